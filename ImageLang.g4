@@ -3,8 +3,13 @@ grammar ImageLang;
 // -----------------------------
 // Parser rules
 // -----------------------------
+// A file without a main block is a module that other files can import
 program
-    : top_decl* main_block EOF
+    : import_decl* top_decl* main_block? EOF
+    ;
+
+import_decl
+    : IMPORT STRING_LITERAL SEMI
     ;
 
 top_decl
@@ -208,6 +213,7 @@ RETURN  : 'return';
 TRY     : 'try';
 EXCEPT  : 'except';
 THROW   : 'throw';
+IMPORT  : 'import';
 
 IMAGE_KW : 'image';
 PIXEL_KW : 'pixel';
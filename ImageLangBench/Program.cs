@@ -0,0 +1,189 @@
+using System;
+using System.Collections.Generic;
+using System.Diagnostics;
+using System.Globalization;
+using System.IO;
+using System.Linq;
+using ImageLangRuntime;
+
+namespace ImageLangBench
+{
+    // Times StdLib kernels on synthetic images and compares throughput with a baseline file.
+    //
+    //   ImageLangBench [--sizes 256,1024,1920x1080,3840x2160,7680x4320] [--filter blur] [--threads N]
+    //                  [--min-time 0.5] [--baseline bench-baseline.tsv] [--save-baseline bench-baseline.tsv]
+    //                  [--tolerance 0.15]
+    //
+    // Each case runs once to warm up, then repeatedly for at least --min-time seconds; the median run is
+    // reported as megapixels per second of input together with managed bytes allocated per run.
+    // With --baseline the exit code is 1 when any case is slower than the baseline by more than --tolerance.
+    public static class Program
+    {
+        private class Case
+        {
+            public string Name;
+            public Func<Input, object> Run;
+        }
+
+        // Fresh wrappers per run so per-image caches (stats, lazy nodes) never carry over between runs
+        private class Input
+        {
+            public PixelBuffer A, B;
+            public string Dir;
+            public ImageWrapper ImageA => new ImageWrapper(A);
+            public ImageWrapper ImageB => new ImageWrapper(B);
+        }
+
+        private class Result
+        {
+            public string Key;
+            public double Millis, MegapixelsPerSecond, AllocatedMB;
+        }
+
+        private static readonly string[] DefaultSizes = { "256", "1024", "1920x1080", "3840x2160", "7680x4320" };
+        private static readonly string[] FileFormats = { "ilraw", "ppm", "png" };
+
+        public static int Main(string[] args) {
+            var opts = ParseArgs(args);
+            string[] sizes = opts.TryGetValue("sizes", out string s) ? s.Split(',') : DefaultSizes;
+            string filter = opts.TryGetValue("filter", out string f) ? f : null;
+            double minTime = opts.TryGetValue("min-time", out string mt) ? double.Parse(mt, CultureInfo.InvariantCulture) : 0.5;
+            double tolerance = opts.TryGetValue("tolerance", out string tol) ? double.Parse(tol, CultureInfo.InvariantCulture) : 0.15;
+            if (opts.TryGetValue("threads", out string th)) Parallelism.SetThreads(int.Parse(th));
+
+            // Measure the kernels, not the result cache
+            ResultCache.Budget = 0;
+            AppDomain.MonitoringIsEnabled = true;
+
+            string dir = Path.Combine(Path.GetTempPath(), "imagelang-bench-" + Process.GetCurrentProcess().Id);
+            Directory.CreateDirectory(dir);
+            var results = new List<Result>();
+            try {
+                Console.WriteLine($"threads={Parallelism.Threads} simd={System.Numerics.Vector.IsHardwareAccelerated} lanes={System.Numerics.Vector<byte>.Count}");
+                Console.WriteLine($"{"case",-24} {"size",-11} {"ms",10} {"MP/s",10} {"alloc MB",10}");
+                foreach (string size in sizes) {
+                    ParseSize(size, out int w, out int h);
+                    var input = new Input { A = Synthetic(w, h, 1), B = Synthetic(w, h, 2), Dir = dir };
+                    foreach (string ext in FileFormats) StdLib.save(input.ImageA, Path.Combine(dir, "a." + ext));
+                    foreach (Case c in Cases()) {
+                        if (filter != null && !c.Name.Contains(filter)) continue;
+                        Result r = Measure(c, input, w, h, minTime);
+                        results.Add(r);
+                        Console.WriteLine($"{c.Name,-24} {w + "x" + h,-11} {r.Millis,10:F2} {r.MegapixelsPerSecond,10:F1} {r.AllocatedMB,10:F2}");
+                    }
+                }
+            } finally {
+                Directory.Delete(dir, true);
+            }
+            Console.WriteLine(BufferPool.Report());
+
+            if (opts.TryGetValue("save-baseline", out string save)) {
+                SaveBaseline(save, results);
+                Console.WriteLine($"Baseline written to {save}");
+            }
+            if (opts.TryGetValue("baseline", out string baseline)) return Compare(baseline, results, tolerance);
+            return 0;
+        }
+
+        private static IEnumerable<Case> Cases() {
+            foreach (double r in new[] { 1.0, 3.0, 8.0, 20.0 })
+                yield return new Case { Name = $"blur r={r}", Run = i => StdLib.blur(i.ImageA, r).Pixels };
+            foreach (double sigma in new[] { 2.0, 8.0 })
+                yield return new Case { Name = $"gauss_blur s={sigma}", Run = i => StdLib.gauss_blur(i.ImageA, sigma).Pixels };
+            yield return new Case { Name = "pow_channels 2.2", Run = i => StdLib.pow_channels(i.ImageA, 2.2).Pixels };
+            yield return new Case { Name = "add_images", Run = i => StdLib.add_images(i.ImageA, i.ImageB).Pixels };
+            yield return new Case { Name = "sub_images", Run = i => StdLib.sub_images(i.ImageA, i.ImageB).Pixels };
+            yield return new Case { Name = "mul_image_scalar 1.5", Run = i => StdLib.mul_image_scalar(i.ImageA, 1.5).Pixels };
+            yield return new Case { Name = "avg", Run = i => StdLib.avg(i.ImageA) };
+            yield return new Case { Name = "get_pixel(blur r=3)", Run = i => StdLib.get_pixel(StdLib.blur(i.ImageA, 3.0), 7, 7) };
+            foreach (string ext in FileFormats) {
+                yield return new Case { Name = "save ." + ext, Run = i => { StdLib.save(i.ImageA, Path.Combine(i.Dir, "a." + ext)); return null; } };
+                yield return new Case { Name = "load ." + ext, Run = i => StdLib.load(Path.Combine(i.Dir, "a." + ext)).Pixels };
+            }
+        }
+
+        private static Result Measure(Case c, Input input, int w, int h, double minTime) {
+            c.Run(input);
+            var times = new List<double>();
+            long allocated = 0;
+            var total = Stopwatch.StartNew();
+            do {
+                GC.Collect();
+                GC.WaitForPendingFinalizers();
+                long before = AppDomain.CurrentDomain.MonitoringTotalAllocatedMemorySize;
+                var sw = Stopwatch.StartNew();
+                c.Run(input);
+                sw.Stop();
+                allocated += AppDomain.CurrentDomain.MonitoringTotalAllocatedMemorySize - before;
+                times.Add(sw.Elapsed.TotalMilliseconds);
+            } while (total.Elapsed.TotalSeconds < minTime || times.Count < 3);
+
+            times.Sort();
+            double median = times[times.Count / 2];
+            return new Result {
+                Key = $"{c.Name}@{w}x{h}",
+                Millis = median,
+                MegapixelsPerSecond = (double)w * h / 1e6 / (median / 1000),
+                AllocatedMB = allocated / (double)times.Count / (1024 * 1024),
+            };
+        }
+
+        // Deterministic gradient plus noise, so kernels see neither constant nor random-only data
+        private static PixelBuffer Synthetic(int w, int h, int seed) {
+            var buf = new PixelBuffer(w, h);
+            var rng = new Random(seed);
+            byte[] d = buf.Data;
+            for (int y = 0; y < h; y++) {
+                for (int x = 0, o = y * buf.Stride; x < w; x++, o += PixelBuffer.BytesPerPixel) {
+                    int noise = rng.Next(32);
+                    d[o + PixelBuffer.R] = (byte)((x * 255 / Math.Max(1, w - 1) + noise) & 255);
+                    d[o + PixelBuffer.G] = (byte)((y * 255 / Math.Max(1, h - 1) + noise) & 255);
+                    d[o + PixelBuffer.B] = (byte)(((x + y) * seed + noise) & 255);
+                    d[o + PixelBuffer.A] = 255;
+                }
+            }
+            return buf;
+        }
+
+        private static void ParseSize(string size, out int w, out int h) {
+            string[] parts = size.Split('x');
+            w = int.Parse(parts[0]);
+            h = parts.Length > 1 ? int.Parse(parts[1]) : w;
+        }
+
+        private static Dictionary<string, string> ParseArgs(string[] args) {
+            var opts = new Dictionary<string, string>();
+            for (int i = 0; i < args.Length; i++) {
+                if (!args[i].StartsWith("--")) throw new ArgumentException("Unexpected argument: " + args[i]);
+                opts[args[i].Substring(2)] = i + 1 < args.Length && !args[i + 1].StartsWith("--") ? args[++i] : "";
+            }
+            return opts;
+        }
+
+        // Baseline format: one "key<TAB>MP/s" line per case
+        private static void SaveBaseline(string path, List<Result> results) {
+            File.WriteAllLines(path, results.Select(r =>
+                r.Key + "\t" + r.MegapixelsPerSecond.ToString("R", CultureInfo.InvariantCulture)));
+        }
+
+        private static int Compare(string path, List<Result> results, double tolerance) {
+            var baseline = new Dictionary<string, double>();
+            foreach (string line in File.ReadAllLines(path)) {
+                string[] parts = line.Split('\t');
+                if (parts.Length == 2) baseline[parts[0]] = double.Parse(parts[1], CultureInfo.InvariantCulture);
+            }
+
+            int regressions = 0;
+            Console.WriteLine($"Comparing with {path} (tolerance {tolerance:P0})");
+            foreach (Result r in results) {
+                if (!baseline.TryGetValue(r.Key, out double old)) continue;
+                double change = r.MegapixelsPerSecond / old - 1;
+                bool regressed = change < -tolerance;
+                if (regressed) regressions++;
+                Console.WriteLine($"{(regressed ? "REGRESSION" : "ok"),-10} {r.Key,-36} {old,10:F1} -> {r.MegapixelsPerSecond,10:F1} MP/s ({change:+0.0%;-0.0%})");
+            }
+            Console.WriteLine(regressions == 0 ? "No regressions." : $"{regressions} regression(s).");
+            return regressions == 0 ? 0 : 1;
+        }
+    }
+}
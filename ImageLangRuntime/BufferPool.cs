@@ -0,0 +1,68 @@
+using System;
+using System.Collections.Generic;
+
+namespace ImageLangRuntime
+{
+    // Size-keyed pool of pixel arrays. PixelBuffers rent their Data here and hand it back when their
+    // image is disposed, so loops producing one same-sized image per iteration reuse a few arrays instead
+    // of allocating a new one each time. IMAGELANG_POOL_MB caps the bytes kept idle (default 128,
+    // 0 disables pooling), IMAGELANG_POOL_STATS=1 prints counters at exit.
+    public static class BufferPool
+    {
+        private static readonly object sync = new object();
+        private static readonly Dictionary<int, Stack<byte[]>> free = new Dictionary<int, Stack<byte[]>>();
+
+        public static long Limit { get; set; } = ReadLimit();
+        public static long RetainedBytes { get; private set; }
+        public static long Rents { get; private set; }
+        public static long Reuses { get; private set; }
+        public static long Returns { get; private set; }
+        public static long Drops { get; private set; }
+
+        public static bool Enabled => Limit > 0;
+
+        static BufferPool() {
+            if (Environment.GetEnvironmentVariable("IMAGELANG_POOL_STATS") == "1")
+                AppDomain.CurrentDomain.ProcessExit += (s, e) => Console.Error.WriteLine(Report());
+        }
+
+        private static long ReadLimit() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_POOL_MB");
+            if (long.TryParse(env, out long mb)) return Math.Max(0, mb) * 1024 * 1024;
+            return 128L * 1024 * 1024;
+        }
+
+        // Contents of a reused array are unspecified unless clear is set
+        public static byte[] Rent(int length, bool clear) {
+            lock (sync) {
+                Rents++;
+                if (free.TryGetValue(length, out var stack) && stack.Count > 0) {
+                    byte[] data = stack.Pop();
+                    RetainedBytes -= length;
+                    Reuses++;
+                    if (clear) Array.Clear(data, 0, length);
+                    return data;
+                }
+            }
+            return new byte[length];
+        }
+
+        public static void Return(byte[] data) {
+            if (data == null || data.Length == 0) return;
+            lock (sync) {
+                if (RetainedBytes + data.Length > Limit) { Drops++; return; }
+                if (!free.TryGetValue(data.Length, out var stack)) free[data.Length] = stack = new Stack<byte[]>();
+                stack.Push(data);
+                RetainedBytes += data.Length;
+                Returns++;
+            }
+        }
+
+        public static void Clear() {
+            lock (sync) { free.Clear(); RetainedBytes = 0; }
+        }
+
+        public static string Report() =>
+            $"[BufferPool] rents={Rents} reuses={Reuses} returns={Returns} drops={Drops} retained={RetainedBytes}/{Limit}";
+    }
+}
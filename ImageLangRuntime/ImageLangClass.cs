@@ -1,18 +1,188 @@
 ﻿using System;
+using System.Collections.Generic;
 using System.Drawing;
 using System.IO;
+using System.Numerics;
+using System.Threading;
+using System.Threading.Tasks;
 
 namespace ImageLangRuntime
 {
-    public class ImageWrapper
+    public class ImageWrapper : IDisposable
     {
-        public Bitmap Bitmap { get; private set; }
+        private static long nextId;
+
+        // Either representation is produced from the other on first use; kernels only touch Pixels.
+        // Results of lazy builtins start with only a node and compute rows or the whole buffer on demand;
+        // images too large for memory live in a TiledImage and are streamed through Rows instead.
+        private Bitmap bitmap;
+        private PixelBuffer pixels;
+        private ImageNode node;
+        private TiledImage tiled;
+
+        public Bitmap Bitmap => bitmap ?? (bitmap = Pixels.ToBitmap());
+        public int Width => pixels?.Width ?? bitmap?.Width ?? tiled?.Width ?? node.Width;
+        public int Height => pixels?.Height ?? bitmap?.Height ?? tiled?.Height ?? node.Height;
+        public bool IsMaterialized => node == null;
+        internal bool OnlyBitmap => pixels == null && bitmap != null;
+        public bool IsTiled => tiled != null || (node != null && node.PrefersTiles);
+        internal int Depth => node?.Depth ?? 0;
+
+        // Whole image in memory; for a tiled image this assembles every strip
+        public PixelBuffer Pixels {
+            get {
+                if (pixels == null) {
+                    if (bitmap != null) pixels = PixelBuffer.FromBitmap(bitmap);
+                    else if (node != null) Force();
+                    if (pixels == null) pixels = tiled.ToPixelBuffer();
+                }
+                return pixels;
+            }
+        }
+
+        // Row reader over the materialized image, for consumers that visit every row
+        public RowReader Rows {
+            get {
+                if (node != null) Force();
+                return tiled != null ? (RowReader)tiled.Row : Pixels.Row;
+            }
+        }
+
+        // Row y as (array, offset) without materializing the whole image when it is still lazy
+        public byte[] ReadRow(int y, out int offset) {
+            if (node != null) {
+                lock (forcing) {
+                    if (node != null && node.Depth <= ImageNode.MaxRowDepth) {
+                        offset = 0;
+                        return node.Row(y);
+                    }
+                }
+            }
+            return Rows(y, out offset);
+        }
+
+        // SaveQueue forces images on the thread pool that the script may be reading or forcing too, so
+        // forcing and reads through a pending node take this lock. Inputs are forced before their
+        // consumers, so the kernels a Force runs only read materialized images and never take it.
+        private static readonly object forcing = new object();
+
+        // Materializes pending inputs oldest first, so a long chain of lazy results is not forced recursively
+        private void Force() {
+            lock (forcing) {
+                if (node != null) ForceLocked();
+            }
+        }
+
+        private void ForceLocked() {
+            var order = new List<ImageWrapper>();
+            var visited = new HashSet<ImageWrapper> { this };
+            var stack = new Stack<ImageWrapper>();
+            stack.Push(this);
+            while (stack.Count > 0) {
+                ImageWrapper top = stack.Peek();
+                bool ready = true;
+                foreach (ImageWrapper input in top.node.Inputs) {
+                    if (input.node != null && visited.Add(input)) { stack.Push(input); ready = false; }
+                }
+                if (ready) order.Add(stack.Pop());
+            }
+            foreach (ImageWrapper w in order) {
+                ImageNode done = w.node;
+                if (done.PrefersTiles) w.tiled = done.MaterializeTiled();
+                else w.pixels = done.Materialize();
+                w.node = null;
+                foreach (ImageWrapper input in done.Inputs) input.Unhold();
+            }
+        }
+
+        // Ownership, so pooled buffers go back to BufferPool deterministically. Handouts count how often
+        // Ops gave the image to the script; holds count runtime owners (lazy nodes reading it, ResultCache,
+        // SaveQueue). The compiler gives a handout back through Release() only for builtin results consumed
+        // by another builtin, so an image stored in a variable is never disposed. Intermediates built
+        // inside a kernel are abandoned right away. An image released or abandoned is disposed once it is
+        // neither handed out nor held.
+        private readonly object owners = new object();
+        private int handouts, holds;
+        private bool abandoned, disposed;
+
+        internal ImageWrapper Handout() {
+            lock (owners) handouts++;
+            return this;
+        }
+
+        internal void Hold() { lock (owners) holds++; }
+
+        internal void Unhold() => Drop(() => holds--);
+
+        public void Release() => Drop(() => { if (handouts > 0) handouts--; abandoned = true; });
+
+        internal void Abandon() => Drop(() => abandoned = true);
+
+        private void Drop(Action change) {
+            bool dead;
+            lock (owners) {
+                change();
+                dead = abandoned && !disposed && handouts == 0 && holds == 0;
+            }
+            if (dead) Dispose();
+        }
+
+        // Returns the pixels to the pool and lets go of the inputs of a node that was never forced
+        public void Dispose() {
+            ImageNode pending;
+            lock (owners) {
+                if (disposed) return;
+                disposed = true;
+                pending = node;
+                node = null;
+            }
+            pixels?.Dispose();
+            pixels = null;
+            bitmap?.Dispose();
+            bitmap = null;
+            tiled?.Dispose();
+            tiled = null;
+            if (pending != null) foreach (ImageWrapper input in pending.Inputs) input.Unhold();
+        }
+
+        // Identity used by ResultCache. Images are never modified after creation, so results keyed by
+        // Id, and the statistics below, stay valid for the image's lifetime.
+        public long Id { get; } = Interlocked.Increment(ref nextId);
+        public long SizeInBytes => (long)Width * Height * PixelBuffer.BytesPerPixel;
+
+        // Computed on first use
+        private ImageStats stats;
+        private long[] summedArea;
+
+        public ImageStats Stats => stats ?? (stats = ImageStats.Compute(Width, Height, Rows));
+
+        public long[] SummedArea => summedArea ?? (summedArea = ImageStats.SummedArea(Pixels));
+
         public ImageWrapper(string path) {
             if (!File.Exists(path)) throw new FileNotFoundException("File not found: " + path);
-            Bitmap = new Bitmap(path);
+            bitmap = new Bitmap(path);
+        }
+        public ImageWrapper(int w, int h) { pixels = new PixelBuffer(w, h); }
+        public ImageWrapper(Bitmap bmp) { bitmap = bmp; }
+        public ImageWrapper(PixelBuffer buf) { pixels = buf; }
+        public ImageWrapper(ImageNode node) { this.node = node; }
+        public ImageWrapper(TiledImage tiled) { this.tiled = tiled; }
+
+        // A tiled image is copied strip by strip, since each wrapper disposes its own TiledImage
+        public ImageWrapper Clone() {
+            if (bitmap != null) return new ImageWrapper((Bitmap)bitmap.Clone());
+            if (IsTiled) {
+                RowReader rows = Rows;
+                int stride = Width * PixelBuffer.BytesPerPixel;
+                return new ImageWrapper(TiledImage.Build(Width, Height, (y0, y1, data) => {
+                    for (int y = y0; y < y1; y++) {
+                        byte[] s = rows(y, out int start);
+                        Buffer.BlockCopy(s, start, data, (y - y0) * stride, stride);
+                    }
+                }));
+            }
+            return new ImageWrapper(Pixels.Clone());
         }
-        public ImageWrapper(int w, int h) { Bitmap = new Bitmap(w, h); }
-        public ImageWrapper(Bitmap bmp) { Bitmap = bmp; }
     }
 
     public struct LangColor {
@@ -33,29 +203,35 @@ namespace ImageLangRuntime
         public static object CreateImage(object w, object h) {
             int width = (int)Convert.ToDouble(w);
             int height = (int)Convert.ToDouble(h);
-            return new ImageWrapper(new Bitmap(width, height));
+            return new ImageWrapper(width, height).Handout();
         }
 
+        // Images returned to the script count as handed out; see ImageWrapper.Release
+        private static object Out(ImageWrapper img) => img?.Handout();
+
+        // Called by compiled code on a builtin's image result once the builtin consuming it has returned
+        public static void Release(object img) => (img as ImageWrapper)?.Release();
+
         public static object Add(object a, object b) {
             if (a is string || b is string) return $"{a}{b}";
-            if (a is ImageWrapper i1 && b is ImageWrapper i2) return StdLib.add_images(i1, i2);
+            if (a is ImageWrapper i1 && b is ImageWrapper i2) return Out(StdLib.add_images(i1, i2));
             double r = ToDouble(a) + ToDouble(b);
             return IsInt(a) && IsInt(b) ? (object)(int)r : r;
         }
 
         public static object Sub(object a, object b) {
-            if (a is ImageWrapper i1 && b is ImageWrapper i2) return StdLib.sub_images(i1, i2);
+            if (a is ImageWrapper i1 && b is ImageWrapper i2) return Out(StdLib.sub_images(i1, i2));
             
-            if (a is ImageWrapper && b == null) { Console.WriteLine("[Runtime Error] Sub: second image is null!"); return a; }
-            if (a == null && b is ImageWrapper) { Console.WriteLine("[Runtime Error] Sub: first image is null!"); return b; }
+            if (a is ImageWrapper ia && b == null) { Console.WriteLine("[Runtime Error] Sub: second image is null!"); return Out(ia); }
+            if (a == null && b is ImageWrapper ib) { Console.WriteLine("[Runtime Error] Sub: first image is null!"); return Out(ib); }
 
             double r = ToDouble(a) - ToDouble(b);
             return IsInt(a) && IsInt(b) ? (object)(int)r : r;
         }
 
         public static object Mul(object a, object b) {
-            if (a is ImageWrapper i && IsNum(b)) return StdLib.mul_image_scalar(i, ToDouble(b));
-            if (b is ImageWrapper i2 && IsNum(a)) return StdLib.mul_image_scalar(i2, ToDouble(a));
+            if (a is ImageWrapper i && IsNum(b)) return Out(StdLib.mul_image_scalar(i, ToDouble(b)));
+            if (b is ImageWrapper i2 && IsNum(a)) return Out(StdLib.mul_image_scalar(i2, ToDouble(a)));
             double r = ToDouble(a) * ToDouble(b);
             return IsInt(a) && IsInt(b) ? (object)(int)r : r;
         }
@@ -82,20 +258,149 @@ namespace ImageLangRuntime
             return a.Equals(b);
         }
 
-        public static object Load(object path) => StdLib.load(path?.ToString());
-        public static void Save(object img, object path) => StdLib.save(img as ImageWrapper, path?.ToString());
-        public static object Pow(object img, object g) => StdLib.pow_channels(img as ImageWrapper, ToDouble(g));
-        public static object Blur(object img, object r) => StdLib.blur(img as ImageWrapper, ToDouble(r));
+        public static object Load(object path) {
+            string p = path?.ToString();
+            SaveQueue.WaitFor(p);
+            return Out(Prefetch.TryTake(p, out ImageWrapper img) ? img : StdLib.load(p));
+        }
+
+        public static void Save(object img, object path) {
+            string p = path?.ToString();
+            Prefetch.Invalidate(p);
+            SaveQueue.WaitFor(p);
+            StdLib.save(img as ImageWrapper, p);
+        }
+
+        public static void SaveAsync(object img, object path) {
+            string p = path?.ToString();
+            Prefetch.Invalidate(p);
+            SaveQueue.Enqueue(img as ImageWrapper, p);
+        }
+
+        public static object Pow(object img, object g) => Out(StdLib.pow_channels(img as ImageWrapper, ToDouble(g)));
+        public static object Blur(object img, object r) => Out(StdLib.blur(img as ImageWrapper, ToDouble(r)));
+        public static object GaussBlur(object img, object sigma) => Out(StdLib.gauss_blur(img as ImageWrapper, ToDouble(sigma)));
         public static object Width(object img) => StdLib.width(img as ImageWrapper);
         public static object Height(object img) => StdLib.height(img as ImageWrapper);
         public static object GetPixel(object img, object x, object y) => StdLib.get_pixel(img as ImageWrapper, (int)ToDouble(x), (int)ToDouble(y));
         public static double Avg(object img) => StdLib.avg(img as ImageWrapper);
+        public static double AvgRegion(object img, object x, object y, object w, object h) =>
+            StdLib.avg_region(img as ImageWrapper, (int)ToDouble(x), (int)ToDouble(y), (int)ToDouble(w), (int)ToDouble(h));
+        public static object SetThreads(object n) { Parallelism.SetThreads((int)ToDouble(n)); return null; }
 
         private static double ToDouble(object o) => Convert.ToDouble(o);
         private static bool IsInt(object o) => o is int;
         private static bool IsNum(object o) => o is int || o is double || o is float;
     }
 
+    // Byte-budgeted LRU of results of pure image builtins, keyed by (op, image id, arg).
+    // IMAGELANG_CACHE_MB sets the budget (0 disables), IMAGELANG_CACHE_STATS=1 prints counters at exit.
+    public static class ResultCache
+    {
+        private struct Key : IEquatable<Key>
+        {
+            public string Op; public long Id; public double Arg;
+            public bool Equals(Key o) => Op == o.Op && Id == o.Id && Arg.Equals(o.Arg);
+            public override bool Equals(object o) => o is Key k && Equals(k);
+            public override int GetHashCode() => (Op.GetHashCode() * 31 + Id.GetHashCode()) * 31 + Arg.GetHashCode();
+        }
+
+        private class Entry { public Key Key; public object Value; public long Bytes; }
+
+        private static readonly object sync = new object();
+        private static readonly LinkedList<Entry> lru = new LinkedList<Entry>();
+        private static readonly Dictionary<Key, LinkedListNode<Entry>> map = new Dictionary<Key, LinkedListNode<Entry>>();
+
+        public static long Budget { get; set; } = ReadBudget();
+        public static long Bytes { get; private set; }
+        public static long Hits { get; private set; }
+        public static long Misses { get; private set; }
+        public static long Evictions { get; private set; }
+
+        static ResultCache() {
+            if (Environment.GetEnvironmentVariable("IMAGELANG_CACHE_STATS") == "1")
+                AppDomain.CurrentDomain.ProcessExit += (s, e) => Console.Error.WriteLine(Report());
+        }
+
+        private static long ReadBudget() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_CACHE_MB");
+            if (long.TryParse(env, out long mb)) return Math.Max(0, mb) * 1024 * 1024;
+            return 256L * 1024 * 1024;
+        }
+
+        public static T GetOrCompute<T>(string op, ImageWrapper img, double arg, Func<T> compute) {
+            if (img == null || Budget <= 0) return compute();
+            var key = new Key { Op = op, Id = img.Id, Arg = arg };
+            lock (sync) {
+                if (map.TryGetValue(key, out var node)) {
+                    lru.Remove(node);
+                    lru.AddFirst(node);
+                    Hits++;
+                    return (T)node.Value.Value;
+                }
+                Misses++;
+            }
+
+            T value = compute();
+            long bytes = value is ImageWrapper w ? w.SizeInBytes : 16;
+            if (bytes > Budget) return value;
+
+            lock (sync) {
+                if (map.ContainsKey(key)) return value;
+                var node = lru.AddFirst(new Entry { Key = key, Value = value, Bytes = bytes });
+                map[key] = node;
+                (value as ImageWrapper)?.Hold();
+                Bytes += bytes;
+                while (Bytes > Budget && lru.Last != null) {
+                    var last = lru.Last;
+                    lru.RemoveLast();
+                    map.Remove(last.Value.Key);
+                    Bytes -= last.Value.Bytes;
+                    (last.Value.Value as ImageWrapper)?.Unhold();
+                    Evictions++;
+                }
+            }
+            return value;
+        }
+
+        public static void Clear() {
+            lock (sync) {
+                foreach (Entry e in lru) (e.Value as ImageWrapper)?.Unhold();
+                lru.Clear(); map.Clear(); Bytes = 0;
+            }
+        }
+
+        public static string Report() =>
+            $"[ResultCache] hits={Hits} misses={Misses} evictions={Evictions} bytes={Bytes}/{Budget}";
+    }
+
+    // Row-band partitioning for StdLib kernels. Every row is computed independently, so the
+    // result does not depend on the number of bands. IMAGELANG_THREADS or set_threads(n) sets
+    // the degree of parallelism; images below MinPixels stay on the calling thread.
+    public static class Parallelism
+    {
+        public static int Threads { get; set; } = ReadThreads();
+        public static long MinPixels { get; set; } = 256 * 256;
+
+        private static int ReadThreads() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_THREADS");
+            return int.TryParse(env, out int n) && n > 0 ? n : Environment.ProcessorCount;
+        }
+
+        public static void SetThreads(int n) => Threads = n > 0 ? n : ReadThreads();
+
+        public static int BandCount(int width, int height) =>
+            (long)width * height < MinPixels ? 1 : Math.Max(1, Math.Min(Threads, height));
+
+        // Calls body(y0, y1) for consecutive row ranges [y0, y1) covering [0, height)
+        public static void ForRows(int width, int height, Action<int, int> body) {
+            int bands = BandCount(width, height);
+            if (bands == 1) { body(0, height); return; }
+            Parallel.For(0, bands, new ParallelOptions { MaxDegreeOfParallelism = Threads },
+                i => body((int)((long)height * i / bands), (int)((long)height * (i + 1) / bands)));
+        }
+    }
+
     public static class StdLib
     {
         public static void write(object obj) => Console.WriteLine(obj?.ToString() ?? "null");
@@ -115,125 +420,256 @@ namespace ImageLangRuntime
         }
 
         public static ImageWrapper load(string path) {
-            try { return new ImageWrapper(path); } catch { return null; }
+            try {
+                return RawImageIO.Handles(path) ? RawImageIO.Load(path) : new ImageWrapper(path);
+            } catch { return null; }
         }
         public static void save(ImageWrapper img, string path) {
-            if (img != null) img.Bitmap.Save(path);
+            if (img == null) return;
+            if (RawImageIO.Handles(path)) RawImageIO.Save(img, path);
+            else img.Bitmap.Save(path);
         }
-        public static int width(ImageWrapper img) => img?.Bitmap.Width ?? 0;
-        public static int height(ImageWrapper img) => img?.Bitmap.Height ?? 0;
+        // Reader behind compiled pixel reads; a null image has no pixels, as width/height report 0 for it
+        private static readonly PixelReader NoPixels = new PixelReader(new PixelBuffer(0, 0, new byte[0]));
+        public static PixelReader pixels_of(ImageWrapper img) => img == null ? NoPixels : new PixelReader(img);
+
+        public static int width(ImageWrapper img) => img?.Width ?? 0;
+        public static int height(ImageWrapper img) => img?.Height ?? 0;
         
         public static LangColor get_pixel(ImageWrapper img, int x, int y) {
             if (img == null) return new LangColor();
-            Color c = img.Bitmap.GetPixel(x, y);
-            return new LangColor(c.R, c.G, c.B);
+            if (x < 0 || x >= img.Width) throw new ArgumentOutOfRangeException(nameof(x));
+            if (y < 0 || y >= img.Height) throw new ArgumentOutOfRangeException(nameof(y));
+            byte[] row = img.ReadRow(y, out int i);
+            i += x * PixelBuffer.BytesPerPixel;
+            return new LangColor(row[i + PixelBuffer.R], row[i + PixelBuffer.G], row[i + PixelBuffer.B]);
         }
 
         public static ImageWrapper pow_channels(ImageWrapper img, double gamma) {
             if (img == null) return null;
-            Bitmap res = new Bitmap(img.Bitmap.Width, img.Bitmap.Height);
-            for(int x=0;x<res.Width;x++) for(int y=0;y<res.Height;y++) {
-                Color c = img.Bitmap.GetPixel(x, y);
-                res.SetPixel(x, y, Color.FromArgb(Clamp(255 * Math.Pow(c.R/255.0, gamma)), Clamp(255 * Math.Pow(c.G/255.0, gamma)), Clamp(255 * Math.Pow(c.B/255.0, gamma))));
-            }
-            return new ImageWrapper(res);
+            return ResultCache.GetOrCompute("pow_channels", img, gamma, () => new ImageWrapper(new LutNode(img, PowLut(gamma))));
+        }
+
+        // Output depends only on the input byte, so Math.Pow runs 256 times instead of 3 per pixel
+        private static byte[] PowLut(double gamma) {
+            var lut = new byte[256];
+            for (int c = 0; c < 256; c++) lut[c] = (byte)Clamp(255 * Math.Pow(c / 255.0, gamma));
+            return lut;
         }
 
         public static ImageWrapper blur(ImageWrapper img, double r)
         {
             if (img == null) return null;
-            
-            
+            return ResultCache.GetOrCompute("blur", img, r, () => Blur(img, r));
+        }
+
+        private static ImageWrapper Blur(ImageWrapper img, double r)
+        {
             int radius = (int)Math.Ceiling(r);
-            if (radius < 1) return new ImageWrapper((Bitmap)img.Bitmap.Clone());
+            if (radius < 1) return img.Clone();
+            return new ImageWrapper(new BoxBlurNode(img, radius));
+        }
+
+        // Approximate Gaussian: three box passes whose widths match the variance of sigma (Wells, 1986)
+        public static ImageWrapper gauss_blur(ImageWrapper img, double sigma)
+        {
+            if (img == null) return null;
+            return ResultCache.GetOrCompute("gauss_blur", img, sigma, () => GaussBlur(img, sigma));
+        }
+
+        private static ImageWrapper GaussBlur(ImageWrapper img, double sigma)
+        {
+            const int passes = 3;
+            if (sigma <= 0) return img.Clone();
+            int wl = (int)Math.Floor(Math.Sqrt(12 * sigma * sigma / passes + 1));
+            if (wl % 2 == 0) wl--;
+            int m = (int)Math.Round((12 * sigma * sigma - passes * wl * wl - 4 * passes * wl - 3 * passes) / (-4.0 * wl - 4));
 
-            Bitmap src = img.Bitmap;
-            Bitmap dest = new Bitmap(src.Width, src.Height);
+            ImageWrapper result = img;
+            for (int i = 0; i < passes; i++) {
+                int radius = ((i < m ? wl : wl + 2) - 1) / 2;
+                if (radius <= 0) continue;
+                ImageWrapper pass = new ImageWrapper(new BoxBlurNode(result, radius));
+                // Only the next pass reads an intermediate, so it is freed when that pass is forced
+                if (result != img) result.Abandon();
+                result = pass;
+            }
+            return result == img ? img.Clone() : result;
+        }
 
-            for (int x = 0; x < src.Width; x++)
+        // Mean over the in-bounds part of the (2r+1)^2 window, computed as a horizontal running sum
+        // per row followed by a vertical running sum per column: O(1) work per pixel for any radius.
+        internal static PixelBuffer BoxBlur(PixelBuffer src, int radius)
+        {
+            int w = src.Width, h = src.Height;
+            var dst = PixelBuffer.Rent(w, h);
+            int[] countX = WindowCounts(w, radius);
+            Parallelism.ForRows(w, h, (y0, y1) => BoxBlurRows(src.Row, w, h, dst.Data, y0 * dst.Stride, radius, countX, y0, y1));
+            return dst;
+        }
+
+        // Output rows [y0, y1) go to d starting at offset o; the window reads source rows y0 - r .. y1 + r - 1,
+        // so a band or tile only needs its halo rows from the source, wherever they are stored.
+        internal static void BoxBlurRows(RowReader src, int w, int h, byte[] d, int o, int radius, int[] countX, int y0, int y1)
+        {
+            int stride = w * PixelBuffer.BytesPerPixel;
+            var colSum = new long[w * 3];
+            var row = new int[w * 3];
+            for (int ky = Math.Max(0, y0 - radius); ky <= Math.Min(h - 1, y0 + radius); ky++) AccumulateRow(src, w, ky, radius, row, colSum, 1);
+
+            for (int y = y0; y < y1; y++, o += stride)
             {
-                for (int y = 0; y < src.Height; y++)
-                {
-                    long rSum = 0, gSum = 0, bSum = 0;
-                    int count = 0;
-
-                    for (int kx = x - radius; kx <= x + radius; kx++)
-                    {
-                        for (int ky = y - radius; ky <= y + radius; ky++)
-                        {
-                            if (kx >= 0 && kx < src.Width && ky >= 0 && ky < src.Height)
-                            {
-                                Color c = src.GetPixel(kx, ky);
-                                rSum += c.R;
-                                gSum += c.G;
-                                bSum += c.B;
-                                count++;
-                            }
-                        }
-                    }
+                int countY = Math.Min(h - 1, y + radius) - Math.Max(0, y - radius) + 1;
+                WriteMeans(colSum, countX, countY, d, o);
+                if (y + 1 == y1) break;
+                if (y + radius + 1 < h) AccumulateRow(src, w, y + radius + 1, radius, row, colSum, 1);
+                if (y - radius >= 0) AccumulateRow(src, w, y - radius, radius, row, colSum, -1);
+            }
+        }
+
+        internal static int[] WindowCounts(int w, int radius)
+        {
+            var countX = new int[w];
+            for (int x = 0; x < w; x++) countX[x] = Math.Min(w - 1, x + radius) - Math.Max(0, x - radius) + 1;
+            return countX;
+        }
+
+        // Writes one output row of window means from per-column channel sums
+        internal static void WriteMeans(long[] colSum, int[] countX, int countY, byte[] d, int o)
+        {
+            for (int x = 0; x < countX.Length; x++, o += PixelBuffer.BytesPerPixel)
+            {
+                int count = countX[x] * countY;
+                d[o] = (byte)(colSum[x * 3] / count);
+                d[o + 1] = (byte)(colSum[x * 3 + 1] / count);
+                d[o + 2] = (byte)(colSum[x * 3 + 2] / count);
+                d[o + 3] = 255;
+            }
+        }
 
-                    
-                    dest.SetPixel(x, y, Color.FromArgb(
-                        (int)(rSum / count),
-                        (int)(gSum / count),
-                        (int)(bSum / count)));
+        // Adds (sign = 1) or removes (sign = -1) the horizontal window sums of row y to the column sums
+        private static void AccumulateRow(RowReader src, int w, int y, int radius, int[] row, long[] colSum, int sign)
+        {
+            byte[] s = src(y, out int start);
+            HorizontalSums(s, start, w, radius, row);
+            for (int i = 0; i < row.Length; i++) colSum[i] += sign * row[i];
+        }
+
+        internal static void HorizontalSums(byte[] s, int start, int w, int radius, int[] row)
+        {
+            int bSum = 0, gSum = 0, rSum = 0;
+            for (int kx = 0; kx <= Math.Min(radius, w - 1); kx++) {
+                int i = start + kx * PixelBuffer.BytesPerPixel;
+                bSum += s[i]; gSum += s[i + 1]; rSum += s[i + 2];
+            }
+            for (int x = 0; x < w; x++)
+            {
+                row[x * 3] = bSum; row[x * 3 + 1] = gSum; row[x * 3 + 2] = rSum;
+                if (x + radius + 1 < w) {
+                    int i = start + (x + radius + 1) * PixelBuffer.BytesPerPixel;
+                    bSum += s[i]; gSum += s[i + 1]; rSum += s[i + 2];
+                }
+                if (x - radius >= 0) {
+                    int i = start + (x - radius) * PixelBuffer.BytesPerPixel;
+                    bSum -= s[i]; gSum -= s[i + 1]; rSum -= s[i + 2];
                 }
             }
-            return new ImageWrapper(dest);
         }
 
         public static double avg(ImageWrapper img) {
-            if (img == null) return 0.0;
-            long sum = 0;
-            int w = img.Bitmap.Width;
-            int h = img.Bitmap.Height;
-            if (w == 0 || h == 0) return 0.0; 
+            if (img == null || img.Width == 0 || img.Height == 0) return 0.0;
+            return img.Stats.Mean;
+        }
 
-            for(int x=0; x<w; x++) for(int y=0; y<h; y++) {
-                Color c = img.Bitmap.GetPixel(x, y);
-                sum += (c.R + c.G + c.B) / 3;
-            }
-            return sum / (double)(w * h);
+        // Mean gray value of the rectangle clipped to the image, O(1) once the summed-area table exists
+        public static double avg_region(ImageWrapper img, int x, int y, int w, int h) {
+            if (img == null) return 0.0;
+            int x0 = Math.Max(0, x), y0 = Math.Max(0, y);
+            int x1 = Math.Min(img.Width, x + w), y1 = Math.Min(img.Height, y + h);
+            if (x1 <= x0 || y1 <= y0) return 0.0;
+            if (img.IsTiled) return ImageStats.RegionSum(img.Rows, x0, y0, x1, y1) / (double)((long)(x1 - x0) * (y1 - y0));
+            long[] sat = img.SummedArea;
+            int n = img.Width + 1;
+            long sum = sat[y1 * n + x1] - sat[y0 * n + x1] - sat[y1 * n + x0] + sat[y0 * n + x0];
+            return sum / (double)((long)(x1 - x0) * (y1 - y0));
         }
 
         public static ImageWrapper add_images(ImageWrapper a, ImageWrapper b) {
             if (a == null) return b; if (b == null) return a;
-            int w = Math.Min(a.Bitmap.Width, b.Bitmap.Width);
-            int h = Math.Min(a.Bitmap.Height, b.Bitmap.Height);
-            Bitmap res = new Bitmap(w, h);
-            for (int x = 0; x < w; x++) for (int y = 0; y < h; y++) {
-                Color c1 = a.Bitmap.GetPixel(x, y);
-                Color c2 = b.Bitmap.GetPixel(x, y);
-                res.SetPixel(x, y, Color.FromArgb(Clamp(c1.R+c2.R), Clamp(c1.G+c2.G), Clamp(c1.B+c2.B)));
-            }
-            return new ImageWrapper(res);
+            return new ImageWrapper(new CombineNode(a, b, false));
         }
 
         public static ImageWrapper sub_images(ImageWrapper a, ImageWrapper b) {
             if (a == null) return null; if (b == null) return a;
-            int w = Math.Min(a.Bitmap.Width, b.Bitmap.Width);
-            int h = Math.Min(a.Bitmap.Height, b.Bitmap.Height);
-            Bitmap res = new Bitmap(w, h);
-            for (int x = 0; x < w; x++) for (int y = 0; y < h; y++) {
-                Color c1 = a.Bitmap.GetPixel(x, y);
-                Color c2 = b.Bitmap.GetPixel(x, y);
-                
-                res.SetPixel(x, y, Color.FromArgb(
-                    Clamp(Math.Abs(c1.R - c2.R)), 
-                    Clamp(Math.Abs(c1.G - c2.G)), 
-                    Clamp(Math.Abs(c1.B - c2.B))));
+            return new ImageWrapper(new CombineNode(a, b, true));
+        }
+
+        private static readonly Vector<byte> AlphaMask = MakeAlphaMask();
+
+        private static Vector<byte> MakeAlphaMask() {
+            var mask = new byte[Vector<byte>.Count];
+            for (int i = PixelBuffer.A; i < mask.Length; i += PixelBuffer.BytesPerPixel) mask[i] = 255;
+            return new Vector<byte>(mask);
+        }
+
+        // Saturating add or absolute difference over the common top-left w x h region of two images,
+        // Vector<byte>.Count channels at a time; alpha is forced to 255 as Color.FromArgb(r, g, b) did.
+        internal static PixelBuffer Combine(PixelBuffer pa, PixelBuffer pb, bool subtract) {
+            int w = Math.Min(pa.Width, pb.Width);
+            int h = Math.Min(pa.Height, pb.Height);
+            var dst = PixelBuffer.Rent(w, h);
+            Parallelism.ForRows(w, h, (y0, y1) => {
+                for (int y = y0; y < y1; y++)
+                    CombineRow(pa.Data, y * pa.Stride, pb.Data, y * pb.Stride, dst.Data, y * dst.Stride, dst.Stride, subtract);
+            });
+            return dst;
+        }
+
+        internal static void CombineRow(byte[] sa, int ia, byte[] sb, int ib, byte[] d, int o, int n, bool subtract) {
+            int lanes = Vector<byte>.Count, i = 0;
+            for (; i <= n - lanes; i += lanes) {
+                var va = new Vector<byte>(sa, ia + i);
+                var vb = new Vector<byte>(sb, ib + i);
+                Vector<byte> r;
+                if (subtract) {
+                    r = Vector.Max(va, vb) - Vector.Min(va, vb);
+                } else {
+                    Vector<byte> sum = va + vb;
+                    r = sum | Vector.LessThan(sum, va);
+                }
+                (r | AlphaMask).CopyTo(d, o + i);
+            }
+            for (; i < n; i += PixelBuffer.BytesPerPixel) {
+                for (int c = 0; c < 3; c++) {
+                    int x1 = sa[ia + i + c], x2 = sb[ib + i + c];
+                    d[o + i + c] = (byte)(subtract ? Math.Abs(x1 - x2) : Math.Min(255, x1 + x2));
+                }
+                d[o + i + 3] = 255;
             }
-            return new ImageWrapper(res);
         }
 
         public static ImageWrapper mul_image_scalar(ImageWrapper img, double v) {
             if (img == null) return null;
-            Bitmap res = new Bitmap(img.Bitmap.Width, img.Bitmap.Height);
-            for(int x=0;x<res.Width;x++) for(int y=0;y<res.Height;y++) {
-                Color c = img.Bitmap.GetPixel(x, y);
-                res.SetPixel(x, y, Color.FromArgb(Clamp(c.R*v), Clamp(c.G*v), Clamp(c.B*v)));
+            var lut = new byte[256];
+            for (int c = 0; c < 256; c++) lut[c] = (byte)Clamp(c * v);
+            return new ImageWrapper(new LutNode(img, lut));
+        }
+
+        internal static PixelBuffer ApplyLut(PixelBuffer src, byte[] lut) {
+            var dst = PixelBuffer.Rent(src.Width, src.Height);
+            Parallelism.ForRows(src.Width, src.Height, (y0, y1) => {
+                for (int y = y0; y < y1; y++) LutRow(src.Data, y * src.Stride, dst.Data, y * dst.Stride, src.Width, lut);
+            });
+            return dst;
+        }
+
+        internal static void LutRow(byte[] s, int si, byte[] d, int di, int width, byte[] lut) {
+            for (int x = 0; x < width; x++, si += PixelBuffer.BytesPerPixel, di += PixelBuffer.BytesPerPixel) {
+                d[di] = lut[s[si]];
+                d[di + 1] = lut[s[si + 1]];
+                d[di + 2] = lut[s[si + 2]];
+                d[di + 3] = 255;
             }
-            return new ImageWrapper(res);
         }
 
         private static int Clamp(double v) => Math.Max(0, Math.Min(255, (int)v));
@@ -0,0 +1,120 @@
+using System;
+using System.Linq;
+
+namespace ImageLangRuntime
+{
+    // Pending result of a lazy builtin (blur, gauss_blur, pow_channels, +, -, * by scalar). Whole-image
+    // consumers (avg, save, other kernels) materialize it through the parallel kernels, or strip by strip
+    // into a TiledImage when it is too large or reads a tiled input; get_pixel only computes and caches
+    // the rows it reads. Rows are produced from the inputs' rows, so a lazy chain is evaluated row by row
+    // up to MaxRowDepth nodes deep, beyond which the image is materialized instead.
+    public abstract class ImageNode
+    {
+        public const int MaxRowDepth = 32;
+
+        private byte[][] rows;
+
+        public int Width { get; }
+        public int Height { get; }
+        public int Depth { get; }
+        public bool PrefersTiles { get; }
+        public ImageWrapper[] Inputs { get; }
+
+        protected ImageNode(int width, int height, params ImageWrapper[] inputs) {
+            Width = width;
+            Height = height;
+            Inputs = inputs;
+            // Released when the node is forced or its image disposed unforced
+            foreach (ImageWrapper input in inputs) input.Hold();
+            Depth = 1 + inputs.Max(i => i.Depth);
+            PrefersTiles = TiledImage.ShouldTile(width, height) || inputs.Any(i => i.IsTiled);
+        }
+
+        public abstract PixelBuffer Materialize();
+
+        protected abstract void ComputeRow(int y, byte[] dst, int offset);
+
+        // Rows [y0, y1) into dst from offset 0; overridden where neighbouring rows share work
+        protected virtual void ComputeRows(int y0, int y1, byte[] dst) {
+            int stride = Width * PixelBuffer.BytesPerPixel;
+            Parallelism.ForRows(Width, y1 - y0, (a, b) => {
+                for (int y = a; y < b; y++) ComputeRow(y0 + y, dst, y * stride);
+            });
+        }
+
+        public TiledImage MaterializeTiled() => TiledImage.Build(Width, Height, ComputeRows);
+
+        public byte[] Row(int y) {
+            if (rows == null) rows = new byte[Height][];
+            if (rows[y] == null) {
+                var row = new byte[Width * PixelBuffer.BytesPerPixel];
+                ComputeRow(y, row, 0);
+                rows[y] = row;
+            }
+            return rows[y];
+        }
+    }
+
+    internal sealed class LutNode : ImageNode
+    {
+        private readonly byte[] lut;
+
+        public LutNode(ImageWrapper src, byte[] lut) : base(src.Width, src.Height, src) { this.lut = lut; }
+
+        public override PixelBuffer Materialize() => StdLib.ApplyLut(Inputs[0].Pixels, lut);
+
+        protected override void ComputeRow(int y, byte[] dst, int offset) {
+            byte[] s = Inputs[0].ReadRow(y, out int si);
+            StdLib.LutRow(s, si, dst, offset, Width, lut);
+        }
+    }
+
+    internal sealed class CombineNode : ImageNode
+    {
+        private readonly bool subtract;
+
+        public CombineNode(ImageWrapper a, ImageWrapper b, bool subtract)
+            : base(Math.Min(a.Width, b.Width), Math.Min(a.Height, b.Height), a, b) { this.subtract = subtract; }
+
+        public override PixelBuffer Materialize() => StdLib.Combine(Inputs[0].Pixels, Inputs[1].Pixels, subtract);
+
+        protected override void ComputeRow(int y, byte[] dst, int offset) {
+            byte[] sa = Inputs[0].ReadRow(y, out int ia);
+            byte[] sb = Inputs[1].ReadRow(y, out int ib);
+            StdLib.CombineRow(sa, ia, sb, ib, dst, offset, Width * PixelBuffer.BytesPerPixel, subtract);
+        }
+    }
+
+    internal sealed class BoxBlurNode : ImageNode
+    {
+        private readonly int radius;
+        private int[] countX;
+
+        public BoxBlurNode(ImageWrapper src, int radius) : base(src.Width, src.Height, src) { this.radius = radius; }
+
+        private int[] CountX => countX ?? (countX = StdLib.WindowCounts(Width, radius));
+
+        public override PixelBuffer Materialize() => StdLib.BoxBlur(Inputs[0].Pixels, radius);
+
+        // One output row needs the horizontal sums of the 2r+1 source rows around it
+        protected override void ComputeRow(int y, byte[] dst, int offset) {
+            var colSum = new long[Width * 3];
+            var sums = new int[Width * 3];
+            int y0 = Math.Max(0, y - radius), y1 = Math.Min(Height - 1, y + radius);
+            for (int ky = y0; ky <= y1; ky++) {
+                byte[] s = Inputs[0].ReadRow(ky, out int start);
+                StdLib.HorizontalSums(s, start, Width, radius, sums);
+                for (int i = 0; i < sums.Length; i++) colSum[i] += sums[i];
+            }
+            StdLib.WriteMeans(colSum, CountX, y1 - y0 + 1, dst, offset);
+        }
+
+        // A strip slides the window down its rows, reading r halo rows above and below it from the input
+        protected override void ComputeRows(int y0, int y1, byte[] dst) {
+            int stride = Width * PixelBuffer.BytesPerPixel;
+            RowReader src = Inputs[0].Rows;
+            Parallelism.ForRows(Width, y1 - y0, (a, b) =>
+                StdLib.BoxBlurRows(src, Width, Height, dst, a * stride, radius, CountX, y0 + a, y0 + b));
+        }
+    }
+}
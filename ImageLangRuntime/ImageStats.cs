@@ -0,0 +1,77 @@
+using System;
+
+namespace ImageLangRuntime
+{
+    // Whole-image statistics over the (R+G+B)/3 gray value that avg has always used,
+    // plus per-channel sums and extrema. Computed once per ImageWrapper.
+    public sealed class ImageStats
+    {
+        public double Mean { get; private set; }
+        public long SumR { get; private set; }
+        public long SumG { get; private set; }
+        public long SumB { get; private set; }
+        public int MinGray { get; private set; }
+        public int MaxGray { get; private set; }
+
+        public static ImageStats Compute(PixelBuffer p) => Compute(p.Width, p.Height, p.Row);
+
+        // Rows are visited once each, so tiled images are streamed strip by strip
+        public static ImageStats Compute(int width, int height, RowReader rows) {
+            var st = new ImageStats { MinGray = 255, MaxGray = 0 };
+            if (width == 0 || height == 0) { st.MinGray = 0; return st; }
+
+            long gray = 0;
+            object sync = new object();
+            int stride = width * PixelBuffer.BytesPerPixel;
+            Parallelism.ForRows(width, height, (y0, y1) => {
+                long g = 0, r = 0, gr = 0, b = 0;
+                int min = 255, max = 0;
+                for (int y = y0; y < y1; y++) {
+                    byte[] s = rows(y, out int start);
+                    for (int i = start, end = start + stride; i < end; i += PixelBuffer.BytesPerPixel) {
+                        int v = (s[i] + s[i + 1] + s[i + 2]) / 3;
+                        g += v;
+                        b += s[i]; gr += s[i + 1]; r += s[i + 2];
+                        if (v < min) min = v;
+                        if (v > max) max = v;
+                    }
+                }
+                lock (sync) {
+                    gray += g;
+                    st.SumR += r; st.SumG += gr; st.SumB += b;
+                    st.MinGray = Math.Min(st.MinGray, min);
+                    st.MaxGray = Math.Max(st.MaxGray, max);
+                }
+            });
+            st.Mean = gray / (double)((long)width * height);
+            return st;
+        }
+
+        // (w+1) x (h+1) table where entry (x, y) is the gray sum of the rectangle [0, x) x [0, y)
+        public static long[] SummedArea(PixelBuffer p) {
+            int w = p.Width, h = p.Height, n = w + 1;
+            var sat = new long[n * (h + 1)];
+            byte[] s = p.Data;
+            for (int y = 0; y < h; y++) {
+                long rowAcc = 0;
+                int i = y * p.Stride;
+                for (int x = 0; x < w; x++, i += PixelBuffer.BytesPerPixel) {
+                    rowAcc += (s[i] + s[i + 1] + s[i + 2]) / 3;
+                    sat[(y + 1) * n + x + 1] = sat[y * n + x + 1] + rowAcc;
+                }
+            }
+            return sat;
+        }
+
+        // Gray sum of [x0, x1) x [y0, y1) by scanning rows, for images too large for a summed-area table
+        public static long RegionSum(RowReader rows, int x0, int y0, int x1, int y1) {
+            long sum = 0;
+            for (int y = y0; y < y1; y++) {
+                byte[] s = rows(y, out int start);
+                for (int i = start + x0 * PixelBuffer.BytesPerPixel, end = start + x1 * PixelBuffer.BytesPerPixel; i < end; i += PixelBuffer.BytesPerPixel)
+                    sum += (s[i] + s[i + 1] + s[i + 2]) / 3;
+            }
+            return sum;
+        }
+    }
+}
@@ -0,0 +1,60 @@
+using System;
+using System.Collections.Generic;
+
+namespace ImageLangRuntime
+{
+    // Result table behind a memoized pure function (runner --memoize-size). The key is the boxed argument,
+    // or an object[] of the arguments for several parameters. Once Capacity entries are stored the table
+    // starts over, which keeps it bounded without per-call bookkeeping.
+    public sealed class Memo
+    {
+        private sealed class ArgsComparer : IEqualityComparer<object>
+        {
+            public new bool Equals(object x, object y) {
+                if (x is object[] a && y is object[] b) {
+                    if (a.Length != b.Length) return false;
+                    for (int i = 0; i < a.Length; i++) if (!Same(a[i], b[i])) return false;
+                    return true;
+                }
+                return Same(x, y);
+            }
+
+            public int GetHashCode(object o) {
+                if (!(o is object[] a)) return Hash(o);
+                int h = 17;
+                foreach (object v in a) h = h * 31 + Hash(v);
+                return h;
+            }
+
+            // Doubles are keyed on their bits: 0.0 and -0.0 compare equal but 1 / x tells them apart
+            private static bool Same(object x, object y) =>
+                x is double a && y is double b
+                    ? BitConverter.DoubleToInt64Bits(a) == BitConverter.DoubleToInt64Bits(b)
+                    : object.Equals(x, y);
+
+            private static int Hash(object v) =>
+                v is double d ? BitConverter.DoubleToInt64Bits(d).GetHashCode() : v?.GetHashCode() ?? 0;
+        }
+
+        private static readonly object NullKey = new object();
+        private readonly Dictionary<object, object> table = new Dictionary<object, object>(new ArgsComparer());
+
+        public int Capacity { get; }
+        public long Hits { get; private set; }
+        public long Misses { get; private set; }
+        public long Resets { get; private set; }
+
+        public Memo(int capacity) { Capacity = Math.Max(1, capacity); }
+
+        public bool TryGet(object key, out object value) {
+            if (table.TryGetValue(key ?? NullKey, out value)) { Hits++; return true; }
+            Misses++;
+            return false;
+        }
+
+        public void Add(object key, object value) {
+            if (table.Count >= Capacity) { table.Clear(); Resets++; }
+            table[key ?? NullKey] = value;
+        }
+    }
+}
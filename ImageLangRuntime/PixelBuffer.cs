@@ -0,0 +1,130 @@
+using System;
+using System.Drawing;
+using System.Drawing.Imaging;
+using System.Runtime.InteropServices;
+
+namespace ImageLangRuntime
+{
+    // Row access shared by in-memory, lazy and tiled images: returns the array holding row y
+    // and the offset of its first byte.
+    public delegate byte[] RowReader(int y, out int offset);
+
+    // Working pixel format of all StdLib kernels: 32bpp, B,G,R,A byte order, row-major scanlines.
+    // Bitmaps are converted with a single LockBits per image instead of GetPixel/SetPixel per pixel.
+    // Data is rented from BufferPool and returned by Dispose, which the owning ImageWrapper calls once
+    // nothing can read the image any more. A buffer that is never disposed is simply collected.
+    public sealed class PixelBuffer : IDisposable
+    {
+        public const int BytesPerPixel = 4;
+        public const int B = 0, G = 1, R = 2, A = 3;
+
+        public int Width { get; }
+        public int Height { get; }
+        public int Stride { get; }
+        public byte[] Data { get; }
+
+        private readonly bool pooled;
+        private bool returned;
+
+        // Zero-filled buffer
+        public PixelBuffer(int width, int height) : this(width, height, true) { }
+
+        public PixelBuffer(int width, int height, byte[] data) {
+            Width = width;
+            Height = height;
+            Stride = width * BytesPerPixel;
+            Data = data;
+        }
+
+        private PixelBuffer(int width, int height, bool clear) {
+            Width = width;
+            Height = height;
+            Stride = width * BytesPerPixel;
+            pooled = BufferPool.Enabled;
+            Data = pooled ? BufferPool.Rent(Stride * height, clear) : new byte[Stride * height];
+        }
+
+        public void Dispose() {
+            if (!pooled || returned) return;
+            returned = true;
+            BufferPool.Return(Data);
+        }
+
+        // Buffer with unspecified contents, for kernels that write every pixel
+        public static PixelBuffer Rent(int width, int height) => new PixelBuffer(width, height, false);
+
+        public int Offset(int x, int y) => y * Stride + x * BytesPerPixel;
+
+        public byte[] Row(int y, out int offset) {
+            offset = y * Stride;
+            return Data;
+        }
+
+        public PixelBuffer Clone() {
+            var copy = Rent(Width, Height);
+            Buffer.BlockCopy(Data, 0, copy.Data, 0, Data.Length);
+            return copy;
+        }
+
+        public static PixelBuffer FromBitmap(Bitmap bmp) {
+            var buf = Rent(bmp.Width, bmp.Height);
+            BitmapData bd = bmp.LockBits(new Rectangle(0, 0, bmp.Width, bmp.Height), ImageLockMode.ReadOnly, PixelFormat.Format32bppArgb);
+            try {
+                for (int y = 0; y < buf.Height; y++)
+                    Marshal.Copy(IntPtr.Add(bd.Scan0, y * bd.Stride), buf.Data, y * buf.Stride, buf.Stride);
+            } finally {
+                bmp.UnlockBits(bd);
+            }
+            return buf;
+        }
+
+        public Bitmap ToBitmap() {
+            var bmp = new Bitmap(Width, Height, PixelFormat.Format32bppArgb);
+            BitmapData bd = bmp.LockBits(new Rectangle(0, 0, Width, Height), ImageLockMode.WriteOnly, PixelFormat.Format32bppArgb);
+            try {
+                for (int y = 0; y < Height; y++)
+                    Marshal.Copy(Data, y * Stride, IntPtr.Add(bd.Scan0, y * bd.Stride), Stride);
+            } finally {
+                bmp.UnlockBits(bd);
+            }
+            return bmp;
+        }
+    }
+
+    // Unchecked reads for img.pixel(x, y) in loops the compiler has proven to stay inside the image.
+    // In-memory images are indexed through their buffer; tiled images are never assembled into one and
+    // are read through ReadRow instead, fetching a row only when y changes.
+    public sealed class PixelReader
+    {
+        private readonly ImageWrapper rows;
+        private readonly PixelBuffer buffer;
+        private byte[] row;
+        private int rowY = -1, rowOffset;
+
+        public PixelReader(ImageWrapper img) {
+            if (img.IsTiled) rows = img;
+            else buffer = img.Pixels;
+        }
+
+        public PixelReader(PixelBuffer buffer) {
+            this.buffer = buffer;
+        }
+
+        public LangColor ColorAt(int x, int y) {
+            byte[] data;
+            int i;
+            if (buffer != null) {
+                data = buffer.Data;
+                i = buffer.Offset(x, y);
+            } else {
+                if (y != rowY) {
+                    row = rows.ReadRow(y, out rowOffset);
+                    rowY = y;
+                }
+                data = row;
+                i = rowOffset + x * PixelBuffer.BytesPerPixel;
+            }
+            return new LangColor(data[i + PixelBuffer.R], data[i + PixelBuffer.G], data[i + PixelBuffer.B]);
+        }
+    }
+}
@@ -0,0 +1,39 @@
+using System.Collections.Concurrent;
+using System.Threading.Tasks;
+
+namespace ImageLangRuntime
+{
+    // Background decoding of images the compiler can see being loaded. Main starts with a Request for
+    // every load() whose path is a literal (or a variable only ever holding one); Ops.Load then takes the
+    // decoded image instead of reading the file itself. An entry serves one load, so two loads of the same
+    // path never share a mutable image, and Save drops the entry for the path it overwrites.
+    public static class Prefetch
+    {
+        private static readonly ConcurrentDictionary<string, Task<ImageWrapper>> pending =
+            new ConcurrentDictionary<string, Task<ImageWrapper>>();
+
+        public static void Request(string path) {
+            if (path == null) return;
+            pending.GetOrAdd(path, p => Task.Run(() => Decode(p)));
+        }
+
+        public static bool TryTake(string path, out ImageWrapper img) {
+            img = null;
+            if (path == null || !pending.TryRemove(path, out var task)) return false;
+            img = task.Result;
+            return true;
+        }
+
+        // Waits for a decode still reading the file, so the caller can overwrite it
+        public static void Invalidate(string path) {
+            if (path != null && pending.TryRemove(path, out var task)) task.Wait();
+        }
+
+        private static ImageWrapper Decode(string path) {
+            ImageWrapper img = StdLib.load(path);
+            // Bitmaps are converted to pixels on first use; do that here too unless the image is streamed
+            if (img != null && !img.IsTiled) { var _ = img.Pixels; }
+            return img;
+        }
+    }
+}
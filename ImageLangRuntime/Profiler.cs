@@ -0,0 +1,145 @@
+using System;
+using System.Collections.Generic;
+using System.Diagnostics;
+using System.Globalization;
+using System.IO;
+using System.Linq;
+using System.Text;
+
+namespace ImageLangRuntime
+{
+    // Collector for programs compiled with --instrument. Regions are "main", "func:<name>",
+    // "loop:<kind>@<line>" and "builtin:<name>@<line>". At exit the profile is written to
+    // IMAGELANG_PROFILE (default imagelang-profile.json) plus a folded-stacks file for flamegraph.pl.
+    public static class Profiler
+    {
+        private class Region { public long Calls, Iterations, TotalTicks, SelfTicks; }
+
+        // One node per distinct call path, created on first entry: a probe only looks up its child by
+        // name, so deep recursion costs no string building. Folded paths are spelled out at exit.
+        private class StackNode
+        {
+            public readonly string Name;
+            public readonly Region Region;
+            public readonly Dictionary<string, StackNode> Children = new Dictionary<string, StackNode>();
+            public long SelfTicks;
+
+            public StackNode(string name, Region region) { Name = name; Region = region; }
+
+            public StackNode Child(string name) {
+                if (!Children.TryGetValue(name, out StackNode child)) Children[name] = child = new StackNode(name, GetRegion(name));
+                return child;
+            }
+        }
+
+        // Frames are reused between calls at the same depth
+        private class Frame { public StackNode Node; public long Start, ChildTicks; }
+
+        private static readonly Stopwatch clock = Stopwatch.StartNew();
+        private static readonly List<Frame> frames = new List<Frame>();
+        private static readonly Dictionary<string, Region> regions = new Dictionary<string, Region>();
+        private static readonly StackNode root = new StackNode(null, null);
+        private static int depth;
+        private static bool dumped;
+
+        static Profiler() {
+            AppDomain.CurrentDomain.ProcessExit += (s, e) => Dump();
+            AppDomain.CurrentDomain.UnhandledException += (s, e) => Dump();
+        }
+
+        public static void Enter(string name) {
+            StackNode node = (depth > 0 ? frames[depth - 1].Node : root).Child(name);
+            if (depth == frames.Count) frames.Add(new Frame());
+            Frame frame = frames[depth++];
+            frame.Node = node;
+            frame.ChildTicks = 0;
+            node.Region.Calls++;
+            frame.Start = clock.ElapsedTicks;
+        }
+
+        // Frames left open by exceptions or early returns are closed together with the region being exited;
+        // only then does the stack need searching.
+        public static void Exit(string name) {
+            if (depth == 0) return;
+            if (frames[depth - 1].Node.Name != name && !IsOpen(name)) return;
+            long now = clock.ElapsedTicks;
+            StackNode node;
+            do {
+                Frame frame = frames[--depth];
+                node = frame.Node;
+                long total = now - frame.Start;
+                long self = total - frame.ChildTicks;
+                node.Region.TotalTicks += total;
+                node.Region.SelfTicks += self;
+                node.SelfTicks += self;
+                if (depth > 0) frames[depth - 1].ChildTicks += total;
+            } while (node.Name != name);
+        }
+
+        private static bool IsOpen(string name) {
+            for (int i = depth - 1; i >= 0; i--) if (frames[i].Node.Name == name) return true;
+            return false;
+        }
+
+        public static void Tick(string name) => GetRegion(name).Iterations++;
+
+        private static Region GetRegion(string name) {
+            if (!regions.TryGetValue(name, out Region r)) regions[name] = r = new Region();
+            return r;
+        }
+
+        private static IEnumerable<string> Folded(StackNode node, string path) {
+            foreach (StackNode child in node.Children.Values) {
+                string childPath = path == null ? child.Name : path + ";" + child.Name;
+                if (child.SelfTicks > 0) yield return $"{childPath} {Micros(child.SelfTicks)}";
+                foreach (string line in Folded(child, childPath)) yield return line;
+            }
+        }
+
+        // Whole seconds and the remainder are scaled separately, so long profiles do not overflow
+        private static long Micros(long ticks) {
+            long f = Stopwatch.Frequency;
+            return ticks / f * 1000000 + ticks % f * 1000000 / f;
+        }
+
+        // Region names carry source paths, which may contain quotes, backslashes or control characters
+        private static string JsonString(string s) {
+            var sb = new StringBuilder("\"");
+            foreach (char c in s) {
+                switch (c) {
+                    case '"': sb.Append("\\\""); break;
+                    case '\\': sb.Append("\\\\"); break;
+                    case '\n': sb.Append("\\n"); break;
+                    case '\r': sb.Append("\\r"); break;
+                    case '\t': sb.Append("\\t"); break;
+                    default:
+                        if (c < ' ') sb.Append("\\u").Append(((int)c).ToString("x4"));
+                        else sb.Append(c);
+                        break;
+                }
+            }
+            return sb.Append('"').ToString();
+        }
+
+        public static void Dump() {
+            if (dumped) return;
+            dumped = true;
+            while (depth > 0) Exit(frames[0].Node.Name);
+
+            string path = Environment.GetEnvironmentVariable("IMAGELANG_PROFILE") ?? "imagelang-profile.json";
+            var json = new StringBuilder();
+            json.Append("{\n  \"unit\": \"us\",\n  \"regions\": [");
+            bool first = true;
+            foreach (var kv in regions.OrderByDescending(kv => kv.Value.SelfTicks)) {
+                json.Append(first ? "\n" : ",\n");
+                first = false;
+                json.AppendFormat(CultureInfo.InvariantCulture,
+                    "    {{\"name\": {0}, \"calls\": {1}, \"iterations\": {2}, \"total\": {3}, \"self\": {4}}}",
+                    JsonString(kv.Key), kv.Value.Calls, kv.Value.Iterations, Micros(kv.Value.TotalTicks), Micros(kv.Value.SelfTicks));
+            }
+            json.Append("\n  ]\n}\n");
+            File.WriteAllText(path, json.ToString());
+            File.WriteAllLines(Path.ChangeExtension(path, ".folded"), Folded(root, null));
+        }
+    }
+}
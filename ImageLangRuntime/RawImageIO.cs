@@ -0,0 +1,169 @@
+using System;
+using System.IO;
+using System.IO.MemoryMappedFiles;
+using System.Text;
+
+namespace ImageLangRuntime
+{
+    // Uncompressed formats handled without System.Drawing, through memory-mapped files:
+    //   .ppm (P6) / .pgm (P5) with maxval 255, and .ilraw: "ILRAW1\0\0", int32 width, int32 height,
+    //   then rows in the PixelBuffer layout (32bpp BGRA), so loading is one bulk copy.
+    // An .ilraw above TiledImage.Threshold is opened as a TiledImage over the file instead of being read,
+    // and saving streams rows through views of at most ViewBytes, so neither needs the image in memory.
+    public static class RawImageIO
+    {
+        private static readonly byte[] RawMagic = Encoding.ASCII.GetBytes("ILRAW1\0\0");
+        private const int RawHeaderSize = 16;
+        private const int ViewBytes = 16 * 1024 * 1024;
+
+        public static bool Handles(string path) {
+            string ext = Path.GetExtension(path).ToLowerInvariant();
+            return ext == ".ppm" || ext == ".pgm" || ext == ".pnm" || ext == ".ilraw";
+        }
+
+        public static ImageWrapper Load(string path) {
+            if (!File.Exists(path)) throw new FileNotFoundException("File not found: " + path);
+            if (ReadRawHeader(path, out int w, out int h) && TiledImage.ShouldTile(w, h))
+                return new ImageWrapper(TiledImage.Open(path, RawHeaderSize, w, h));
+            using (var mmf = MemoryMappedFile.CreateFromFile(path, FileMode.Open, null, 0, MemoryMappedFileAccess.Read))
+            using (var view = mmf.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read)) {
+                if (view.ReadByte(0) == RawMagic[0]) return new ImageWrapper(LoadRaw(view));
+                return new ImageWrapper(LoadNetpbm(view));
+            }
+        }
+
+        private static bool ReadRawHeader(string path, out int w, out int h) {
+            w = h = 0;
+            var header = new byte[RawHeaderSize];
+            using (var fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read)) {
+                if (fs.Read(header, 0, RawHeaderSize) != RawHeaderSize) return false;
+            }
+            for (int i = 0; i < RawMagic.Length; i++)
+                if (header[i] != RawMagic[i]) return false;
+            w = BitConverter.ToInt32(header, 8);
+            h = BitConverter.ToInt32(header, 12);
+            return true;
+        }
+
+        private static PixelBuffer LoadRaw(MemoryMappedViewAccessor view) {
+            for (int i = 0; i < RawMagic.Length; i++)
+                if (view.ReadByte(i) != RawMagic[i]) throw new InvalidDataException("Not an ILRAW file");
+            int w = view.ReadInt32(8), h = view.ReadInt32(12);
+            var buf = PixelBuffer.Rent(w, h);
+            view.ReadArray(RawHeaderSize, buf.Data, 0, buf.Data.Length);
+            return buf;
+        }
+
+        private static PixelBuffer LoadNetpbm(MemoryMappedViewAccessor view) {
+            long pos = 0;
+            string magic = NextToken(view, ref pos);
+            if (magic != "P6" && magic != "P5") throw new InvalidDataException("Only binary PPM (P6) and PGM (P5) are supported");
+            int w = int.Parse(NextToken(view, ref pos));
+            int h = int.Parse(NextToken(view, ref pos));
+            int maxval = int.Parse(NextToken(view, ref pos));
+            if (maxval != 255) throw new InvalidDataException("Only 8-bit PPM/PGM is supported");
+            pos++; // single whitespace after maxval
+
+            int channels = magic == "P6" ? 3 : 1;
+            var buf = PixelBuffer.Rent(w, h);
+            var row = new byte[w * channels];
+            byte[] d = buf.Data;
+            for (int y = 0; y < h; y++) {
+                view.ReadArray(pos + (long)y * row.Length, row, 0, row.Length);
+                for (int x = 0, o = y * buf.Stride; x < w; x++, o += PixelBuffer.BytesPerPixel) {
+                    if (channels == 3) {
+                        d[o + PixelBuffer.R] = row[x * 3];
+                        d[o + PixelBuffer.G] = row[x * 3 + 1];
+                        d[o + PixelBuffer.B] = row[x * 3 + 2];
+                    } else {
+                        d[o] = d[o + 1] = d[o + 2] = row[x];
+                    }
+                    d[o + PixelBuffer.A] = 255;
+                }
+            }
+            return buf;
+        }
+
+        private static string NextToken(MemoryMappedViewAccessor view, ref long pos) {
+            var sb = new StringBuilder();
+            while (pos < view.Capacity) {
+                char c = (char)view.ReadByte(pos);
+                if (c == '#') {
+                    while (pos < view.Capacity && view.ReadByte(pos) != '\n') pos++;
+                } else if (char.IsWhiteSpace(c)) {
+                    if (sb.Length > 0) return sb.ToString();
+                    pos++;
+                } else {
+                    sb.Append(c);
+                    pos++;
+                }
+            }
+            return sb.ToString();
+        }
+
+        public static void Save(ImageWrapper img, string path) {
+            TiledImage.ReleaseSource(path);
+            string ext = Path.GetExtension(path).ToLowerInvariant();
+            if (ext == ".ilraw") SaveRaw(img, path);
+            else SaveNetpbm(img, path, ext == ".pgm");
+        }
+
+        private static void SaveRaw(ImageWrapper img, string path) {
+            int w = img.Width, h = img.Height, stride = w * PixelBuffer.BytesPerPixel;
+            var header = new byte[RawHeaderSize];
+            Array.Copy(RawMagic, header, RawMagic.Length);
+            Array.Copy(BitConverter.GetBytes(w), 0, header, 8, 4);
+            Array.Copy(BitConverter.GetBytes(h), 0, header, 12, 4);
+            RowReader rows = img.Rows;
+            WriteMapped(path, header, h, stride, (y, row) => {
+                byte[] s = rows(y, out int start);
+                Buffer.BlockCopy(s, start, row, 0, stride);
+            });
+        }
+
+        // PGM stores the (R+G+B)/3 gray value used by avg
+        private static void SaveNetpbm(ImageWrapper img, string path, bool gray) {
+            int w = img.Width, h = img.Height, channels = gray ? 1 : 3;
+            byte[] header = Encoding.ASCII.GetBytes($"{(gray ? "P5" : "P6")}\n{w} {h}\n255\n");
+            RowReader rows = img.Rows;
+            WriteMapped(path, header, h, w * channels, (y, row) => {
+                byte[] s = rows(y, out int i);
+                for (int x = 0; x < w; x++, i += PixelBuffer.BytesPerPixel) {
+                    if (gray) {
+                        row[x] = (byte)((s[i] + s[i + 1] + s[i + 2]) / 3);
+                    } else {
+                        row[x * 3] = s[i + PixelBuffer.R];
+                        row[x * 3 + 1] = s[i + PixelBuffer.G];
+                        row[x * 3 + 2] = s[i + PixelBuffer.B];
+                    }
+                }
+            });
+        }
+
+        // Writes the header and then height rows of rowBytes each, filled by encode(y, row),
+        // mapping at most ViewBytes of the file at a time
+        private static void WriteMapped(string path, byte[] header, int height, int rowBytes, Action<int, byte[]> encode) {
+            long size = header.Length + (long)height * rowBytes;
+            int rowsPerView = Math.Max(1, ViewBytes / Math.Max(1, rowBytes));
+            var row = new byte[rowBytes];
+            using (var mmf = CreateMapped(path, size)) {
+                using (var view = mmf.CreateViewAccessor(0, header.Length, MemoryMappedFileAccess.ReadWrite))
+                    view.WriteArray(0, header, 0, header.Length);
+                for (int y0 = 0; y0 < height; y0 += rowsPerView) {
+                    int count = Math.Min(rowsPerView, height - y0);
+                    long pos = header.Length + (long)y0 * rowBytes;
+                    using (var view = mmf.CreateViewAccessor(pos, (long)count * rowBytes, MemoryMappedFileAccess.ReadWrite)) {
+                        for (int y = 0; y < count; y++) {
+                            encode(y0 + y, row);
+                            view.WriteArray((long)y * rowBytes, row, 0, rowBytes);
+                        }
+                        view.Flush();
+                    }
+                }
+            }
+        }
+
+        private static MemoryMappedFile CreateMapped(string path, long size) =>
+            MemoryMappedFile.CreateFromFile(path, FileMode.Create, null, size, MemoryMappedFileAccess.ReadWrite);
+    }
+}
@@ -0,0 +1,122 @@
+using System;
+using System.Collections.Generic;
+using System.Drawing;
+using System.Linq;
+using System.Runtime.ExceptionServices;
+using System.Threading;
+using System.Threading.Tasks;
+
+namespace ImageLangRuntime
+{
+    // Background writer behind save() outside try blocks. Images never change after creation, so the
+    // queue holds the image itself rather than a copy; a lazy one is materialized by the write on the
+    // thread pool, and writes to one path keep their program order.
+    // Queued snapshots may hold at most Budget bytes (IMAGELANG_SAVE_MB, default 256): once that is
+    // reached save() blocks until a write finishes, and an image larger than the budget is written
+    // synchronously. A failed write is rethrown by the next WaitFor on its path, so it never surfaces from
+    // an unrelated load or save; Flush, which Main ends with, reports every failure still unreported.
+    public static class SaveQueue
+    {
+        private static readonly object sync = new object();
+        private static readonly Dictionary<string, Task> pending = new Dictionary<string, Task>();
+        private static readonly List<KeyValuePair<string, Exception>> failures = new List<KeyValuePair<string, Exception>>();
+        private static long queuedBytes;
+
+        public static long Budget { get; set; } = ReadBudget();
+
+        static SaveQueue() {
+            AppDomain.CurrentDomain.ProcessExit += (s, e) => Drain();
+            AppDomain.CurrentDomain.UnhandledException += (s, e) => Drain();
+        }
+
+        private static long ReadBudget() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_SAVE_MB");
+            if (long.TryParse(env, out long mb)) return Math.Max(0, mb) * 1024 * 1024;
+            return 256L * 1024 * 1024;
+        }
+
+        public static void Enqueue(ImageWrapper img, string path) {
+            if (img == null) return;
+            long bytes = img.SizeInBytes;
+            if (path == null || bytes > Budget) {
+                WaitFor(path);
+                StdLib.save(img, path);
+                return;
+            }
+
+            lock (sync) {
+                while (queuedBytes > 0 && queuedBytes + bytes > Budget) Monitor.Wait(sync);
+                queuedBytes += bytes;
+            }
+            // GDI+ objects cannot be shared across threads: a loaded bitmap is converted here, and the
+            // pool thread encodes from a bitmap of its own
+            if (img.OnlyBitmap) _ = img.Pixels;
+            img.Hold();
+            lock (sync) {
+                Task previous = pending.TryGetValue(path, out Task t) ? t : Task.CompletedTask;
+                pending[path] = previous.ContinueWith(_ => Write(img, path, bytes), TaskScheduler.Default);
+            }
+        }
+
+        // Blocks until every queued write to path is on disk
+        public static void WaitFor(string path) {
+            Task task = null;
+            lock (sync) {
+                if (path != null && pending.TryGetValue(path, out task)) pending.Remove(path);
+            }
+            task?.Wait();
+            if (path != null) Raise(TakeFailures(path));
+        }
+
+        public static void Flush() {
+            Task[] tasks;
+            lock (sync) {
+                tasks = pending.Values.ToArray();
+                pending.Clear();
+            }
+            Task.WaitAll(tasks);
+            Raise(TakeFailures(null));
+        }
+
+        private static void Write(ImageWrapper img, string path, long bytes) {
+            try {
+                if (RawImageIO.Handles(path)) RawImageIO.Save(img, path);
+                else using (Bitmap bmp = img.Pixels.ToBitmap()) bmp.Save(path);
+            } catch (Exception e) {
+                lock (sync) failures.Add(new KeyValuePair<string, Exception>(path, e));
+            } finally {
+                img.Unhold();
+                lock (sync) {
+                    queuedBytes -= bytes;
+                    Monitor.PulseAll(sync);
+                }
+            }
+        }
+
+        // Failed writes to path, or to any path when it is null, in the order they failed
+        private static List<Exception> TakeFailures(string path) {
+            lock (sync) {
+                var taken = failures.Where(f => path == null || f.Key == path).Select(f => f.Value).ToList();
+                failures.RemoveAll(f => path == null || f.Key == path);
+                return taken;
+            }
+        }
+
+        private static void Raise(List<Exception> errors) {
+            if (errors.Count == 0) return;
+            if (errors.Count == 1) ExceptionDispatchInfo.Capture(errors[0]).Throw();
+            throw new AggregateException(string.Join(Environment.NewLine, errors.Select(e => e.Message)), errors);
+        }
+
+        // Exit paths that skipped Flush still get their files; errors can only be reported
+        private static void Drain() {
+            Task[] tasks;
+            lock (sync) tasks = pending.Values.ToArray();
+            Task.WaitAll(tasks);
+            lock (sync) {
+                foreach (var f in failures) Console.Error.WriteLine($"[SaveQueue] {f.Value.Message}");
+                failures.Clear();
+            }
+        }
+    }
+}
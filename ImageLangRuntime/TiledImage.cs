@@ -0,0 +1,255 @@
+using System;
+using System.Collections.Generic;
+using System.IO;
+using System.Threading;
+
+namespace ImageLangRuntime
+{
+    // Out-of-core image stored as horizontal strips of StripRows full rows in a backing file:
+    // a scratch file for computed results or the source .ilraw for loaded images. Strips are paged
+    // in and out through TileCache. Results larger than IMAGELANG_TILE_THRESHOLD_MB (default 1024),
+    // or computed from a tiled input, are produced strip by strip instead of as one PixelBuffer.
+    // Dispose closes the file (deleting a scratch file) and drops the image's strips from TileCache.
+    public sealed class TiledImage : IDisposable
+    {
+        private static long nextId;
+
+        // Images reading straight from a source file, so saving over that file can move them off it first
+        private static readonly List<WeakReference<TiledImage>> readers = new List<WeakReference<TiledImage>>();
+
+        public static long Threshold { get; set; } = ReadThreshold();
+        public static int StripBytes { get; set; } = 4 * 1024 * 1024;
+
+        // The file is swapped for a scratch copy when its source is overwritten; io guards both
+        private readonly object io = new object();
+        private FileStream file;
+        private long baseOffset;
+        private string source;
+
+        public long Id { get; } = Interlocked.Increment(ref nextId);
+        public int Width { get; }
+        public int Height { get; }
+        public int Stride { get; }
+        public int StripRows { get; }
+        public int StripCount { get; }
+
+        private static long ReadThreshold() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_TILE_THRESHOLD_MB");
+            if (long.TryParse(env, out long mb) && mb > 0) return mb * 1024 * 1024;
+            return 1024L * 1024 * 1024;
+        }
+
+        private TiledImage(int width, int height, FileStream file, long baseOffset) {
+            Width = width;
+            Height = height;
+            Stride = width * PixelBuffer.BytesPerPixel;
+            StripRows = Math.Max(1, StripBytes / Math.Max(1, Stride));
+            StripCount = (height + StripRows - 1) / StripRows;
+            this.file = file;
+            this.baseOffset = baseOffset;
+        }
+
+        public static bool ShouldTile(int width, int height) =>
+            (long)width * height * PixelBuffer.BytesPerPixel > Threshold;
+
+        // Read-only view of rows stored at offset in an existing file
+        public static TiledImage Open(string path, long offset, int width, int height) {
+            var fs = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, 1 << 16, FileOptions.RandomAccess);
+            var t = new TiledImage(width, height, fs, offset) { source = Path.GetFullPath(path) };
+            lock (readers) readers.Add(new WeakReference<TiledImage>(t));
+            return t;
+        }
+
+        // Empty image in a scratch file, deleted on close
+        public static TiledImage Create(int width, int height) =>
+            new TiledImage(width, height, CreateScratch((long)width * PixelBuffer.BytesPerPixel * height), 0);
+
+        // Scratch files live under IMAGELANG_SCRATCH (default: the temp directory)
+        private static FileStream CreateScratch(long length) {
+            string dir = Environment.GetEnvironmentVariable("IMAGELANG_SCRATCH") ?? Path.GetTempPath();
+            string path = Path.Combine(dir, "imagelang-" + Guid.NewGuid().ToString("N") + ".tile");
+            var fs = new FileStream(path, FileMode.CreateNew, FileAccess.ReadWrite, FileShare.None, 1 << 16,
+                FileOptions.RandomAccess | FileOptions.DeleteOnClose);
+            fs.SetLength(length);
+            return fs;
+        }
+
+        // Called before path is written: images still reading it copy their strips to scratch files and
+        // close their handles, so the save neither fails on the open file nor changes them
+        public static void ReleaseSource(string path) {
+            string full = Path.GetFullPath(path);
+            var moving = new List<TiledImage>();
+            lock (readers) {
+                readers.RemoveAll(r => !r.TryGetTarget(out TiledImage t) || t.source == null);
+                foreach (var r in readers)
+                    if (r.TryGetTarget(out TiledImage t) && string.Equals(t.source, full, StringComparison.OrdinalIgnoreCase)) moving.Add(t);
+            }
+            foreach (TiledImage t in moving) t.MoveToScratch();
+        }
+
+        private void MoveToScratch() {
+            lock (io) {
+                if (source == null) return;
+                FileStream scratch = CreateScratch((long)Stride * Height);
+                for (int s = 0; s < StripCount; s++) {
+                    byte[] data = ReadStrip(s);
+                    scratch.Seek((long)s * StripRows * Stride, SeekOrigin.Begin);
+                    scratch.Write(data, 0, data.Length);
+                }
+                file.Dispose();
+                file = scratch;
+                baseOffset = 0;
+                source = null;
+            }
+        }
+
+        public void Dispose() {
+            lock (io) {
+                if (file == null) return;
+                file.Dispose();
+                file = null;
+                source = null;
+            }
+            TileCache.Drop(this);
+        }
+
+        // Computes the image one strip at a time; fill(y0, y1, data) writes rows [y0, y1) to data
+        public static TiledImage Build(int width, int height, Action<int, int, byte[]> fill) {
+            TiledImage t = Create(width, height);
+            for (int s = 0; s < t.StripCount; s++) {
+                int y0 = s * t.StripRows, y1 = Math.Min(height, y0 + t.StripRows);
+                var data = new byte[(y1 - y0) * t.Stride];
+                fill(y0, y1, data);
+                TileCache.Put(t, s, data, true);
+            }
+            return t;
+        }
+
+        public byte[] Row(int y, out int offset) {
+            int s = y / StripRows;
+            offset = (y - s * StripRows) * Stride;
+            return TileCache.Get(this, s);
+        }
+
+        public PixelBuffer ToPixelBuffer() {
+            var buf = PixelBuffer.Rent(Width, Height);
+            for (int s = 0; s < StripCount; s++) {
+                byte[] data = TileCache.Get(this, s);
+                Buffer.BlockCopy(data, 0, buf.Data, s * StripRows * Stride, data.Length);
+            }
+            return buf;
+        }
+
+        private long StripOffset(int s) => baseOffset + (long)s * StripRows * Stride;
+        private int StripLength(int s) => (Math.Min(Height, (s + 1) * StripRows) - s * StripRows) * Stride;
+
+        internal byte[] ReadStrip(int s) {
+            var data = new byte[StripLength(s)];
+            lock (io) {
+                if (file == null) throw new ObjectDisposedException(nameof(TiledImage));
+                file.Seek(StripOffset(s), SeekOrigin.Begin);
+                int read = 0;
+                while (read < data.Length) {
+                    int n = file.Read(data, read, data.Length - read);
+                    if (n == 0) throw new EndOfStreamException("Truncated tile data");
+                    read += n;
+                }
+            }
+            return data;
+        }
+
+        internal void WriteStrip(int s, byte[] data) {
+            lock (io) {
+                if (file == null) return;
+                file.Seek(StripOffset(s), SeekOrigin.Begin);
+                file.Write(data, 0, data.Length);
+            }
+        }
+    }
+
+    // Byte-budgeted LRU of strips shared by all tiled images; dirty strips are written back to
+    // their image's file on eviction. IMAGELANG_TILE_CACHE_MB sets the budget (default 512).
+    public static class TileCache
+    {
+        private struct Key : IEquatable<Key>
+        {
+            public long Id; public int Strip;
+            public bool Equals(Key o) => Id == o.Id && Strip == o.Strip;
+            public override bool Equals(object o) => o is Key k && Equals(k);
+            public override int GetHashCode() => Id.GetHashCode() * 31 + Strip;
+        }
+
+        private class Entry { public Key Key; public TiledImage Owner; public byte[] Data; public bool Dirty; }
+
+        private static readonly object sync = new object();
+        private static readonly LinkedList<Entry> lru = new LinkedList<Entry>();
+        private static readonly Dictionary<Key, LinkedListNode<Entry>> map = new Dictionary<Key, LinkedListNode<Entry>>();
+
+        public static long Budget { get; set; } = ReadBudget();
+        public static long Bytes { get; private set; }
+        public static long Hits { get; private set; }
+        public static long Misses { get; private set; }
+        public static long WriteBacks { get; private set; }
+
+        private static long ReadBudget() {
+            string env = Environment.GetEnvironmentVariable("IMAGELANG_TILE_CACHE_MB");
+            if (long.TryParse(env, out long mb) && mb > 0) return mb * 1024 * 1024;
+            return 512L * 1024 * 1024;
+        }
+
+        public static byte[] Get(TiledImage t, int strip) {
+            var key = new Key { Id = t.Id, Strip = strip };
+            lock (sync) {
+                if (map.TryGetValue(key, out var node)) {
+                    lru.Remove(node);
+                    lru.AddFirst(node);
+                    Hits++;
+                    return node.Value.Data;
+                }
+                Misses++;
+            }
+            byte[] data = t.ReadStrip(strip);
+            Put(t, strip, data, false);
+            return data;
+        }
+
+        public static void Put(TiledImage t, int strip, byte[] data, bool dirty) {
+            var key = new Key { Id = t.Id, Strip = strip };
+            lock (sync) {
+                if (map.TryGetValue(key, out var old)) {
+                    lru.Remove(old);
+                    Bytes -= old.Value.Data.Length;
+                }
+                map[key] = lru.AddFirst(new Entry { Key = key, Owner = t, Data = data, Dirty = dirty });
+                Bytes += data.Length;
+                // The newest strip always stays resident, even when it alone exceeds the budget
+                while (Bytes > Budget && lru.Count > 1) {
+                    Entry last = lru.Last.Value;
+                    lru.RemoveLast();
+                    map.Remove(last.Key);
+                    Bytes -= last.Data.Length;
+                    if (last.Dirty) { last.Owner.WriteStrip(last.Key.Strip, last.Data); WriteBacks++; }
+                }
+            }
+        }
+
+        // Forgets a disposed image's strips, dirty ones included, since its file is gone
+        public static void Drop(TiledImage t) {
+            lock (sync) {
+                var node = lru.First;
+                while (node != null) {
+                    var next = node.Next;
+                    if (node.Value.Owner == t) {
+                        lru.Remove(node);
+                        map.Remove(node.Value.Key);
+                        Bytes -= node.Value.Data.Length;
+                    }
+                    node = next;
+                }
+            }
+        }
+
+        public static string Report() =>
+            $"[TileCache] hits={Hits} misses={Misses} writebacks={WriteBacks} bytes={Bytes}/{Budget}";
+    }
+}
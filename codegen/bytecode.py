@@ -0,0 +1,366 @@
+from array import array
+
+from ImageLangVisitor import ImageLangVisitor
+from ImageLangParser import ImageLangParser
+
+# The instruction set and the .ilbc format are in codegen.ilbc, which loading and running needs without the parser
+from codegen.ilbc import *
+from codegen.pygen import MAIN, UnsupportedConstruct, decode_string
+
+
+class BytecodeCompiler(ImageLangVisitor):
+    """Compiles a verified tree to a Program. Statement visitors emit code, expression visitors return
+    (register, type code) of their value. Arithmetic on operands of known numeric or bool type uses the
+    typed opcodes; everything else goes through the generic ones, which follow ImageLangRuntime.Ops."""
+
+    def __init__(self):
+        self.constants = []
+        self.constant_index = {}
+        self.functions = []
+        self.function_index = {}
+        self.function_refs = {}
+        self.in_main = False
+
+    def compile(self, tree) -> Program:
+        return self.visit(tree)
+
+    # -----------------------------
+    # Helpers
+    # -----------------------------
+    def emit(self, op, a=0, b=0, c=0):
+        self.code.extend((op, a, b, c))
+        return len(self.code) // 4 - 1
+
+    def here(self): return len(self.code) // 4
+
+    def patch(self, at, target): self.code[at * 4 + 2] = target
+
+    def const(self, value):
+        key = (type(value), repr(value))
+        if key not in self.constant_index:
+            self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_index[key]
+
+    def temp(self):
+        r = self.temp_top
+        self.temp_top += 1
+        self.n_regs = max(self.n_regs, self.temp_top)
+        return r
+
+    def move(self, dst, src):
+        """Puts a value into dst, retargeting the instruction that just produced it into a temporary."""
+        if src == dst: return
+        if src >= self.n_locals and self.code and self.code[-3] == src and self.code[-4] not in NO_RESULT:
+            self.code[-3] = dst
+        else:
+            self.emit(MOVE, dst, src)
+
+    def store(self, name, reg, t):
+        target = self.regs[name]
+        if self.reg_types[target] == "f" and t != "f": self.emit(FLOAT, target, reg)
+        else: self.move(target, reg)
+
+    def unsupported(self, ctx, what):
+        return UnsupportedConstruct(f"line {ctx.start.line}: {what} is not supported by the bytecode compiler")
+
+    def scan_locals(self, ctx):
+        if isinstance(ctx, ImageLangParser.Var_declContext):
+            self.define(ctx.ID().getText(), ctx.type_().getText())
+        if isinstance(ctx, ImageLangParser.Except_clauseContext) and ctx.ID():
+            self.define(ctx.ID().getText(), "string")
+        if hasattr(ctx, "getChildren"):
+            for child in ctx.getChildren(): self.scan_locals(child)
+
+    def define(self, name, type_name):
+        if name not in self.regs:
+            self.regs[name] = len(self.reg_types)
+            self.reg_types.append(TYPE_CODES.get(type_name, "o"))
+
+    def begin_function(self, ctx, params):
+        self.code, self.regs, self.reg_types = array("i"), {}, []
+        for p in params: self.define(p.ID().getText(), p.type_().getText())
+        self.scan_locals(ctx)
+        self.n_locals = self.n_regs = self.temp_top = len(self.reg_types)
+        for p in params:
+            r = self.regs[p.ID().getText()]
+            if self.reg_types[r] == "f": self.emit(FLOAT, r, r)
+
+    def end_function(self, name, params):
+        self.emit(RETN)
+        reg_types = "".join(self.reg_types) + "o" * (self.n_regs - self.n_locals)
+        return Function(name, len(params), self.function_refs.get(name, []), reg_types, self.code)
+
+    # -----------------------------
+    # Program structure
+    # -----------------------------
+    def visitProgram(self, ctx):
+        if ctx.import_decl(): raise self.unsupported(ctx.import_decl(0), "import")
+        if ctx.main_block() is None: raise self.unsupported(ctx, "a module without a main block")
+        decls = [td.func_decl() for td in ctx.top_decl()]
+        for i, f_ctx in enumerate(decls):
+            params = f_ctx.param_list().param() if f_ctx.param_list() else []
+            self.function_index[f_ctx.ID().getText()] = i
+            self.function_refs[f_ctx.ID().getText()] = [
+                j for j, p in enumerate(params) if p.getToken(ImageLangParser.AMP, 0) is not None]
+        self.functions = [None] * (len(decls) + 1)
+        for i, f_ctx in enumerate(decls): self.functions[i] = self.visit(f_ctx)
+
+        self.in_main = True
+        self.begin_function(ctx.main_block(), [])
+        self.visit(ctx.main_block())
+        self.functions[-1] = self.end_function(MAIN, [])
+        self.in_main = False
+        return Program(self.constants, self.functions, len(decls))
+
+    def visitMain_block(self, ctx): self.visit(ctx.block())
+
+    def visitFunc_decl(self, ctx):
+        params = ctx.param_list().param() if ctx.param_list() else []
+        self.begin_function(ctx, params)
+        self.visit(ctx.block())
+        return self.end_function(ctx.ID().getText(), params)
+
+    def visitBlock(self, ctx):
+        for s in ctx.stmt(): self.visit(s)
+
+    # Temporaries never live across statements
+    def visitStmt(self, ctx):
+        self.visitChildren(ctx)
+        self.temp_top = self.n_locals
+
+    # -----------------------------
+    # Statements
+    # -----------------------------
+    def visitVar_decl(self, ctx):
+        if ctx.expression(): self.store(ctx.ID().getText(), *self.visit(ctx.expression()))
+
+    def visitAssignment(self, ctx):
+        lvalue = ctx.lvalue()
+        if not (lvalue.ID() and lvalue.lvalue() is None):
+            raise self.unsupported(ctx, f"assignment to '{lvalue.getText()}'")
+        self.store(lvalue.ID().getText(), *self.visit(ctx.expression()))
+
+    def visitExpr_stmt(self, ctx): self.visit(ctx.expression())
+
+    def visitIo_stmt(self, ctx):
+        if ctx.type_(): self.emit(BUILTIN, self.temp(), BUILTIN_INDEX["read_string"])
+        else: self.visit(ctx.expression())
+
+    def condition(self, ctx, op=JMPF):
+        reg, _ = self.visit(ctx)
+        return self.emit(op, reg)
+
+    def visitIf_stmt(self, ctx):
+        skip = self.condition(ctx.expression())
+        self.visit(ctx.block(0))
+        if ctx.ELSE():
+            end = self.emit(JMP)
+            self.patch(skip, self.here())
+            self.visit(ctx.block(1))
+            self.patch(end, self.here())
+        else:
+            self.patch(skip, self.here())
+
+    def loop(self, cond, body, step=None, op=JMPF):
+        top = self.here()
+        exit_jump = self.condition(cond, op)
+        self.visit(body)
+        if step is not None: self.visit(step)
+        self.emit(JMP, 0, top)
+        self.patch(exit_jump, self.here())
+
+    def visitWhile_stmt(self, ctx): self.loop(ctx.expression(), ctx.block())
+
+    def visitUntil_stmt(self, ctx): self.loop(ctx.expression(), ctx.block(), op=JMPT)
+
+    def visitFor_stmt(self, ctx):
+        hdr = ctx.for_header()
+        self.visit(hdr.var_decl())
+        self.temp_top = self.n_locals
+        self.loop(hdr.expression(), ctx.block(), hdr.assignment())
+
+    def visitReturn_stmt(self, ctx):
+        if self.in_main or not ctx.expression():
+            self.emit(RETN)
+        else:
+            reg, _ = self.visit(ctx.expression())
+            self.emit(RET, reg)
+
+    def visitThrow_stmt(self, ctx):
+        reg, _ = self.visit(ctx.expression())
+        self.emit(THROW, reg)
+
+    # Every exception type lowers to System.Exception, so only the first clause can ever run
+    def visitTry_stmt(self, ctx):
+        setup = self.emit(TRY)
+        self.visit(ctx.block())
+        self.emit(ENDTRY)
+        end = self.emit(JMP)
+        self.patch(setup, self.here())
+        clauses = ctx.except_clause()
+        if clauses:
+            if clauses[0].ID(): self.emit(CATCH, self.regs[clauses[0].ID().getText()])
+            self.visit(clauses[0].block())
+        elif ctx.default_clause():
+            self.visit(ctx.default_clause().block())
+        self.patch(end, self.here())
+
+    # -----------------------------
+    # Expressions
+    # -----------------------------
+    def binary(self, ctx, generic, typed, result):
+        ra, ta = self.visit(ctx.expression(0))
+        rb, tb = self.visit(ctx.expression(1))
+        op, t = typed(ta, tb)
+        if op is None: op, t = generic, result(ta, tb)
+        dst = self.temp()
+        self.emit(op, dst, ra, rb)
+        return dst, t
+
+    def negated(self, ctx, generic, typed):
+        dst, _ = self.binary(ctx, generic, typed, lambda ta, tb: "b")
+        self.emit(NOT_B, dst, dst)
+        return dst, "b"
+
+    @staticmethod
+    def arithmetic(int_op, float_op):
+        def typed(ta, tb):
+            if ta == tb == "i": return int_op, "i"
+            if ta in NUMERIC and tb in NUMERIC: return float_op, "f"
+            return None, None
+        return typed
+
+    @staticmethod
+    def numeric_result(ta, tb):
+        if ta in NUMERIC and tb in NUMERIC: return "i" if ta == tb == "i" else "f"
+        return "m" if "m" in (ta, tb) else "o"
+
+    @staticmethod
+    def compare(op):
+        return lambda ta, tb: (op, "b") if ta in NUMERIC and tb in NUMERIC else (None, None)
+
+    @staticmethod
+    def equal(ta, tb): return (EQ_I, "b") if ta == tb == "i" else (None, None)
+
+    @staticmethod
+    def logical(op):
+        return lambda ta, tb: (op, "b") if ta == tb == "b" else (None, None)
+
+    def visitAddExpr(self, ctx):
+        return self.binary(ctx, ADD, self.arithmetic(ADD_I, ADD_F),
+                           lambda ta, tb: "s" if "s" in (ta, tb) else self.numeric_result(ta, tb))
+
+    def visitSubExpr(self, ctx): return self.binary(ctx, SUB, self.arithmetic(SUB_I, SUB_F), self.numeric_result)
+
+    def visitMulExpr(self, ctx): return self.binary(ctx, MUL, self.arithmetic(MUL_I, MUL_F), self.numeric_result)
+
+    def visitDivExpr(self, ctx): return self.binary(ctx, DIV, lambda ta, tb: (None, None), self.numeric_result)
+
+    def visitModExpr(self, ctx): return self.binary(ctx, MOD, lambda ta, tb: (None, None), self.numeric_result)
+
+    def visitEqExpr(self, ctx): return self.binary(ctx, EQ, self.equal, lambda ta, tb: "b")
+
+    def visitLtExpr(self, ctx): return self.binary(ctx, LT, self.compare(LT_N), lambda ta, tb: "b")
+
+    def visitGtExpr(self, ctx): return self.binary(ctx, GT, self.compare(GT_N), lambda ta, tb: "b")
+
+    # a != b, a <= b and a >= b are negations, as in the IL compiler
+    def visitNeqExpr(self, ctx): return self.negated(ctx, EQ, self.equal)
+
+    def visitLeExpr(self, ctx): return self.negated(ctx, GT, self.compare(GT_N))
+
+    def visitGeExpr(self, ctx): return self.negated(ctx, LT, self.compare(LT_N))
+
+    def visitAndExpr(self, ctx): return self.binary(ctx, AND, self.logical(AND_B), lambda ta, tb: "b")
+
+    def visitOrExpr(self, ctx): return self.binary(ctx, OR, self.logical(OR_B), lambda ta, tb: "b")
+
+    def visitNotExpr(self, ctx):
+        reg, t = self.visit(ctx.expression())
+        dst = self.temp()
+        self.emit(NOT_B if t == "b" else NOT, dst, reg)
+        return dst, "b"
+
+    def visitUnaryExpr(self, ctx): return self.visit(ctx.unary_expr())
+
+    def visitUnary_expr(self, ctx):
+        if not ctx.getToken(ImageLangParser.MINUS, 0): return self.visit(ctx.getChild(0))
+        reg, t = self.visit(ctx.unary_expr())
+        dst = self.temp()
+        self.emit({"i": NEG_I, "f": NEG_F}.get(t, NEG), dst, reg)
+        return dst, t if t in NUMERIC else "o"
+
+    def visitCast_expr(self, ctx):
+        reg, t = self.visit(ctx.unary_expr())
+        op, t_cast = {"string": (CAST_S, "s"), "float": (CAST_F, "f"), "int": (CAST_I, "i")}.get(
+            ctx.type_().getText(), (None, t))
+        if op is None: return reg, t
+        dst = self.temp()
+        self.emit(op, dst, reg)
+        return dst, t_cast
+
+    def visitPostfix_expr(self, ctx):
+        if ctx.primary_base(): return self.visit(ctx.primary_base())
+        if ctx.getToken(ImageLangParser.PIXEL_KW, 0):
+            return self.builtin("get_pixel", [ctx.postfix_expr(), ctx.expression(0), ctx.expression(1)])
+        if ctx.ID():
+            base, _ = self.visit(ctx.postfix_expr())
+            dst = self.temp()
+            self.emit(FIELD, dst, base, FIELDS.index(ctx.ID().getText()))
+            return dst, "o"
+        raise self.unsupported(ctx, "indexing")
+
+    def literal(self, value, t):
+        dst = self.temp()
+        self.emit(LOADK, dst, self.const(value))
+        return dst, t
+
+    def visitPrimary_base(self, ctx):
+        if ctx.INT_LITERAL(): return self.literal(int(ctx.getText()), "i")
+        if ctx.FLOAT_LITERAL(): return self.literal(float(ctx.getText()), "f")
+        if ctx.STRING_LITERAL(): return self.literal(decode_string(ctx.getText()), "s")
+        if ctx.BOOL_LITERAL(): return self.literal(ctx.getText() == "true", "b")
+        if ctx.NULL_KW(): return self.literal(None, "o")
+        if ctx.ID():
+            reg = self.regs[ctx.ID().getText()]
+            return reg, self.reg_types[reg]
+        if ctx.type_() and ctx.LPAREN():
+            t_name = ctx.type_().getText()
+            args = ctx.arg_list().expression() if ctx.arg_list() else []
+            if t_name in ("color", "pixel"): return self.builtin("color", args)
+            if t_name == "image": return self.builtin("image", args)
+            raise self.unsupported(ctx, f"constructor '{t_name}(...)'")
+        if ctx.func_call(): return self.visit(ctx.func_call())
+        if ctx.expression(): return self.visit(ctx.expression())
+        if ctx.read_type_call():
+            t = ctx.read_type_call().type_().getText()
+            return self.builtin({"int": "read_int", "float": "read_float", "bool": "read_bool"}.get(t, "read_string"), [])
+
+    def arguments(self, exprs):
+        base = self.temp_top
+        for _ in exprs: self.temp()
+        for i, e in enumerate(exprs):
+            reg, _ = self.visit(e)
+            self.move(base + i, reg)
+        return base
+
+    def builtin(self, name, exprs):
+        base = self.arguments(exprs)
+        dst = self.temp()
+        self.emit(BUILTIN, dst, BUILTIN_INDEX[name], base)
+        return dst, BUILTINS[BUILTIN_INDEX[name]][2]
+
+    def visitFunc_call(self, ctx):
+        name = ctx.ID().getText()
+        exprs = ctx.arg_list().expression() if ctx.arg_list() else []
+        if name in BUILTIN_INDEX: return self.builtin(name, exprs)
+
+        base = self.arguments(exprs)
+        dst = self.temp()
+        self.emit(CALL, dst, self.function_index[name], base)
+        # By-ref arguments come back in the argument registers
+        for i in self.function_refs[name]:
+            if exprs[i].getText() not in self.regs: raise self.unsupported(ctx, f"by-ref argument '{exprs[i].getText()}'")
+            self.store(exprs[i].getText(), base + i, "o")
+        return dst, "o"
@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Instr:
+    opcode: str
+    operand: Optional[str] = None
+
+    def __str__(self):
+        return f"    {self.opcode} {self.operand}" if self.operand is not None else f"    {self.opcode}"
+
+    @staticmethod
+    def parse(text: str) -> 'Instr':
+        opcode, _, operand = text.partition(" ")
+        return Instr(opcode, operand or None)
+
+
+@dataclass
+class Label:
+    name: str
+
+    def __str__(self):
+        return f"{self.name}:"
+
+
+@dataclass
+class Directive:
+    # Assembly/class/method headers, .locals, .try/catch braces: the peephole pass never looks across these
+    text: str
+    indent: bool = True
+
+    def __str__(self):
+        return f"    {self.text}" if self.indent else self.text
@@ -0,0 +1,134 @@
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import List
+
+# Register bytecode for the Python VM (pyruntime/vm.py). Every instruction is four int32 words
+# (opcode, a, b, c) in one array; a is the destination register of value-producing instructions, jump
+# targets are instruction indices. Registers 0..n_params-1 hold the arguments, then the locals, then
+# expression temporaries.
+(MOVE, LOADK, FLOAT,
+ ADD, SUB, MUL, DIV, MOD, EQ, LT, GT, AND, OR, NOT, NEG,
+ ADD_I, SUB_I, MUL_I, ADD_F, SUB_F, MUL_F, EQ_I, LT_N, GT_N, AND_B, OR_B, NOT_B, NEG_I, NEG_F,
+ CAST_S, CAST_F, CAST_I, FIELD,
+ JMP, JMPF, JMPT, CALL, BUILTIN, RET, RETN, THROW, TRY, ENDTRY, CATCH) = range(44)
+
+OPNAMES = ("MOVE LOADK FLOAT ADD SUB MUL DIV MOD EQ LT GT AND OR NOT NEG "
+           "ADD_I SUB_I MUL_I ADD_F SUB_F MUL_F EQ_I LT_N GT_N AND_B OR_B NOT_B NEG_I NEG_F "
+           "CAST_S CAST_F CAST_I FIELD JMP JMPF JMPT CALL BUILTIN RET RETN THROW TRY ENDTRY CATCH").split()
+
+# Builtins by index: name, arity and the register type of the result; arguments are in registers c..c+arity-1
+BUILTINS = [
+    ("write", 1, "o"), ("read", 1, "s"), ("load", 1, "m"), ("save", 2, "o"), ("pow_channels", 2, "m"),
+    ("blur", 2, "m"), ("gauss_blur", 2, "m"), ("width", 1, "i"), ("height", 1, "i"), ("get_pixel", 3, "c"),
+    ("avg", 1, "f"), ("avg_region", 5, "f"), ("set_threads", 1, "o"),
+    ("read_int", 0, "i"), ("read_float", 0, "f"), ("read_bool", 0, "b"), ("read_string", 0, "s"),
+    ("color", 3, "c"), ("image", 2, "m"),
+]
+BUILTIN_INDEX = {name: i for i, (name, _, _) in enumerate(BUILTINS)}
+
+FIELDS = ("r", "g", "b")
+
+# Register types: int, float, bool, image, color, string, anything. Locals keep their declared type;
+# a temporary's type is known when the instruction that writes it guarantees one.
+TYPE_CODES = {"int": "i", "float": "f", "bool": "b", "image": "m", "color": "c", "pixel": "c", "string": "s"}
+NUMERIC = ("i", "f")
+
+# Instructions whose a operand is not a destination register
+NO_RESULT = (JMP, JMPF, JMPT, RET, RETN, THROW, TRY, ENDTRY)
+
+MAGIC = b"ILBC"
+VERSION = 1
+
+
+@dataclass
+class Function:
+    name: str
+    n_params: int
+    refs: List[int]     # indices of by-ref parameters, copied back to the caller's argument registers
+    reg_types: str      # one type code per register; locals start at their type's default value
+    code: array         # array('i') of 4-word instructions
+
+
+@dataclass
+class Program:
+    constants: list
+    functions: List[Function]
+    entry: int
+
+
+def dump(program: Program, fp):
+    """Writes program in the .ilbc format: a header, the constant pool and the functions, little-endian."""
+    fp.write(struct.pack("<4sHI", MAGIC, VERSION, program.entry))
+    fp.write(struct.pack("<I", len(program.constants)))
+    for value in program.constants:
+        if value is None: fp.write(b"N")
+        elif isinstance(value, bool): fp.write(b"B" + struct.pack("<?", value))
+        elif isinstance(value, int): fp.write(b"I" + struct.pack("<q", value))
+        elif isinstance(value, float): fp.write(b"D" + struct.pack("<d", value))
+        else: fp.write(b"S" + _pack_str(value))
+    fp.write(struct.pack("<I", len(program.functions)))
+    for f in program.functions:
+        fp.write(_pack_str(f.name))
+        fp.write(struct.pack("<HH", f.n_params, len(f.refs)) + bytes(f.refs))
+        fp.write(_pack_str(f.reg_types))
+        code = array("i", f.code)
+        if sys.byteorder == "big": code.byteswap()
+        fp.write(struct.pack("<I", len(code)) + code.tobytes())
+
+
+def load(fp) -> Program:
+    magic, version, entry = _unpack(fp, "<4sHI")
+    if magic != MAGIC: raise ValueError("Not an ImageLang bytecode file")
+    if version != VERSION: raise ValueError(f"Unsupported bytecode version {version}, expected {VERSION}")
+    constants = []
+    for _ in range(_unpack(fp, "<I")[0]):
+        tag = _read(fp, 1)
+        if tag == b"N": constants.append(None)
+        elif tag == b"B": constants.append(_unpack(fp, "<?")[0])
+        elif tag == b"I": constants.append(_unpack(fp, "<q")[0])
+        elif tag == b"D": constants.append(_unpack(fp, "<d")[0])
+        elif tag == b"S": constants.append(_read_str(fp))
+        else: raise ValueError(f"Bad constant tag {tag!r}")
+    functions = []
+    for _ in range(_unpack(fp, "<I")[0]):
+        name = _read_str(fp)
+        n_params, n_refs = _unpack(fp, "<HH")
+        refs = list(_read(fp, n_refs))
+        reg_types = _read_str(fp)
+        code = array("i")
+        code.frombytes(_read(fp, 4 * _unpack(fp, "<I")[0]))
+        if sys.byteorder == "big": code.byteswap()
+        functions.append(Function(name, n_params, refs, reg_types, code))
+    return Program(constants, functions, entry)
+
+
+def disassemble(program: Program) -> str:
+    lines = []
+    for i, f in enumerate(program.functions):
+        lines.append(f"function {i} {f.name} params={f.n_params} refs={f.refs} regs={f.reg_types}")
+        for pc in range(len(f.code) // 4):
+            op, a, b, c = f.code[pc * 4:pc * 4 + 4]
+            note = f"  ; {program.constants[b]!r}" if op == LOADK else f"  ; {BUILTINS[b][0]}" if op == BUILTIN else ""
+            lines.append(f"    {pc:4} {OPNAMES[op]:<8} {a} {b} {c}{note}")
+    return "\n".join(lines)
+
+
+def _pack_str(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return struct.pack("<I", len(data)) + data
+
+
+def _read_str(fp) -> str:
+    return _read(fp, _unpack(fp, "<I")[0]).decode("utf-8")
+
+
+def _unpack(fp, fmt):
+    return struct.unpack(fmt, _read(fp, struct.calcsize(fmt)))
+
+
+def _read(fp, size) -> bytes:
+    data = fp.read(size)
+    if len(data) != size: raise ValueError("Truncated bytecode file")
+    return data
@@ -0,0 +1,67 @@
+from collections import Counter
+from typing import List
+
+from codegen.il import Instr, Label
+
+SHORT_INDEX_OPS = {"ldloc", "stloc", "ldarg"}
+SHORT_S_OPS = {"ldloc", "stloc", "ldarg", "starg", "ldloca", "ldarga"}
+
+
+def _is(item, opcode):
+    return isinstance(item, Instr) and item.opcode == opcode
+
+
+def _rewrite_pairs(items: List, stats: Counter):
+    out, changed, i = [], False, 0
+    while i < len(items):
+        a = items[i]
+        b = items[i + 1] if i + 1 < len(items) else None
+
+        # box T; unbox.any T -> (nothing)
+        if _is(a, "box") and _is(b, "unbox.any") and a.operand == b.operand:
+            stats["box/unbox.any"] += 1
+            i += 2; changed = True
+            continue
+        # stloc n; ldloc n -> dup; stloc n
+        if _is(a, "stloc") and _is(b, "ldloc") and a.operand == b.operand:
+            stats["stloc/ldloc"] += 1
+            out.extend([Instr("dup"), a])
+            i += 2; changed = True
+            continue
+        # br L; L: -> L:
+        if _is(a, "br") and isinstance(b, Label) and b.name == a.operand:
+            stats["br-next"] += 1
+            i += 1; changed = True
+            continue
+
+        out.append(a)
+        i += 1
+    return out, changed
+
+
+def _short_form(item, stats: Counter):
+    if not isinstance(item, Instr) or item.operand is None or not item.operand.lstrip("-").isdigit():
+        return item
+    op, n = item.opcode, int(item.operand)
+    if op == "ldc.i4":
+        stats["short-form"] += 1
+        if n == -1: return Instr("ldc.i4.m1")
+        if 0 <= n <= 8: return Instr(f"ldc.i4.{n}")
+        if -128 <= n <= 127: return Instr("ldc.i4.s", item.operand)
+        stats["short-form"] -= 1
+        return item
+    if op in SHORT_INDEX_OPS and 0 <= n <= 3:
+        stats["short-form"] += 1
+        return Instr(f"{op}.{n}")
+    if op in SHORT_S_OPS and 0 <= n <= 255:
+        stats["short-form"] += 1
+        return Instr(f"{op}.s", item.operand)
+    return item
+
+
+def optimize(items: List, stats: Counter) -> List:
+    """Rewrites one method body; Labels and Directives act as barriers for the pair patterns."""
+    changed = True
+    while changed:
+        items, changed = _rewrite_pairs(items, stats)
+    return [_short_form(item, stats) for item in items]
@@ -0,0 +1,302 @@
+from ImageLangVisitor import ImageLangVisitor
+from ImageLangParser import ImageLangParser
+
+MAIN = "_main"
+
+# Builtins resolve to the pyruntime functions standing in for ImageLangRuntime.Ops / StdLib
+BUILTIN_CALLS = {
+    "load": "_ops.Load", "save": "_ops.Save", "write": "_std.write", "pow_channels": "_ops.Pow",
+    "blur": "_ops.Blur", "gauss_blur": "_ops.GaussBlur", "width": "_ops.Width", "height": "_ops.Height",
+    "get_pixel": "_ops.GetPixel", "avg": "_ops.Avg", "avg_region": "_ops.AvgRegion", "set_threads": "_ops.SetThreads",
+}
+
+DEFAULTS = {"int": "0", "float": "0.0", "bool": "False", "color": "_Color()", "pixel": "_Color()"}
+
+BINARY_OPS = {
+    ImageLangParser.AddExprContext: "_ops.Add", ImageLangParser.SubExprContext: "_ops.Sub",
+    ImageLangParser.MulExprContext: "_ops.Mul", ImageLangParser.DivExprContext: "_ops.Div",
+    ImageLangParser.ModExprContext: "_ops.Mod", ImageLangParser.EqExprContext: "_ops.Eq",
+    ImageLangParser.LtExprContext: "_ops.Lt", ImageLangParser.GtExprContext: "_ops.Gt",
+    ImageLangParser.AndExprContext: "_ops.And", ImageLangParser.OrExprContext: "_ops.Or",
+}
+
+# a != b, a <= b and a >= b are lowered to negations as in the IL compiler
+NEGATED_OPS = {
+    ImageLangParser.NeqExprContext: "_ops.Eq", ImageLangParser.LeExprContext: "_ops.Gt",
+    ImageLangParser.GeExprContext: "_ops.Lt",
+}
+
+
+class UnsupportedConstruct(Exception):
+    pass
+
+
+def decode_string(token: str) -> str:
+    escapes = {"n": "\n", "t": "\t", "r": "\r", "0": "\0", '"': '"', "\\": "\\"}
+    body, out, i = token[1:-1], [], 0
+    while i < len(body):
+        if body[i] == "\\" and i + 1 < len(body):
+            out.append(escapes.get(body[i + 1], body[i:i + 2]))
+            i += 2
+        else:
+            out.append(body[i])
+            i += 1
+    return "".join(out)
+
+
+class PythonGenerator(ImageLangVisitor):
+    """Translates a verified program into Python source, one function per func_decl plus main, and
+    compiles each to a code object run against pyruntime. Statement visitors append lines, expression
+    visitors return Python source text. Locals are function-wide and zero-initialized like IL locals;
+    by-ref parameters are returned next to the result and written back by the caller."""
+
+    def __init__(self, source_name="program.imagelang"):
+        self.source_name = source_name.replace("\\", "/").split("/")[-1]
+        self.lines = []
+        self.depth = 0
+        self.locals = {}
+        self.ref_params = []
+        self.in_main = False
+        self.function_refs = {}
+        self.temp_counter = 0
+
+    def build(self, tree):
+        """Returns the program's entry point as a Python callable."""
+        from pyruntime import ops, stdlib
+        from pyruntime.values import Color, LangError, message_of
+
+        namespace = {"_ops": ops, "_std": stdlib, "_Color": Color, "_LangError": LangError, "_message": message_of}
+        for name, source in self.generate(tree).items():
+            exec(compile(source, f"<{self.source_name}:{name}>", "exec"), namespace)
+        return namespace[MAIN]
+
+    def generate(self, tree):
+        return self.visit(tree)
+
+    def line(self, text): self.lines.append("    " * self.depth + text)
+
+    def new_temp(self):
+        self.temp_counter += 1
+        return f"_t{self.temp_counter}"
+
+    def unsupported(self, ctx, what):
+        return UnsupportedConstruct(f"line {ctx.start.line}: {what} is not supported by the in-process backend")
+
+    def scan_locals(self, ctx):
+        if isinstance(ctx, ImageLangParser.Var_declContext):
+            self.locals.setdefault(ctx.ID().getText(), ctx.type_().getText())
+        if isinstance(ctx, ImageLangParser.ParamContext):
+            self.locals.setdefault(ctx.ID().getText(), ctx.type_().getText())
+        if isinstance(ctx, ImageLangParser.Except_clauseContext) and ctx.ID():
+            self.locals.setdefault(ctx.ID().getText(), "string")
+        if hasattr(ctx, "getChildren"):
+            for child in ctx.getChildren(): self.scan_locals(child)
+
+    def store(self, name, value):
+        return f"_ops.Float({value})" if self.locals.get(name) == "float" else value
+
+    def returned(self, value):
+        return f"({value}, {', '.join('v_' + p for p in self.ref_params)})" if self.ref_params else value
+
+    def body(self, block):
+        self.depth += 1
+        start = len(self.lines)
+        self.visit(block)
+        if len(self.lines) == start: self.line("pass")
+        self.depth -= 1
+
+    def begin_function(self, header, ctx, params):
+        self.lines, self.depth, self.locals = [], 0, {}
+        self.scan_locals(ctx)
+        self.line(header)
+        self.depth = 1
+        for p in params:
+            if self.locals[p] == "float": self.line(f"v_{p} = _ops.Float(v_{p})")
+        for name, t in self.locals.items():
+            if name not in params: self.line(f"v_{name} = {DEFAULTS.get(t, 'None')}")
+
+    # -----------------------------
+    # Program structure
+    # -----------------------------
+    def visitProgram(self, ctx):
+        if ctx.import_decl(): raise self.unsupported(ctx.import_decl(0), "import")
+        if ctx.main_block() is None: raise self.unsupported(ctx, "a module without a main block")
+        sources = {}
+        for td in ctx.top_decl():
+            f_ctx = td.func_decl()
+            params = f_ctx.param_list().param() if f_ctx.param_list() else []
+            self.function_refs[f_ctx.ID().getText()] = [p.getToken(ImageLangParser.AMP, 0) is not None for p in params]
+        for td in ctx.top_decl():
+            f_ctx = td.func_decl()
+            sources["f_" + f_ctx.ID().getText()] = self.visit(f_ctx)
+
+        self.in_main, self.ref_params = True, []
+        self.begin_function(f"def {MAIN}():", ctx.main_block(), [])
+        self.visit(ctx.main_block())
+        self.line("return")
+        self.in_main = False
+        sources[MAIN] = "\n".join(self.lines) + "\n"
+        return sources
+
+    def visitMain_block(self, ctx): self.visit(ctx.block())
+
+    def visitFunc_decl(self, ctx):
+        params = ctx.param_list().param() if ctx.param_list() else []
+        names = [p.ID().getText() for p in params]
+        self.ref_params = [p.ID().getText() for p in params if p.getToken(ImageLangParser.AMP, 0) is not None]
+        self.begin_function(f"def f_{ctx.ID().getText()}({', '.join('v_' + n for n in names)}):", ctx, names)
+        self.visit(ctx.block())
+        self.line(f"return {self.returned('None')}")
+        self.ref_params = []
+        return "\n".join(self.lines) + "\n"
+
+    def visitBlock(self, ctx):
+        for s in ctx.stmt(): self.visit(s)
+
+    def visitStmt(self, ctx): self.visitChildren(ctx)
+
+    # -----------------------------
+    # Statements
+    # -----------------------------
+    def visitVar_decl(self, ctx):
+        if ctx.expression():
+            name = ctx.ID().getText()
+            self.line(f"v_{name} = {self.store(name, self.visit(ctx.expression()))}")
+
+    def visitAssignment(self, ctx):
+        lvalue = ctx.lvalue()
+        if not (lvalue.ID() and lvalue.lvalue() is None):
+            raise self.unsupported(ctx, f"assignment to '{lvalue.getText()}'")
+        name = lvalue.ID().getText()
+        self.line(f"v_{name} = {self.store(name, self.visit(ctx.expression()))}")
+
+    def visitExpr_stmt(self, ctx): self.line(self.visit(ctx.expression()))
+
+    def visitIo_stmt(self, ctx):
+        if ctx.type_(): self.line("_std.read_string()")
+        else: self.line(self.visit(ctx.expression()))
+
+    def visitIf_stmt(self, ctx):
+        self.line(f"if {self.visit(ctx.expression())}:")
+        self.body(ctx.block(0))
+        if ctx.ELSE():
+            self.line("else:")
+            self.body(ctx.block(1))
+
+    def visitWhile_stmt(self, ctx):
+        self.line(f"while {self.visit(ctx.expression())}:")
+        self.body(ctx.block())
+
+    def visitUntil_stmt(self, ctx):
+        self.line(f"while not {self.visit(ctx.expression())}:")
+        self.body(ctx.block())
+
+    def visitFor_stmt(self, ctx):
+        hdr = ctx.for_header()
+        self.visit(hdr.var_decl())
+        self.line(f"while {self.visit(hdr.expression())}:")
+        self.depth += 1
+        self.visit(ctx.block())
+        self.visit(hdr.assignment())
+        self.depth -= 1
+
+    def visitReturn_stmt(self, ctx):
+        if self.in_main:
+            self.line("return")
+        else:
+            value = self.visit(ctx.expression()) if ctx.expression() else "None"
+            self.line(f"return {self.returned(value)}")
+
+    def visitThrow_stmt(self, ctx):
+        self.line(f"raise _LangError({self.visit(ctx.expression())})")
+
+    # Every exception type lowers to System.Exception, so the first except clause handles any error
+    def visitTry_stmt(self, ctx):
+        self.line("try:")
+        self.body(ctx.block())
+        for exc in ctx.except_clause():
+            if exc.ID():
+                temp = self.new_temp()
+                self.line(f"except Exception as {temp}:")
+                self.depth += 1
+                self.line(f"v_{exc.ID().getText()} = _message({temp})")
+                self.depth -= 1
+                self.body(exc.block())
+            else:
+                self.line("except Exception:")
+                self.body(exc.block())
+        if ctx.default_clause():
+            self.line("except Exception:")
+            self.body(ctx.default_clause().block())
+
+    # -----------------------------
+    # Expressions
+    # -----------------------------
+    def binary(self, ctx):
+        a, b = self.visit(ctx.expression(0)), self.visit(ctx.expression(1))
+        if type(ctx) in NEGATED_OPS: return f"(not {NEGATED_OPS[type(ctx)]}({a}, {b}))"
+        return f"{BINARY_OPS[type(ctx)]}({a}, {b})"
+
+    visitAddExpr = visitSubExpr = visitMulExpr = visitDivExpr = visitModExpr = binary
+    visitEqExpr = visitNeqExpr = visitLtExpr = visitGtExpr = visitLeExpr = visitGeExpr = binary
+    visitAndExpr = visitOrExpr = binary
+
+    def visitNotExpr(self, ctx): return f"_ops.Not({self.visit(ctx.expression())})"
+
+    def visitUnaryExpr(self, ctx): return self.visit(ctx.unary_expr())
+
+    def visitUnary_expr(self, ctx):
+        if ctx.getToken(ImageLangParser.MINUS, 0): return f"_ops.Neg({self.visit(ctx.unary_expr())})"
+        return self.visit(ctx.getChild(0))
+
+    def visitCast_expr(self, ctx):
+        value = self.visit(ctx.unary_expr())
+        cast = {"string": "_ops.CastString", "float": "_ops.CastFloat", "int": "_ops.CastInt"}.get(ctx.type_().getText())
+        return f"{cast}({value})" if cast else value
+
+    def visitPostfix_expr(self, ctx):
+        if ctx.primary_base(): return self.visit(ctx.primary_base())
+        base = self.visit(ctx.postfix_expr())
+        if ctx.getToken(ImageLangParser.PIXEL_KW, 0):
+            return f"_ops.GetPixel({base}, {self.visit(ctx.expression(0))}, {self.visit(ctx.expression(1))})"
+        if ctx.ID(): return f"{base}.{ctx.ID().getText()}"
+        raise self.unsupported(ctx, "indexing")
+
+    def visitPrimary_base(self, ctx):
+        if ctx.INT_LITERAL() or ctx.FLOAT_LITERAL(): return ctx.getText()
+        if ctx.STRING_LITERAL(): return repr(decode_string(ctx.getText()))
+        if ctx.BOOL_LITERAL(): return "True" if ctx.getText() == "true" else "False"
+        if ctx.NULL_KW(): return "None"
+        if ctx.ID(): return "v_" + ctx.ID().getText()
+        if ctx.type_() and ctx.LPAREN():
+            t_name = ctx.type_().getText()
+            args = ", ".join(self.visit(e) for e in ctx.arg_list().expression()) if ctx.arg_list() else ""
+            if t_name in ("color", "pixel"): return f"_ops.CreateColor({args})"
+            if t_name == "image": return f"_ops.CreateImage({args})"
+            raise self.unsupported(ctx, f"constructor '{t_name}(...)'")
+        if ctx.func_call(): return self.visit(ctx.func_call())
+        if ctx.expression(): return f"({self.visit(ctx.expression())})"
+        if ctx.read_type_call():
+            t = ctx.read_type_call().type_().getText()
+            if t == "int": return "_std.read_int()"
+            if t == "float": return "_std.read_float()"
+            if t == "bool": return "(_std.read_string() == 'true')"
+            return "_std.read_string()"
+
+    def visitFunc_call(self, ctx):
+        name = ctx.ID().getText()
+        args = [self.visit(e) for e in ctx.arg_list().expression()] if ctx.arg_list() else []
+        if name in BUILTIN_CALLS: return f"{BUILTIN_CALLS[name]}({', '.join(args)})"
+        if name == "read": return f"({', '.join(args + ['_std.read_string()'])},)[-1]"
+
+        refs = self.function_refs.get(name, [])
+        call = f"f_{name}({', '.join(args)})"
+        if not any(refs): return call
+        # (t := f(...), v_a := t[1], ..., t[0])[-1]: call, write back by-ref arguments, yield the result
+        temp = self.new_temp()
+        parts = [f"{temp} := {call}"]
+        ref_args = [e for e, is_ref in zip(ctx.arg_list().expression(), refs) if is_ref]
+        for i, e in enumerate(ref_args, start=1):
+            parts.append(f"v_{e.getText()} := {self.store(e.getText(), f'{temp}[{i}]')}")
+        parts.append(f"{temp}[0]")
+        return f"({', '.join(parts)})[-1]"
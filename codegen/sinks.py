@@ -0,0 +1,71 @@
+import gzip
+import io
+import os
+
+
+class ILSink:
+    """Receives rendered IL lines; the compiler flushes into it once per method."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.first = True
+
+    def write_lines(self, lines):
+        for line in lines:
+            if not self.first: self.stream.write("\n")
+            self.stream.write(line)
+            self.first = False
+
+    def close(self):
+        self.stream.close()
+
+    def discard(self):
+        """Closes the sink after a failed compilation."""
+        self.close()
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None: self.close()
+        else: self.discard()
+
+
+class MemorySink(ILSink):
+    def __init__(self):
+        super().__init__(io.StringIO())
+
+    def getvalue(self): return self.stream.getvalue()
+
+    def close(self): pass
+
+
+class ReplacingSink(ILSink):
+    """Writes next to path and moves the file into place only on a clean close, so a compilation that
+    fails halfway leaves neither a truncated file nor a half-overwritten previous one."""
+
+    def __init__(self, path, open_stream):
+        self.path = path
+        self.temp = f"{path}.{os.getpid()}.tmp"
+        super().__init__(open_stream(self.temp))
+
+    def close(self):
+        self.stream.close()
+        os.replace(self.temp, self.path)
+
+    def discard(self):
+        self.stream.close()
+        os.remove(self.temp)
+
+
+class FileSink(ReplacingSink):
+    def __init__(self, path, buffer_size=1 << 16):
+        super().__init__(path, lambda p: open(p, "w", encoding="utf-8", buffering=buffer_size))
+
+
+class GzipSink(ReplacingSink):
+    def __init__(self, path):
+        super().__init__(path, lambda p: gzip.open(p, "wt", encoding="utf-8"))
+
+
+def open_sink(path):
+    return GzipSink(path) if path.endswith(".gz") else FileSink(path)
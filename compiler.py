@@ -1,15 +1,67 @@
+import re
 import sys
+from collections import Counter
+from dataclasses import dataclass
 from ImageLangVisitor import ImageLangVisitor
 from ImageLangParser import ImageLangParser
 
+from codegen.il import Instr, Label, Directive
+from codegen import peephole
+from codegen.sinks import MemorySink
+from semantics.types import STRING
+
+MEMO = "class [ImageLangRuntime]ImageLangRuntime.Memo"
+PIXEL_READER = "class [ImageLangRuntime]ImageLangRuntime.PixelReader"
+LANG_COLOR = "valuetype [ImageLangRuntime]ImageLangRuntime.LangColor"
+MEMO_PARAM_TYPES = ("int", "float", "bool")
+MEMO_RESULT_TYPES = ("int", "float", "bool", "string", "color", "pixel")
+
+BUILTINS = ["load", "save", "write", "pow_channels", "blur", "gauss_blur", "width", "height", "get_pixel", "avg", "avg_region", "read", "set_threads"]
+# Builtins returning an image the script has not seen before
+IMAGE_RESULTS = ("load", "pow_channels", "blur", "gauss_blur")
+
+
+@dataclass
+class InlineFrame:
+    prefix: str
+    exit_label: str
+    result: str
+    try_depth: int
+
+
 class Compiler(ImageLangVisitor):
-    def __init__(self):
+    def __init__(self, inline_threshold=8, optimize=True, sink=None, instrument=False, source_name="program.imagelang",
+                 imports=(), pure=(), memoize_size=0, prefetch=True, background_saves=True, expression_types=None):
+        # il_code only holds the method being emitted; finished methods go to the sink
         self.il_code = []
+        self.sink = sink if sink is not None else MemorySink()
+        self.method_start = None
         self.label_counter = 0
         self.locals_map = {}       
         self.locals_type_map = {}  
         self.next_local_index = 0
         self.in_main = False
+        self.locals_slot = None
+        self.try_depth = 0
+        self.epilogue = None
+
+        # Function being emitted as (name, [(param, by_ref)]) and the label self tail calls jump back to
+        self.current_function = None
+        self.tail_start = None
+
+        # Inlining of small non-recursive functions; threshold counts statements, 0 disables
+        self.inline_threshold = inline_threshold
+        self.func_decls = {}
+        self.inlinable = set()
+        self.inline_stack = []
+        self.inline_counter = 0
+
+        self.optimize = optimize
+        self.peephole_stats = Counter()
+
+        # --instrument: Profiler probes around functions, loops and builtins plus .line directives
+        self.instrument = instrument
+        self.source_name = source_name.replace("\\", "/").split("/")[-1].replace("'", "")
         
         self.type_mapping = {
             "int": "int32", "float": "float64", "bool": "bool", "string": "string", "void": "void",
@@ -20,11 +72,57 @@ class Compiler(ImageLangVisitor):
 
         self.function_metadata = {}
 
-    def get_il(self): return "\n".join(self.il_code)
+        # Imported modules (modules.ModuleInterface, dependencies first): their cached IL is spliced into
+        # the Program class and their functions are called like local ones, never inlined
+        self.imports = list(imports)
+
+        # --memoize-size: pure functions of scalar arguments get a result table of that many entries, unless
+        # they are inlined, which is cheaper than a table lookup for bodies that small
+        self.pure = set(pure)
+        self.memoize_size = memoize_size
+        self.memoized = set()
+
+        # Types the analyzer gave each expression node; string sums compile to one String.Concat
+        self.expression_types = expression_types or {}
+
+        # Main starts background decodes of the images it will load from paths known at compile time
+        self.prefetch = prefetch
+
+        # save() goes through the runtime's SaveQueue unless a try block could be waiting for its errors:
+        # lexically inside one, or in a function reachable from a call inside one (sync_save_funcs)
+        self.background_saves = background_saves
+        self.sync_save_funcs = set()
+
+        # Enclosing for loops that bound a variable by an image dimension, as (var, "width"/"height", image);
+        # img.pixel(x, y) reads proven in range by them skip the bounds checks
+        self.range_facts = []
+
+    def get_il(self):
+        self.flush()
+        return self.sink.getvalue()
+
+    def flush(self):
+        self.sink.write_lines(str(item) for item in self.il_code)
+        self.il_code = []
     
-    def emit(self, instr): self.il_code.append(f"    {instr}")
+    def emit(self, instr): self.il_code.append(Instr.parse(instr))
     
-    def emit_label(self, lbl): self.il_code.append(f"{lbl}:")
+    def emit_label(self, lbl): self.il_code.append(Label(lbl))
+
+    def emit_directive(self, text, indent=True): self.il_code.append(Directive(text, indent))
+
+    def begin_method(self, header):
+        self.flush()
+        self.emit_directive(header, indent=False)
+        self.method_start = len(self.il_code)
+
+    def end_method(self, footer):
+        self.patch_locals_init()
+        if self.optimize:
+            self.il_code[self.method_start:] = peephole.optimize(self.il_code[self.method_start:], self.peephole_stats)
+        self.method_start = None
+        self.emit_directive(footer, indent=False)
+        self.flush()
     
     def new_label(self):
         self.label_counter += 1
@@ -37,33 +135,386 @@ class Compiler(ImageLangVisitor):
         self.locals_type_map = {}
         self.next_local_index = 0
     
+    def local(self, name):
+        return self.inline_stack[-1].prefix + name if self.inline_stack else name
+
     def register_local(self, name, lang_type):
         if name not in self.locals_map:
             self.locals_map[name] = self.next_local_index
             self.locals_type_map[name] = self.map_type(lang_type)
             self.next_local_index += 1
 
-    def scan_locals(self, ctx):
+    def scan_locals(self, ctx, prefix=""):
         if ctx is None: return
         if isinstance(ctx, ImageLangParser.Var_declContext):
-            self.register_local(ctx.ID().getText(), ctx.type_().getText())
+            self.register_local(prefix + ctx.ID().getText(), ctx.type_().getText())
         if isinstance(ctx, ImageLangParser.Func_declContext):
             if ctx.param_list():
                 for p in ctx.param_list().param():
-                    self.register_local(p.ID().getText(), p.type_().getText())
+                    self.register_local(prefix + p.ID().getText(), p.type_().getText())
         if isinstance(ctx, ImageLangParser.For_stmtContext):
-            self.scan_locals(ctx.for_header())
+            self.scan_locals(ctx.for_header(), prefix)
         if isinstance(ctx, ImageLangParser.Except_clauseContext) and ctx.ID():
-            self.register_local(ctx.ID().getText(), "string")
+            self.register_local(prefix + ctx.ID().getText(), "string")
         if hasattr(ctx, "getChildren"):
-            for child in ctx.getChildren(): self.scan_locals(child)
+            for child in ctx.getChildren(): self.scan_locals(child, prefix)
 
     def emit_locals_init(self):
-        if not self.locals_map: return
-        decls = [f"[{idx}] {self.locals_type_map[name]} {name}" for name, idx in sorted(self.locals_map.items(), key=lambda x: x[1])]
-        self.emit(f".locals init ({', '.join(decls)})")
+        # Inlined bodies register locals while the method is emitted, so the directive is patched at the end
+        self.locals_slot = len(self.il_code)
+        self.il_code.append(None)
+
+    def patch_locals_init(self):
+        if self.locals_slot is None: return
+        if not self.locals_map:
+            del self.il_code[self.locals_slot]
+        else:
+            decls = [f"[{idx}] {self.locals_type_map[name]} {name}" for name, idx in sorted(self.locals_map.items(), key=lambda x: x[1])]
+            self.il_code[self.locals_slot] = Directive(f".locals init ({', '.join(decls)})")
+        self.locals_slot = None
+
+    def emit_probe(self, kind, region):
+        if not self.instrument: return
+        self.emit(f"ldstr \"{region}\"")
+        self.emit(f"call void [ImageLangRuntime]ImageLangRuntime.Profiler::{kind}(string)")
+
+    def loop_region(self, kind, ctx): return f"loop:{kind}@{ctx.start.line}"
+
+    def branch_out(self, lbl, try_depth=0):
+        self.emit(f"{'leave' if self.try_depth > try_depth else 'br'} {lbl}")
+
+    # -----------------------------
+    # Inlining
+    # -----------------------------
+    def collect_inlinable(self):
+        calls = {}
+        for name, f_ctx in self.func_decls.items():
+            calls[name] = {c.ID().getText() for c in self.find_all(f_ctx.block(), ImageLangParser.Func_callContext)}
+
+        def reaches_self(name):
+            seen, todo = set(), list(calls[name])
+            while todo:
+                n = todo.pop()
+                if n == name: return True
+                if n in seen or n not in calls: continue
+                seen.add(n)
+                todo.extend(calls[n])
+            return False
+
+        self.inlinable = set()
+        if self.inline_threshold <= 0: return
+        for name, f_ctx in self.func_decls.items():
+            body = f_ctx.block()
+            if self.find_all(body, ImageLangParser.Try_stmtContext): continue
+            if len(self.find_all(body, ImageLangParser.StmtContext)) > self.inline_threshold: continue
+            if reaches_self(name): continue
+            self.inlinable.add(name)
+
+    # -----------------------------
+    # Tail calls
+    # -----------------------------
+    def primary_of(self, expr):
+        # `f(...)`, `x` or `(x)` reach their primary_base through single-child expression nodes
+        node = expr
+        while True:
+            if isinstance(node, ImageLangParser.UnaryExprContext): node = node.unary_expr()
+            elif isinstance(node, ImageLangParser.Unary_exprContext) and node.postfix_expr(): node = node.postfix_expr()
+            elif isinstance(node, ImageLangParser.Postfix_exprContext) and node.primary_base(): node = node.primary_base()
+            elif isinstance(node, ImageLangParser.Primary_baseContext) and node.expression() and not node.type_():
+                node = node.expression()
+            else: return node if isinstance(node, ImageLangParser.Primary_baseContext) else None
+
+    def tail_call_of(self, expr):
+        base = self.primary_of(expr)
+        return base.func_call() if base is not None else None
+
+    def emit_tail_call(self, call):
+        """Emits `return call` as a jump or a tail. call where that keeps the semantics; False otherwise."""
+        if call is None or self.try_depth > 0: return False
+        name, params = self.current_function
+        callee = call.ID().getText()
+        if callee in BUILTINS or callee in self.inlinable or callee not in self.function_metadata: return False
+        args = call.arg_list().expression() if call.arg_list() else []
+
+        # Self call: reassign the parameters and start over. A by-ref parameter must be passed on in its own
+        # position, so the caller's variable stays the one written back; memoized bodies keep their real call
+        if callee == name and name not in self.memoized:
+            if any(is_ref and arg.getText() != p_name for (p_name, is_ref), arg in zip(params, args)):
+                return False
+            value_params = [(p_name, arg) for (p_name, is_ref), arg in zip(params, args) if not is_ref]
+            for _, arg in value_params: self.visit(arg)
+            for p_name, _ in reversed(value_params):
+                self.emit_unbox(self.locals_type_map[p_name])
+                self.emit(f"stloc {self.locals_map[p_name]}")
+            # A real call starts with zeroed locals
+            param_names = {p_name for p_name, _ in params}
+            for local in list(self.locals_map):
+                if local not in param_names and local != "__ret": self.emit_default_init(local)
+            self.emit(f"br {self.tail_start}")
+            return True
+
+        # Other calls: tail. needs the call to be followed directly by ret, so no by-ref write-back or
+        # exit probe here and no pointers into this frame passed to the callee
+        modes = self.function_metadata[callee]
+        if self.instrument or any(is_ref for _, is_ref in params) or any(modes): return False
+        for arg in args: self.visit(arg)
+        sig = ", ".join("object" for _ in modes)
+        self.emit("tail.")
+        self.emit(f"call object Program::{callee}({sig})")
+        self.emit("ret")
+        return True
+
+    # -----------------------------
+    # Prefetching
+    # -----------------------------
+    def prefetch_paths(self, ctx):
+        """String literal tokens of the paths load() is called with, in program order: literals anywhere,
+        and main's string variables that are declared once with a literal and never written again."""
+        main = ctx.main_block()
+        constants, written = {}, set()
+        for decl in self.find_all(main, ImageLangParser.Var_declContext):
+            name = decl.ID().getText()
+            base = self.primary_of(decl.expression()) if decl.expression() else None
+            if name in constants or base is None or base.STRING_LITERAL() is None: written.add(name)
+            constants[name] = base.getText() if base is not None else None
+        written |= self.assigned_names(main)
+
+        paths = []
+        for call in self.find_all(ctx, ImageLangParser.Func_callContext):
+            if call.ID().getText() != "load" or not call.arg_list(): continue
+            base = self.primary_of(call.arg_list().expression()[0])
+            if base is None: continue
+            if base.STRING_LITERAL(): path = base.getText()
+            elif base.ID() and base.ID().getText() not in written and self.is_within(call, main):
+                path = constants.get(base.ID().getText())
+            else: continue
+            if path is not None and path not in paths: paths.append(path)
+        return paths
+
+    def assigned_names(self, ctx):
+        """Variables ctx may write besides its declarations: assignments, read(x), and arguments of user
+        functions, any of which may be by-ref."""
+        names = set()
+        for a in self.find_all(ctx, ImageLangParser.AssignmentContext):
+            lvalue = a.lvalue()
+            while lvalue.ID() is None: lvalue = lvalue.lvalue()
+            names.add(lvalue.ID().getText())
+        for io in self.find_all(ctx, ImageLangParser.Io_stmtContext):
+            if io.expression(): names.add(io.expression().getText())
+        for call in self.find_all(ctx, ImageLangParser.Func_callContext):
+            if call.ID().getText() not in BUILTINS and call.arg_list():
+                names.update(e.getText() for e in call.arg_list().expression())
+        return names
+
+    def is_within(self, node, ancestor):
+        while node is not None and node is not ancestor: node = node.parentCtx
+        return node is ancestor
+
+    # -----------------------------
+    # Pixel reads
+    # -----------------------------
+    def loop_bound(self, ctx):
+        """(var, axis, image) when every iteration of the for loop has 0 <= var < width/height(image):
+        `for int v = <literal>; v < width(img); v = v + <literal> do` with neither v nor img written
+        in the body."""
+        hdr = ctx.for_header()
+        decl = hdr.var_decl()
+        if decl.type_().getText() != "int" or decl.expression() is None: return None
+        start = self.primary_of(decl.expression())
+        if start is None or start.INT_LITERAL() is None: return None
+        var = decl.ID().getText()
+        cond = re.fullmatch(rf"{var}<(width|height)\((\w+)\)", hdr.expression().getText())
+        step = hdr.assignment()
+        if not cond or step.lvalue().getText() != var: return None
+        if not re.fullmatch(rf"{var}\+[1-9]\d*|[1-9]\d*\+{var}", step.expression().getText()): return None
+        axis, img = cond.groups()
+        body = ctx.block()
+        written = self.assigned_names(body) | {d.ID().getText() for d in self.find_all(body, ImageLangParser.Var_declContext)}
+        if var in written or img in written: return None
+        if self.locals_type_map.get(self.local(img)) != self.map_type("image"): return None
+        return self.local(var), axis, self.local(img)
+
+    def reads_pixels_of(self, ctx, img):
+        for p in self.find_all(ctx, ImageLangParser.Postfix_exprContext):
+            if p.PIXEL_KW() and self.local(p.postfix_expr().getText()) == img: return True
+        return False
+
+    def hoist_pixel_reader(self, img):
+        # The image cannot change inside the proving loops, so its reader is set up once before them
+        name = f"__pixels_{img}"
+        self.register_local(name, "object")
+        self.locals_type_map[name] = PIXEL_READER
+        self.emit(f"ldloc {self.locals_map[img]}")
+        self.emit(f"call {PIXEL_READER} [ImageLangRuntime]ImageLangRuntime.StdLib::pixels_of(class [ImageLangRuntime]ImageLangRuntime.ImageWrapper)")
+        self.emit(f"stloc {self.locals_map[name]}")
+
+    def proven_pixel_read(self, ctx):
+        """(image, x, y) locals for img.pixel(x, y) with x and y in range by the enclosing loops."""
+        base, x, y = (self.primary_of(e) for e in (ctx.postfix_expr(), ctx.expression(0), ctx.expression(1)))
+        if any(b is None or b.ID() is None for b in (base, x, y)): return None
+        img, x, y = (self.local(b.getText()) for b in (base, x, y))
+        if (x, "width", img) in self.range_facts and (y, "height", img) in self.range_facts: return img, x, y
+        return None
+
+    def emit_pixel_read(self, ctx):
+        proven = self.proven_pixel_read(ctx)
+        if proven:
+            img, x, y = proven
+            self.emit(f"ldloc {self.locals_map[f'__pixels_{img}']}")
+            self.emit(f"ldloc {self.locals_map[x]}")
+            self.emit(f"ldloc {self.locals_map[y]}")
+            self.emit(f"callvirt instance {LANG_COLOR} {PIXEL_READER.split(' ')[1]}::ColorAt(int32, int32)")
+            self.emit_box_if_needed(LANG_COLOR)
+            return
+        self.visit(ctx.postfix_expr())
+        self.visit(ctx.expression(0))
+        self.visit(ctx.expression(1))
+        self.emit("call object [ImageLangRuntime]ImageLangRuntime.Ops::GetPixel(object, object, object)")
+
+    # -----------------------------
+    # Background saves
+    # -----------------------------
+    def called_under_try(self, ctx):
+        """Functions that may run while a try block is active. A module cannot see its importers' try
+        blocks, so there every function counts."""
+        if ctx.main_block() is None: return set(self.func_decls)
+        todo = [c.ID().getText() for t in self.find_all(ctx, ImageLangParser.Try_stmtContext)
+                for c in self.find_all(t, ImageLangParser.Func_callContext)]
+        seen = set()
+        while todo:
+            name = todo.pop()
+            if name in seen or name not in self.func_decls: continue
+            seen.add(name)
+            todo.extend(c.ID().getText() for c in self.find_all(self.func_decls[name].block(), ImageLangParser.Func_callContext))
+        return seen
+
+    def save_in_background(self):
+        # Inlined bodies have no try blocks of their own and share the caller's try_depth
+        if not self.background_saves or self.try_depth > 0: return False
+        return self.current_function is None or self.current_function[0] not in self.sync_save_funcs
+
+    # -----------------------------
+    # Memoization
+    # -----------------------------
+    def memoizable(self, name, f_ctx):
+        if self.memoize_size <= 0 or name not in self.pure or not f_ctx.param_list(): return False
+        if name in self.inlinable: return False
+        if f_ctx.type_().getText() not in MEMO_RESULT_TYPES: return False
+        return all(p.type_().getText() in MEMO_PARAM_TYPES for p in f_ctx.param_list().param())
+
+    def emit_memo_wrapper(self, name, n_params):
+        # name(args) looks the arguments up in a Memo created on first use and calls name__impl on a miss;
+        # recursive calls inside the body go through the wrapper too
+        sig = ", ".join(["object"] * n_params)
+        field = f"{MEMO} Program::__memo_{name}"
+        have, miss = self.new_label(), self.new_label()
+        self.flush()
+        self.emit_directive(f".field private static {MEMO} __memo_{name}", indent=False)
+        self.begin_method(f".method public static object {name}({sig}) cil managed {{")
+        self.emit_directive(".locals init ([0] object key, [1] object result)")
+        self.emit(f"ldsfld {field}")
+        self.emit(f"brtrue {have}")
+        self.emit(f"ldc.i4 {self.memoize_size}")
+        self.emit(f"newobj instance void {MEMO.split(' ')[1]}::.ctor(int32)")
+        self.emit(f"stsfld {field}")
+        self.emit_label(have)
+        # One argument is its own key; several go into an object[] compared element by element
+        if n_params == 1:
+            self.emit("ldarg 0")
+        else:
+            self.emit(f"ldc.i4 {n_params}")
+            self.emit("newarr [mscorlib]System.Object")
+            for i in range(n_params):
+                self.emit("dup")
+                self.emit(f"ldc.i4 {i}")
+                self.emit(f"ldarg {i}")
+                self.emit("stelem.ref")
+        self.emit("stloc 0")
+        self.emit(f"ldsfld {field}")
+        self.emit("ldloc 0")
+        self.emit("ldloca 1")
+        self.emit(f"callvirt instance bool {MEMO.split(' ')[1]}::TryGet(object, object&)")
+        self.emit(f"brfalse {miss}")
+        self.emit("ldloc 1")
+        self.emit("ret")
+        self.emit_label(miss)
+        for i in range(n_params): self.emit(f"ldarg {i}")
+        self.emit(f"call object Program::{name}__impl({sig})")
+        self.emit("stloc 1")
+        self.emit(f"ldsfld {field}")
+        self.emit("ldloc 0")
+        self.emit("ldloc 1")
+        self.emit(f"callvirt instance void {MEMO.split(' ')[1]}::Add(object, object)")
+        self.emit("ldloc 1")
+        self.emit("ret")
+        self.end_method("}")
+
+    def find_all(self, ctx, cls):
+        found = []
+        if isinstance(ctx, cls): found.append(ctx)
+        if hasattr(ctx, "getChildren"):
+            for child in ctx.getChildren(): found.extend(self.find_all(child, cls))
+        return found
+
+    def emit_inline_call(self, ctx, name):
+        f_ctx = self.func_decls[name]
+        params = f_ctx.param_list().param() if f_ctx.param_list() else []
+        args = ctx.arg_list().expression() if ctx.arg_list() else []
+
+        self.inline_counter += 1
+        prefix = f"__inl{self.inline_counter}_{name}_"
+        self.scan_locals(f_ctx, prefix)
+        self.register_local(prefix + "ret", "object")
+
+        # A real call starts with zeroed locals; inlined copies inside loops must too
+        param_names = {prefix + p.ID().getText() for p in params}
+        for local in self.locals_map:
+            if local.startswith(prefix) and local not in param_names:
+                self.emit_default_init(local)
+
+        # Arguments are evaluated in the caller's frame, then copied into the callee's locals
+        write_back = []
+        for p, e in zip(params, args):
+            p_name = prefix + p.ID().getText()
+            p_type = self.locals_type_map[p_name]
+            if p.getToken(ImageLangParser.AMP, 0) is not None:
+                src = self.local(e.getText())
+                self.emit(f"ldloc {self.locals_map[src]}")
+                self.emit_box_if_needed(self.locals_type_map[src])
+                write_back.append((p_name, src))
+            else:
+                self.visit(e)
+            self.emit_unbox(p_type)
+            self.emit(f"stloc {self.locals_map[p_name]}")
+
+        frame = InlineFrame(prefix, self.new_label(), prefix + "ret", self.try_depth)
+        self.inline_stack.append(frame)
+        self.emit_probe("Enter", f"func:{name}")
+        self.visit(f_ctx.block())
+        self.emit("ldnull")
+        self.emit(f"stloc {self.locals_map[frame.result]}")
+        self.emit_label(frame.exit_label)
+        self.emit_probe("Exit", f"func:{name}")
+        self.inline_stack.pop()
+
+        for p_name, src in write_back:
+            self.emit(f"ldloc {self.locals_map[p_name]}")
+            self.emit_box_if_needed(self.locals_type_map[p_name])
+            self.emit_unbox(self.locals_type_map[src])
+            self.emit(f"stloc {self.locals_map[src]}")
+        self.emit(f"ldloc {self.locals_map[frame.result]}")
+
+    def emit_default_init(self, name):
+        idx, t = self.locals_map[name], self.locals_type_map[name]
+        if t in ("int32", "bool"): self.emit("ldc.i4.0")
+        elif t == "float64": self.emit("ldc.r8 0.0")
+        elif "valuetype" in t:
+            self.emit(f"ldloca {idx}")
+            self.emit(f"initobj {t.replace('valuetype ', '')}")
+            return
+        else: self.emit("ldnull")
+        self.emit(f"stloc {idx}")
 
-    
     def emit_unbox(self, t):
         if t == "int32": self.emit("unbox.any [mscorlib]System.Int32")
         elif t == "float64": self.emit("unbox.any [mscorlib]System.Double")
@@ -80,17 +531,27 @@ class Compiler(ImageLangVisitor):
 
     
     def visitProgram(self, ctx):
-        self.il_code = [
-            ".assembly extern mscorlib {}", ".assembly extern System.Drawing {}",
-            ".assembly extern ImageLangRuntime {}", ".assembly ImageLangProgram {}",
-            ".module program.exe", ".class public auto ansi Program extends [mscorlib]System.Object {"
-        ]
+        # A module compiles to its methods alone; importers place them inside their own Program class
+        self.il_code = []
+        if ctx.main_block():
+            self.il_code = [Directive(line, indent=False) for line in (
+                ".assembly extern mscorlib {}", ".assembly extern System.Drawing {}",
+                ".assembly extern ImageLangRuntime {}", ".assembly ImageLangProgram {}",
+                ".module program.exe", ".class public auto ansi Program extends [mscorlib]System.Object {"
+            )]
+            for iface in self.imports:
+                self.il_code.extend(Directive(line, indent=False) for line in iface.il)
 
         self.function_metadata = {}
+        self.func_decls = {}
+        for iface in self.imports:
+            for fn in iface.functions:
+                self.function_metadata[fn.name] = [p.by_ref for p in fn.params]
 
         for td in ctx.top_decl():
             f_ctx = td.func_decl()
             f_name = f_ctx.ID().getText()
+            self.func_decls[f_name] = f_ctx
             param_modes = []
             if f_ctx.param_list():
                 for p in f_ctx.param_list().param():
@@ -100,19 +561,43 @@ class Compiler(ImageLangVisitor):
             # Сохраняем список режимов параметров
             self.function_metadata[f_name] = param_modes
 
+        self.collect_inlinable()
+        self.memoized = {name for name, f_ctx in self.func_decls.items() if self.memoizable(name, f_ctx)}
+        self.sync_save_funcs = self.called_under_try(ctx)
+
         for td in ctx.top_decl(): self.visit(td)
-        self.il_code.append(".method static void Main() cil managed { .entrypoint")
+        if ctx.main_block() is None:
+            self.flush()
+            return
+        self.begin_method(".method static void Main() cil managed { .entrypoint")
         self.in_main = True
         self.reset_scope()
         self.scan_locals(ctx.main_block())
         self.emit_locals_init()
+        self.emit_probe("Enter", "main")
+        if self.prefetch:
+            for path in self.prefetch_paths(ctx):
+                self.emit(f"ldstr {path}")
+                self.emit("call void [ImageLangRuntime]ImageLangRuntime.Prefetch::Request(string)")
         self.visit(ctx.main_block())
         self.in_main = False
-        self.emit("ret")
-        self.il_code.append("} }")
+        self.emit_main_exit()
+        self.end_method("} }")
 
     def visitMain_block(self, ctx): self.visit(ctx.block())
 
+    def emit_main_exit(self):
+        # Queued saves are on disk, and their errors raised, before the program ends
+        if self.background_saves:
+            self.emit("call void [ImageLangRuntime]ImageLangRuntime.SaveQueue::Flush()")
+        self.emit_probe("Exit", "main")
+        self.emit("ret")
+
+    def visitStmt(self, ctx):
+        if self.instrument:
+            self.emit_directive(f".line {ctx.start.line}:{ctx.start.column + 1} '{self.source_name}'")
+        self.visitChildren(ctx)
+
     def visitBlock(self, ctx): 
         for s in ctx.stmt(): self.visit(s)
 
@@ -120,6 +605,8 @@ class Compiler(ImageLangVisitor):
         name = ctx.ID().getText()
         self.reset_scope()
         self.scan_locals(ctx)
+        self.register_local("__ret", "object")
+        self.epilogue = self.new_label()
         
         params_info = []
         if ctx.param_list():
@@ -132,7 +619,8 @@ class Compiler(ImageLangVisitor):
             sig_parts.append("object&" if is_ref else "object")
         sig = ", ".join(sig_parts)
         
-        self.il_code.append(f".method public static object {name}({sig}) cil managed {{")
+        method_name = f"{name}__impl" if name in self.memoized else name
+        self.begin_method(f".method public static object {method_name}({sig}) cil managed {{")
         self.emit_locals_init()
 
         for i, (p_name, is_ref) in enumerate(params_info):
@@ -144,8 +632,18 @@ class Compiler(ImageLangVisitor):
             self.emit_unbox(t)
             self.emit(f"stloc {self.locals_map[p_name]}")
 
+        self.emit_probe("Enter", f"func:{name}")
+        self.current_function = (name, params_info)
+        self.tail_start = self.new_label()
+        self.emit_label(self.tail_start)
         self.visit(ctx.block())
+        self.current_function = None
+        self.emit("ldnull")
+        self.emit(f"stloc {self.locals_map['__ret']}")
 
+        # Single exit point: every return writes back by-ref parameters
+        self.emit_label(self.epilogue)
+        self.emit_probe("Exit", f"func:{name}")
         for i, (p_name, is_ref) in enumerate(params_info):
             if is_ref:
                 t = self.locals_type_map[p_name]
@@ -154,14 +652,16 @@ class Compiler(ImageLangVisitor):
                 self.emit_box_if_needed(t)
                 self.emit("stind.ref")
 
-        self.emit("ldnull")
+        self.emit(f"ldloc {self.locals_map['__ret']}")
         self.emit("ret")
-        self.il_code.append("}")
+        self.epilogue = None
+        self.end_method("}")
+        if name in self.memoized: self.emit_memo_wrapper(name, len(params_info))
     
     def visitVar_decl(self, ctx):
         if ctx.expression():
             self.visit(ctx.expression())
-            name = ctx.ID().getText()
+            name = self.local(ctx.ID().getText())
             t = self.locals_type_map[name]
             self.emit_unbox(t)
             self.emit(f"stloc {self.locals_map[name]}")
@@ -169,17 +669,27 @@ class Compiler(ImageLangVisitor):
     def visitAssignment(self, ctx):
         lvalue = ctx.lvalue()
         if lvalue.ID() and not lvalue.DOT():
-            name = lvalue.ID().getText()
+            name = self.local(lvalue.ID().getText())
             self.visit(ctx.expression())
             self.emit_unbox(self.locals_type_map[name])
             self.emit(f"stloc {self.locals_map[name]}")
 
     def visitReturn_stmt(self, ctx):
-        if self.in_main: self.emit("ret")
+        if self.inline_stack:
+            frame = self.inline_stack[-1]
+            if ctx.expression(): self.visit(ctx.expression())
+            else: self.emit("ldnull")
+            self.emit(f"stloc {self.locals_map[frame.result]}")
+            self.branch_out(frame.exit_label, frame.try_depth)
+        elif self.in_main:
+            self.emit_main_exit()
+        elif ctx.expression() and self.emit_tail_call(self.tail_call_of(ctx.expression())):
+            pass
         else:
             if ctx.expression(): self.visit(ctx.expression())
             else: self.emit("ldnull")
-            self.emit("ret")
+            self.emit(f"stloc {self.locals_map['__ret']}")
+            self.branch_out(self.epilogue)
 
     def visitExpr_stmt(self, ctx):
         self.visit(ctx.expression())
@@ -200,31 +710,45 @@ class Compiler(ImageLangVisitor):
         
     def visitWhile_stmt(self, ctx):
         s, e = self.new_label(), self.new_label()
+        region = self.loop_region("while", ctx)
+        self.emit_probe("Enter", region)
         self.emit_label(s)
         self.visit(ctx.expression())
         self.emit_unbox("bool")
         self.emit(f"brfalse {e}")
+        self.emit_probe("Tick", region)
         self.visit(ctx.block())
         self.emit(f"br {s}")
         self.emit_label(e)
+        self.emit_probe("Exit", region)
 
     def visitUntil_stmt(self, ctx):
         s, e = self.new_label(), self.new_label()
+        region = self.loop_region("until", ctx)
+        self.emit_probe("Enter", region)
         self.emit_label(s)
         self.visit(ctx.expression())
         self.emit_unbox("bool")
         self.emit(f"brtrue {e}")
+        self.emit_probe("Tick", region)
         self.visit(ctx.block())
         self.emit(f"br {s}")
         self.emit_label(e)
+        self.emit_probe("Exit", region)
         
     def visitFor_stmt(self, ctx):
         hdr = ctx.for_header()
         start, end = self.new_label(), self.new_label()
+        region = self.loop_region("for", ctx)
         
         if hdr.var_decl(): 
             self.visit(hdr.var_decl())
         
+        fact = self.loop_bound(ctx) if hdr.var_decl() and hdr.expression() and hdr.assignment() else None
+        if fact and self.reads_pixels_of(ctx.block(), fact[2]) and not any(f[2] == fact[2] for f in self.range_facts):
+            self.hoist_pixel_reader(fact[2])
+
+        self.emit_probe("Enter", region)
         self.emit_label(start)
                 
         if hdr.expression():
@@ -232,20 +756,82 @@ class Compiler(ImageLangVisitor):
             self.emit_unbox("bool")
             self.emit(f"brfalse {end}")
             
+        self.emit_probe("Tick", region)
+        if fact: self.range_facts.append(fact)
         self.visit(ctx.block())
+        if fact: self.range_facts.pop()
         
         if hdr.assignment(): 
             self.visit(hdr.assignment())
              
         self.emit(f"br {start}")
         self.emit_label(end)
+        self.emit_probe("Exit", region)
 
     def emit_op(self, ctx, name):
-        self.visit(ctx.expression(0))
-        self.visit(ctx.expression(1))
+        temps = []
+        self.visit_arg(ctx.expression(0), temps)
+        self.visit_arg(ctx.expression(1), temps)
         self.emit(f"call object [ImageLangRuntime]ImageLangRuntime.Ops::{name}(object, object)")
+        self.release_temps(temps)
+
+    def visit_arg(self, expr, temps):
+        # An image built by one builtin and passed straight to another is unreachable once the consumer
+        # returns, so it is kept in a temp and released then; its pooled buffer goes back right away
+        self.visit(expr)
+        call = self.tail_call_of(expr)
+        if call is None or call.ID().getText() not in IMAGE_RESULTS: return
+        name = f"__img{self.next_local_index}"
+        self.register_local(name, "object")
+        self.emit("dup")
+        self.emit(f"stloc {self.locals_map[name]}")
+        temps.append(name)
+
+    def release_temps(self, temps):
+        for name in temps:
+            self.emit(f"ldloc {self.locals_map[name]}")
+            self.emit("call void [ImageLangRuntime]ImageLangRuntime.Ops::Release(object)")
+
+    def visitAddExpr(self, ctx):
+        if self.is_string(ctx): self.emit_concat(self.concat_operands(ctx))
+        else: self.emit_op(ctx, "Add")
+
+    def is_string(self, expr):
+        t = self.expression_types.get(expr)
+        return t is not None and t.equals(STRING)
+
+    def loads_string(self, expr):
+        # Literals, string casts and string locals are typed string on the stack; other values arrive as object
+        if isinstance(expr, ImageLangParser.UnaryExprContext) and expr.unary_expr().cast_expr():
+            return expr.unary_expr().cast_expr().type_().getText() == "string"
+        base = self.primary_of(expr)
+        if base is None: return False
+        if base.STRING_LITERAL(): return True
+        return base.ID() is not None and self.locals_type_map.get(self.local(base.getText())) == "string"
+
+    def concat_operands(self, expr):
+        # The analyzer only accepts + on strings when both sides are strings, so a string sum flattens fully
+        if isinstance(expr, ImageLangParser.AddExprContext) and self.is_string(expr):
+            return self.concat_operands(expr.expression(0)) + self.concat_operands(expr.expression(1))
+        return [expr]
+
+    def emit_concat(self, operands):
+        # One Concat builds the result instead of one intermediate string per +. Every operand is a string
+        # or null, so values boxed as object only need a cast
+        array = len(operands) > 4
+        if array:
+            self.emit(f"ldc.i4 {len(operands)}")
+            self.emit("newarr [mscorlib]System.String")
+        for i, e in enumerate(operands):
+            if array:
+                self.emit("dup")
+                self.emit(f"ldc.i4 {i}")
+            self.visit(e)
+            if not self.loads_string(e): self.emit("castclass [mscorlib]System.String")
+            if array: self.emit("stelem.ref")
+        sig = "string[]" if array else ", ".join(["string"] * len(operands))
+        self.emit(f"call string [mscorlib]System.String::Concat({sig})")
 
-    def visitAddExpr(self, ctx): self.emit_op(ctx, "Add")
     def visitSubExpr(self, ctx): self.emit_op(ctx, "Sub")
     def visitMulExpr(self, ctx): self.emit_op(ctx, "Mul")
     def visitDivExpr(self, ctx): self.emit_op(ctx, "Div")
@@ -263,8 +849,17 @@ class Compiler(ImageLangVisitor):
             self.visit(ctx.getChild(0))
         
     def visitCast_expr(self, ctx):
-        self.visit(ctx.unary_expr())
         t = ctx.type_().getText()
+        # Numeric locals format in place instead of being boxed first
+        base = self.primary_of(ctx.unary_expr())
+        if t == "string" and base is not None and base.ID() is not None:
+            name = self.local(base.getText())
+            local_type = self.locals_type_map.get(name)
+            if local_type in ("int32", "float64"):
+                self.emit(f"ldloca {self.locals_map[name]}")
+                self.emit(f"call instance string [mscorlib]System.{'Int32' if local_type == 'int32' else 'Double'}::ToString()")
+                return
+        self.visit(ctx.unary_expr())
         if t == "string": self.emit("callvirt instance string [mscorlib]System.Object::ToString()")
         elif t == "float": 
              self.emit("call float64 [mscorlib]System.Convert::ToDouble(object)")
@@ -275,6 +870,7 @@ class Compiler(ImageLangVisitor):
 
     def visitPostfix_expr(self, ctx):
         if ctx.primary_base(): self.visit(ctx.primary_base())
+        elif ctx.PIXEL_KW(): self.emit_pixel_read(ctx)
         elif ctx.DOT():
             self.visit(ctx.postfix_expr())
             f = ctx.ID().getText()
@@ -295,7 +891,7 @@ class Compiler(ImageLangVisitor):
             self.emit("box [mscorlib]System.Boolean")
         elif ctx.NULL_KW(): self.emit("ldnull")
         elif ctx.ID():
-            name = ctx.ID().getText()
+            name = self.local(ctx.ID().getText())
             if name in self.locals_map:
                 self.emit(f"ldloc {self.locals_map[name]}")
                 self.emit_box_if_needed(self.locals_type_map[name])
@@ -330,36 +926,51 @@ class Compiler(ImageLangVisitor):
 
     def visitFunc_call(self, ctx):
         name = ctx.ID().getText()
-        is_builtin = name in ["load", "save", "write", "pow_channels", "blur", "width", "height", "get_pixel", "avg", "read"]
+        is_builtin = name in BUILTINS
+
+        if name in self.inlinable:
+            self.emit_inline_call(ctx, name)
+            return
 
         if is_builtin:
             param_modes = [False] * 10
         else:
             param_modes = self.function_metadata.get(name, [])
 
+        temps = []
         if ctx.arg_list():
             for i, e in enumerate(ctx.arg_list().expression()):
                 is_ref_param = param_modes[i] if i < len(param_modes) else False
                 
                 if is_ref_param:
-                    var_name = e.getText()
+                    var_name = self.local(e.getText())
                     if var_name in self.locals_map:
                         self.emit(f"ldloca {self.locals_map[var_name]}")
                     else:
                         self.visit(e)
+                elif is_builtin:
+                    self.visit_arg(e, temps)
                 else:
                     self.visit(e)
 
         rt = "[ImageLangRuntime]ImageLangRuntime.Ops"
+        probe = f"builtin:{name}@{ctx.start.line}" if is_builtin else None
+        if probe: self.emit_probe("Enter", probe)
         if name == "load": self.emit(f"call object {rt}::Load(object)")
-        elif name == "save": self.emit(f"call void {rt}::Save(object, object)")
+        elif name == "save":
+            self.emit(f"call void {rt}::{'SaveAsync' if self.save_in_background() else 'Save'}(object, object)")
         elif name == "write": self.emit(f"call void [ImageLangRuntime]ImageLangRuntime.StdLib::write(object)")
         elif name == "pow_channels": self.emit(f"call object {rt}::Pow(object, object)")
         elif name == "blur": self.emit(f"call object {rt}::Blur(object, object)")
+        elif name == "gauss_blur": self.emit(f"call object {rt}::GaussBlur(object, object)")
         elif name == "width": self.emit(f"call object {rt}::Width(object)")
         elif name == "height": self.emit(f"call object {rt}::Height(object)")
         elif name == "get_pixel": self.emit(f"call object {rt}::GetPixel(object, object, object)")
         elif name == "avg": self.emit(f"call float64 {rt}::Avg(object)"); self.emit("box [mscorlib]System.Double")
+        elif name == "avg_region":
+            self.emit(f"call float64 {rt}::AvgRegion(object, object, object, object, object)")
+            self.emit("box [mscorlib]System.Double")
+        elif name == "set_threads": self.emit(f"call object {rt}::SetThreads(object)")
         elif name == "read": 
             if ctx.arg_list(): self.emit("pop")
             self.emit(f"call string [ImageLangRuntime]ImageLangRuntime.StdLib::read_string()")
@@ -367,6 +978,8 @@ class Compiler(ImageLangVisitor):
             sig_types = [("object&" if m else "object") for m in param_modes]
             sig = ", ".join(sig_types)
             self.emit(f"call object Program::{name}({sig})")
+        self.release_temps(temps)
+        if probe: self.emit_probe("Exit", probe)
 
     def visitThrow_stmt(self, ctx):
         exc_name = ctx.exception_type().getText()
@@ -381,32 +994,35 @@ class Compiler(ImageLangVisitor):
 
     def visitTry_stmt(self, ctx):
         end = self.new_label()
-        self.emit(".try {")
+        self.try_depth += 1
+        self.emit_directive(".try {")
         self.visit(ctx.block())
         self.emit(f"leave {end}")
-        self.emit("}")
+        self.emit_directive("}")
         
         for exc in ctx.except_clause():
             exc_name = exc.exception_type().getText()
             cil_type = self.type_mapping.get(exc_name, "[mscorlib]System.Exception")
-            self.emit(f"catch {cil_type} {{")     
+            self.emit_directive(f"catch {cil_type} {{")
             if exc.ID():
                 self.emit("callvirt instance string [mscorlib]System.Exception::get_Message()")
-                var_name = exc.ID().getText()
+                var_name = self.local(exc.ID().getText())
                 self.emit(f"stloc {self.locals_map[var_name]}")
             else:
                 self.emit("pop") 
                 
             self.visit(exc.block())
             self.emit(f"leave {end}")
-            self.emit("}")
+            self.emit_directive("}")
             
         if ctx.default_clause():
-            self.emit("catch [mscorlib]System.Object { pop") 
+            self.emit_directive("catch [mscorlib]System.Object {")
+            self.emit("pop")
             self.visit(ctx.default_clause().block())
             self.emit(f"leave {end}")
-            self.emit("}")
+            self.emit_directive("}")
             
+        self.try_depth -= 1
         self.emit_label(end)
 
     def visitNeqExpr(self, ctx):
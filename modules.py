@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import List
+
+from semantics.symbols import FuncSymbol, VarSymbol
+from semantics.types import Type
+from codegen.sinks import MemorySink
+
+INTERFACE_VERSION = 4
+
+
+class ModuleError(Exception):
+    pass
+
+
+@dataclass
+class ModuleInterface:
+    path: str
+    digest: str                     # changes whenever the module or anything it imports changes
+    functions: List[FuncSymbol]
+    imports: List[str]              # absolute paths of the modules it imports itself
+    il: List[str]                   # the module's own methods, spliced into the importing program's class
+
+
+def interface_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".imli"
+
+
+def type_from_json(d) -> Type:
+    return Type(d["name"], type_from_json(d["param"]) if d["param"] else None)
+
+
+def func_from_json(d) -> FuncSymbol:
+    params = [VarSymbol(p["name"], type_from_json(p["type"]), p["by_ref"], p["line"], p["column"]) for p in d["params"]]
+    return FuncSymbol(d["name"], type_from_json(d["ret_type"]), params, d["pure"], d["line"], d["column"], d["path"])
+
+
+class ModuleLoader:
+    """Resolves `import "path";` to module interfaces. A module is analyzed and compiled once; its
+    signatures and IL are cached next to it in a .imli file that stays valid while the module source,
+    the interfaces it imports and the compiler options are unchanged."""
+
+    def __init__(self, parse, compiler_options=None):
+        self.parse = parse
+        self.options = compiler_options or {}
+        self.interfaces = {}
+        self.loading = []
+
+    def load(self, path: str) -> ModuleInterface:
+        path = os.path.abspath(path)
+        if path in self.interfaces: return self.interfaces[path]
+        if path in self.loading:
+            cycle = " -> ".join(os.path.basename(p) for p in self.loading[self.loading.index(path):] + [path])
+            raise ModuleError(f"Import cycle: {cycle}")
+        try:
+            with open(path, "rb") as f:
+                source = f.read()
+        except OSError:
+            raise ModuleError(f"Module not found: {path}") from None
+
+        self.loading.append(path)
+        try:
+            iface = self.read_cached(path, source) or self.build(path, source)
+        finally:
+            self.loading.pop()
+        self.interfaces[path] = iface
+        return iface
+
+    def closure(self, interfaces) -> List[ModuleInterface]:
+        """The interfaces with everything they import, each once, dependencies first."""
+        ordered, seen = [], set()
+
+        def visit(iface):
+            if iface.path in seen: return
+            seen.add(iface.path)
+            for dep in iface.imports: visit(self.interfaces[dep])
+            ordered.append(iface)
+
+        for iface in interfaces: visit(iface)
+        return ordered
+
+    def digest(self, source: bytes, deps) -> str:
+        h = hashlib.sha256(source)
+        h.update(json.dumps(self.options, sort_keys=True).encode())
+        for dep in deps: h.update(dep.digest.encode())
+        return h.hexdigest()
+
+    def read_cached(self, path, source):
+        try:
+            with open(interface_path(path), encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INTERFACE_VERSION: return None
+            # Import and declaration paths are absolute, so a moved module is rebuilt before its stale
+            # imports are followed
+            if data.get("path") != path: return None
+            deps = [self.load(p) for p in data["imports"]]
+            if data["digest"] != self.digest(source, deps): return None
+            functions = [func_from_json(d) for d in data["functions"]]
+            return ModuleInterface(path, data["digest"], functions, data["imports"], data["il"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def build(self, path, source) -> ModuleInterface:
+        from semantics.analyzer import SemanticAnalyzer
+        from compiler import Compiler
+
+        name = os.path.basename(path)
+        tree, _, lex_errs, parse_errs, tokens = self.parse(source.decode("utf-8"))
+        errors = lex_errs + parse_errs
+        if not errors:
+            analyzer = SemanticAnalyzer(tokens, loader=self, base_dir=os.path.dirname(path), path=path)
+            analyzer.analyze(tree)
+            errors = analyzer.errors
+        if errors:
+            details = "; ".join(f"line {e['line']}: {e['message']}" for e in errors)
+            raise ModuleError(f"Errors in module '{name}': {details}")
+        if tree.main_block() is not None:
+            raise ModuleError(f"Module '{name}' has a main block; only files without one can be imported")
+
+        sink = MemorySink()
+        pure = {fn.name for fn in analyzer.module_functions if fn.pure}
+        compiler = Compiler(sink=sink, source_name=name, imports=self.closure(analyzer.imports), pure=pure,
+                            expression_types=analyzer.index.expression_types, **self.options)
+        compiler.visit(tree)
+        il = compiler.get_il().splitlines()
+
+        deps = analyzer.imports
+        iface = ModuleInterface(path, self.digest(source, deps), analyzer.module_functions, [d.path for d in deps], il)
+        self.write_cached(iface)
+        return iface
+
+    def write_cached(self, iface: ModuleInterface):
+        data = {
+            "version": INTERFACE_VERSION, "path": iface.path, "digest": iface.digest, "imports": iface.imports,
+            "functions": [asdict(fn) for fn in iface.functions], "il": iface.il,
+        }
+        # A read-only checkout still compiles, just without the cache
+        try:
+            with open(interface_path(iface.path), "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1)
+        except OSError:
+            pass
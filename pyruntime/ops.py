@@ -0,0 +1,127 @@
+import math
+
+import numpy as np
+
+from pyruntime import stdlib
+from pyruntime.values import Image, Color, cast_error, is_int, is_num, to_double, to_int32, to_text, trunc_int32
+
+# Counterpart of ImageLangRuntime.Ops: the dynamically typed operations the compiled program calls
+# with boxed operands. Integer results go through a double and an unchecked (int) cast, as there.
+
+
+def _as_image(o): return o if isinstance(o, Image) else None
+
+
+def _arith(a, b, r):
+    return trunc_int32(r) if is_int(a) and is_int(b) else r
+
+
+def _div(x: float, y: float) -> float:
+    if y == 0:
+        if x == 0 or math.isnan(x): return math.nan
+        return math.copysign(math.inf, x) * math.copysign(1, y)
+    return x / y
+
+
+def CreateColor(r, g, b): return Color(trunc_int32(to_double(r)), trunc_int32(to_double(g)), trunc_int32(to_double(b)))
+
+
+def CreateImage(w, h):
+    return Image(np.zeros((trunc_int32(to_double(h)), trunc_int32(to_double(w)), 4), dtype=np.uint8))
+
+
+def Add(a, b):
+    if isinstance(a, str) or isinstance(b, str): return to_text(a) + to_text(b)
+    if isinstance(a, Image) and isinstance(b, Image): return stdlib.add_images(a, b)
+    return _arith(a, b, to_double(a) + to_double(b))
+
+
+def Sub(a, b):
+    if isinstance(a, Image) and isinstance(b, Image): return stdlib.sub_images(a, b)
+    if isinstance(a, Image) and b is None:
+        print("[Runtime Error] Sub: second image is null!")
+        return a
+    if a is None and isinstance(b, Image):
+        print("[Runtime Error] Sub: first image is null!")
+        return b
+    return _arith(a, b, to_double(a) - to_double(b))
+
+
+def Mul(a, b):
+    if isinstance(a, Image) and is_num(b): return stdlib.mul_image_scalar(a, to_double(b))
+    if isinstance(b, Image) and is_num(a): return stdlib.mul_image_scalar(b, to_double(a))
+    return _arith(a, b, to_double(a) * to_double(b))
+
+
+def Div(a, b): return _arith(a, b, _div(to_double(a), to_double(b)))
+
+
+# Not in the .NET runtime, whose compiler has no lowering for '%'; defined like Div with C# remainder semantics
+def Mod(a, b):
+    x, y = to_double(a), to_double(b)
+    return _arith(a, b, math.fmod(x, y) if y != 0 and math.isfinite(x) else math.nan)
+
+
+def Neg(a):
+    d = to_double(a)
+    return trunc_int32(-d) if is_int(a) else -d
+
+
+def Gt(a, b): return to_double(a) > to_double(b)
+
+
+def Lt(a, b): return to_double(a) < to_double(b)
+
+
+def Eq(a, b):
+    """object.Equals: boxed values are equal only when their runtime types match."""
+    if a is None and b is None: return True
+    if a is None or b is None: return False
+    if type(a) is not type(b): return False
+    if isinstance(a, Image): return a is b
+    if isinstance(a, float) and math.isnan(a): return math.isnan(b)
+    return a == b
+
+
+def And(a, b): return _bool(a) & _bool(b)
+
+
+def Or(a, b): return _bool(a) | _bool(b)
+
+
+def Not(a): return not _bool(a)
+
+
+def _bool(o):
+    if type(o) is not bool: raise cast_error(o, "System.Boolean")
+    return o
+
+
+# Casts: (string) calls ToString() on the operand, (float) and (int) go through System.Convert
+def CastString(o):
+    if o is None: raise AttributeError("Object reference not set to an instance of an object.")
+    return to_text(o)
+
+
+def CastFloat(o): return to_double(o)
+
+
+def CastInt(o): return to_int32(o)
+
+
+# Stores into float locals and parameters accept ints, as the typing rules allow
+def Float(o): return float(o) if is_int(o) else o
+
+
+def Load(path): return stdlib.load(None if path is None else to_text(path))
+def Save(img, path): stdlib.save(_as_image(img), None if path is None else to_text(path))
+def Pow(img, g): return stdlib.pow_channels(_as_image(img), to_double(g))
+def Blur(img, r): return stdlib.blur(_as_image(img), to_double(r))
+def GaussBlur(img, sigma): return stdlib.gauss_blur(_as_image(img), to_double(sigma))
+def Width(img): return stdlib.width(_as_image(img))
+def Height(img): return stdlib.height(_as_image(img))
+def GetPixel(img, x, y): return stdlib.get_pixel(_as_image(img), trunc_int32(to_double(x)), trunc_int32(to_double(y)))
+def Avg(img): return stdlib.avg(_as_image(img))
+def AvgRegion(img, x, y, w, h):
+    return stdlib.avg_region(_as_image(img), *(trunc_int32(to_double(v)) for v in (x, y, w, h)))
+def SetThreads(n): return stdlib.set_threads(trunc_int32(to_double(n)))
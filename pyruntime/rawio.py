@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+
+# Same formats and layout as ImageLangRuntime/RawImageIO.cs: binary PPM (P6) / PGM (P5) with maxval 255,
+# and .ilraw = "ILRAW1\0\0", int32 width, int32 height, then BGRA rows.
+RAW_MAGIC = b"ILRAW1\0\0"
+RAW_HEADER_SIZE = 16
+EXTENSIONS = (".ppm", ".pgm", ".pnm", ".ilraw")
+
+
+def handles(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in EXTENSIONS
+
+
+def load(path: str) -> np.ndarray:
+    if not os.path.exists(path): raise FileNotFoundError(f"File not found: {path}")
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(mm) and mm[0] == RAW_MAGIC[0]: return load_raw(mm)
+    return load_netpbm(mm)
+
+
+def load_raw(mm) -> np.ndarray:
+    if bytes(mm[:len(RAW_MAGIC)]) != RAW_MAGIC: raise ValueError("Not an ILRAW file")
+    if len(mm) < RAW_HEADER_SIZE: raise ValueError("Truncated ILRAW header")
+    # Python ints, so the size of images of 2 GB and more does not wrap as int32 arithmetic would
+    w, h = (int(v) for v in np.frombuffer(bytes(mm[8:RAW_HEADER_SIZE]), dtype="<i4"))
+    if w < 0 or h < 0: raise ValueError(f"Invalid ILRAW dimensions {w}x{h}")
+    end = RAW_HEADER_SIZE + w * h * 4
+    if len(mm) < end: raise ValueError(f"Truncated ILRAW data: expected {end} bytes, found {len(mm)}")
+    return np.array(mm[RAW_HEADER_SIZE:end]).reshape(h, w, 4)
+
+
+def load_netpbm(mm) -> np.ndarray:
+    pos = 0
+    magic, pos = next_token(mm, pos)
+    if magic not in ("P6", "P5"): raise ValueError("Only binary PPM (P6) and PGM (P5) are supported")
+    w, pos = next_token(mm, pos)
+    h, pos = next_token(mm, pos)
+    maxval, pos = next_token(mm, pos)
+    if int(maxval) != 255: raise ValueError("Only 8-bit PPM/PGM is supported")
+    w, h = int(w), int(h)
+    pos += 1  # single whitespace after maxval
+
+    if w < 0 or h < 0: raise ValueError(f"Invalid PPM/PGM dimensions {w}x{h}")
+
+    channels = 3 if magic == "P6" else 1
+    end = pos + w * h * channels
+    if len(mm) < end: raise ValueError(f"Truncated PPM/PGM data: expected {end} bytes, found {len(mm)}")
+    pixels = np.asarray(mm[pos:end]).reshape(h, w, channels)
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[..., :3] = pixels[..., ::-1] if channels == 3 else pixels
+    out[..., 3] = 255
+    return out
+
+
+def next_token(mm, pos):
+    token = bytearray()
+    while pos < len(mm):
+        c = int(mm[pos])
+        if c == ord("#"):
+            while pos < len(mm) and mm[pos] != ord("\n"): pos += 1
+        elif chr(c).isspace():
+            if token: break
+            pos += 1
+        else:
+            token.append(c)
+            pos += 1
+    return token.decode("ascii"), pos
+
+
+def save(data: np.ndarray, path: str):
+    ext = os.path.splitext(path)[1].lower()
+    h, w = data.shape[:2]
+    with open(path, "wb") as f:
+        if ext == ".ilraw":
+            f.write(RAW_MAGIC)
+            f.write(np.array([w, h], dtype="<i4").tobytes())
+            f.write(np.ascontiguousarray(data).tobytes())
+        elif ext == ".pgm":
+            # PGM stores the (R+G+B)/3 gray value used by avg
+            f.write(f"P5\n{w} {h}\n255\n".encode("ascii"))
+            f.write(gray(data).astype(np.uint8).tobytes())
+        else:
+            f.write(f"P6\n{w} {h}\n255\n".encode("ascii"))
+            f.write(np.ascontiguousarray(data[..., 2::-1]).tobytes())
+
+
+def gray(data: np.ndarray) -> np.ndarray:
+    return data[..., :3].sum(axis=2, dtype=np.int64) // 3
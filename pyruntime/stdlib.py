@@ -0,0 +1,198 @@
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+from pyruntime import rawio
+from pyruntime.values import Image, Color, to_text, trunc_int32_array
+
+# NumPy counterparts of ImageLangRuntime.StdLib. Results match the .NET kernels byte for byte:
+# integer means truncate, channel math clamps through (int) casts, and alpha of every result is 255.
+
+
+class ArgumentOutOfRangeError(IndexError):
+    def __init__(self, param):
+        super().__init__(f"Specified argument was out of the range of valid values.\r\nParameter name: {param}")
+
+
+def write(obj): print(to_text(obj) if obj is not None else "null")
+
+
+def read_string() -> str:
+    line = sys.stdin.readline()
+    return line.strip() if line else ""
+
+
+def read_int():
+    s = read_string()
+    if re.fullmatch(r"[+-]?\d+", s) and -2**31 <= int(s) < 2**31: return int(s)
+    return 0
+
+
+def read_float():
+    s = read_string().replace(",", ".")
+    if re.fullmatch(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?", s): return float(s)
+    return 0.0
+
+
+def load(path):
+    try:
+        if rawio.handles(path): return Image(rawio.load(path))
+        return Image(load_bitmap(path))
+    except Exception:
+        return None
+
+
+def save(img, path):
+    if img is None: return
+    if rawio.handles(path): rawio.save(img.data, path)
+    else: save_bitmap(img.data, path)
+
+
+# Other formats go through Pillow when it is installed
+def load_bitmap(path) -> np.ndarray:
+    if not os.path.exists(path): raise FileNotFoundError(f"File not found: {path}")
+    from PIL import Image as PILImage
+    rgba = np.asarray(PILImage.open(path).convert("RGBA"))
+    return np.ascontiguousarray(rgba[..., [2, 1, 0, 3]])
+
+
+def save_bitmap(data, path):
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        raise RuntimeError(f"Saving '{path}' needs Pillow; .ppm, .pgm and .ilraw are always available") from None
+    # Bitmap.Save(path) on a computed bitmap writes PNG whatever the extension
+    PILImage.fromarray(np.ascontiguousarray(data[..., [2, 1, 0, 3]]), "RGBA").save(path, format="PNG")
+
+
+def width(img) -> int: return img.width if img is not None else 0
+
+
+def height(img) -> int: return img.height if img is not None else 0
+
+
+def get_pixel(img, x: int, y: int) -> Color:
+    if img is None: return Color()
+    if x < 0 or x >= img.width: raise ArgumentOutOfRangeError("x")
+    if y < 0 or y >= img.height: raise ArgumentOutOfRangeError("y")
+    b, g, r = (int(v) for v in img.data[y, x, :3])
+    return Color(r, g, b)
+
+
+def pow_channels(img, gamma: float):
+    if img is None: return None
+    with np.errstate(all="ignore"):
+        lut = 255 * np.power(np.arange(256) / 255.0, gamma)
+    return Image(apply_lut(img.data, clamp(lut)))
+
+
+def blur(img, r: float):
+    if img is None: return None
+    radius = math.ceil(r)
+    if radius < 1: return img.clone()
+    return Image(box_blur(img.data, radius))
+
+
+# Approximate Gaussian: three box passes whose widths match the variance of sigma (Wells, 1986)
+def gauss_blur(img, sigma: float):
+    if img is None: return None
+    passes = 3
+    if sigma <= 0: return img.clone()
+    wl = math.floor(math.sqrt(12 * sigma * sigma / passes + 1))
+    if wl % 2 == 0: wl -= 1
+    m = round((12 * sigma * sigma - passes * wl * wl - 4 * passes * wl - 3 * passes) / (-4.0 * wl - 4))
+
+    data = img.data
+    for i in range(passes):
+        radius = ((wl if i < m else wl + 2) - 1) // 2
+        if radius > 0: data = box_blur(data, radius)
+    return Image(data) if data is not img.data else img.clone()
+
+
+def box_blur(data: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over the in-bounds part of the (2r+1)^2 window, from prefix sums along x and then y."""
+    h, w = data.shape[:2]
+    sums = window_sums(data[..., :3].astype(np.int64), radius, axis=1)
+    sums = window_sums(sums, radius, axis=0)
+    count_x = window_counts(w, radius)
+    count_y = window_counts(h, radius)
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[..., :3] = sums // (count_y[:, None, None] * count_x[None, :, None])
+    out[..., 3] = 255
+    return out
+
+
+def window_sums(a: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    n = a.shape[axis]
+    prefix = np.concatenate([np.zeros_like(a.take([0], axis=axis)), np.cumsum(a, axis=axis)], axis=axis) if n else a
+    idx = np.arange(n)
+    lo, hi = np.maximum(0, idx - radius), np.minimum(n - 1, idx + radius) + 1
+    return prefix.take(hi, axis=axis) - prefix.take(lo, axis=axis)
+
+
+def window_counts(n: int, radius: int) -> np.ndarray:
+    idx = np.arange(n)
+    return np.minimum(n - 1, idx + radius) - np.maximum(0, idx - radius) + 1
+
+
+def avg(img) -> float:
+    if img is None or img.width == 0 or img.height == 0: return 0.0
+    return float(rawio.gray(img.data).sum()) / (img.width * img.height)
+
+
+def avg_region(img, x: int, y: int, w: int, h: int) -> float:
+    if img is None: return 0.0
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(img.width, x + w), min(img.height, y + h)
+    if x1 <= x0 or y1 <= y0: return 0.0
+    return float(rawio.gray(img.data[y0:y1, x0:x1]).sum()) / ((x1 - x0) * (y1 - y0))
+
+
+def add_images(a, b):
+    if a is None: return b
+    if b is None: return a
+    return Image(combine(a.data, b.data, subtract=False))
+
+
+def sub_images(a, b):
+    if a is None: return None
+    if b is None: return a
+    return Image(combine(a.data, b.data, subtract=True))
+
+
+# Saturating add or absolute difference over the common top-left region of two images
+def combine(a: np.ndarray, b: np.ndarray, subtract: bool) -> np.ndarray:
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    x1 = a[:h, :w, :3].astype(np.int16)
+    x2 = b[:h, :w, :3].astype(np.int16)
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[..., :3] = np.abs(x1 - x2) if subtract else np.minimum(255, x1 + x2)
+    out[..., 3] = 255
+    return out
+
+
+def mul_image_scalar(img, v: float):
+    if img is None: return None
+    with np.errstate(all="ignore"):
+        lut = np.arange(256) * v
+    return Image(apply_lut(img.data, clamp(lut)))
+
+
+def apply_lut(data: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    out = np.empty_like(data)
+    out[..., :3] = lut[data[..., :3]]
+    out[..., 3] = 255
+    return out
+
+
+def clamp(values: np.ndarray) -> np.ndarray:
+    """Clamp((int)v) for a table of doubles."""
+    return np.clip(trunc_int32_array(values), 0, 255).astype(np.uint8)
+
+
+def set_threads(n):
+    # NumPy picks its own threading; accepted for compatibility with the .NET runtime
+    return None
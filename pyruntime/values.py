@@ -0,0 +1,122 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+
+class Image:
+    """Pixels as a (height, width, 4) uint8 array in B, G, R, A order, the layout of the .NET PixelBuffer."""
+    __slots__ = ("data",)
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    @property
+    def width(self): return self.data.shape[1]
+
+    @property
+    def height(self): return self.data.shape[0]
+
+    def clone(self): return Image(self.data.copy())
+
+    def __str__(self): return "ImageLangRuntime.ImageWrapper"
+
+
+@dataclass(frozen=True)
+class Color:
+    r: int = 0
+    g: int = 0
+    b: int = 0
+
+    def __str__(self): return "ImageLangRuntime.LangColor"
+
+
+class LangError(Exception):
+    """Raised by `throw`; every ImageLang exception type maps to System.Exception in the compiled program."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message if message is not None else "Exception of type 'System.Exception' was thrown."
+
+    def __str__(self): return self.message
+
+
+def message_of(exc: BaseException) -> str:
+    return exc.message if isinstance(exc, LangError) else str(exc)
+
+
+def is_int(o): return type(o) is int
+
+
+def is_num(o): return type(o) in (int, float)
+
+
+def cast_error(o, target):
+    return TypeError(f"Unable to cast object of type '{clr_name(o)}' to type '{target}'.")
+
+
+def clr_name(o):
+    return {bool: "System.Boolean", int: "System.Int32", float: "System.Double", str: "System.String",
+            Image: "ImageLangRuntime.ImageWrapper", Color: "ImageLangRuntime.LangColor"}.get(type(o), type(o).__name__)
+
+
+def to_double(o) -> float:
+    """Convert.ToDouble(object)."""
+    if o is None: return 0.0
+    if isinstance(o, (bool, int, float)): return float(o)
+    if isinstance(o, str):
+        try:
+            return float(o.strip())
+        except ValueError:
+            raise ValueError("Input string was not in a correct format.") from None
+    raise cast_error(o, "System.IConvertible")
+
+
+def to_int32(o) -> int:
+    """Convert.ToInt32(object): rounds half to even and rejects values outside Int32."""
+    if o is None: return 0
+    if isinstance(o, str):
+        try:
+            v = int(o.strip())
+        except ValueError:
+            raise ValueError("Input string was not in a correct format.") from None
+    elif isinstance(o, (bool, int)):
+        v = int(o)
+    elif isinstance(o, float):
+        if not math.isfinite(o): raise OverflowError("Value was either too large or too small for an Int32.")
+        v = round(o)
+    else:
+        raise cast_error(o, "System.IConvertible")
+    if not INT32_MIN <= v <= INT32_MAX: raise OverflowError("Value was either too large or too small for an Int32.")
+    return v
+
+
+def trunc_int32(d: float) -> int:
+    """An unchecked (int) cast of a double: truncation, with NaN and out-of-range values becoming Int32.MinValue."""
+    if not math.isfinite(d): return INT32_MIN
+    v = int(d)
+    return v if INT32_MIN <= v <= INT32_MAX else INT32_MIN
+
+
+def trunc_int32_array(a: np.ndarray) -> np.ndarray:
+    out = np.full(a.shape, INT32_MIN, dtype=np.int64)
+    ok = np.isfinite(a) & (a > INT32_MIN - 1) & (a < INT32_MAX + 1)
+    out[ok] = np.trunc(a[ok]).astype(np.int64)
+    return out
+
+
+def format_double(d: float) -> str:
+    """Double.ToString() on .NET Framework: 15 significant digits, general format."""
+    if math.isnan(d): return "NaN"
+    if math.isinf(d): return "Infinity" if d > 0 else "-Infinity"
+    if d == 0: return "0"
+    return format(d, ".15G")
+
+
+def to_text(o) -> str:
+    """object.ToString() as used by string concatenation, where null becomes the empty string."""
+    if o is None: return ""
+    if isinstance(o, bool): return "True" if o else "False"
+    if isinstance(o, float): return format_double(o)
+    return str(o)
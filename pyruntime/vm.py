@@ -0,0 +1,105 @@
+from codegen.ilbc import *
+from pyruntime import ops, stdlib
+from pyruntime.values import Color, LangError, message_of, INT32_MIN, INT32_MAX
+
+DEFAULTS = {"i": 0, "f": 0.0, "b": False}
+
+BUILTIN_IMPLS = {
+    "write": stdlib.write, "read": lambda _: stdlib.read_string(), "load": ops.Load, "save": ops.Save,
+    "pow_channels": ops.Pow, "blur": ops.Blur, "gauss_blur": ops.GaussBlur, "width": ops.Width,
+    "height": ops.Height, "get_pixel": ops.GetPixel, "avg": ops.Avg, "avg_region": ops.AvgRegion,
+    "set_threads": ops.SetThreads, "read_int": stdlib.read_int, "read_float": stdlib.read_float,
+    "read_bool": lambda: stdlib.read_string() == "true", "read_string": stdlib.read_string,
+    "color": ops.CreateColor, "image": ops.CreateImage,
+}
+
+
+def _wrap(x):
+    """Result of int arithmetic after the double round trip of Ops: out-of-range values become Int32.MinValue."""
+    return x if INT32_MIN <= x <= INT32_MAX else INT32_MIN
+
+
+class VM:
+    """Runs a bytecode Program. Instructions are decoded once into tuples; each call gets a fresh
+    register list copied from its function's template of typed defaults. Calls recurse on the Python
+    stack, and try blocks push handler addresses that a raised exception unwinds to."""
+
+    def __init__(self, program: Program):
+        self.constants = program.constants
+        self.entry = program.entry
+        self.code = [[tuple(f.code[i:i + 4]) for i in range(0, len(f.code), 4)] for f in program.functions]
+        self.templates = [[Color() if t == "c" else DEFAULTS.get(t) for t in f.reg_types] for f in program.functions]
+        self.arity = [f.n_params for f in program.functions]
+        self.refs = [f.refs for f in program.functions]
+        self.builtins = [(BUILTIN_IMPLS[name], n) for name, n, _ in BUILTINS]
+
+    def run(self):
+        return self.execute(self.entry, [])[0]
+
+    def execute(self, index, args):
+        """Returns the function's result and its registers, whose first slots are the by-ref parameters."""
+        code, k = self.code[index], self.constants
+        regs = self.templates[index].copy()
+        regs[:len(args)] = args
+        handlers, exc, pc = [], None, 0
+        while True:
+            try:
+                # Ordered by how often they run in pixel loops
+                while True:
+                    op, a, b, c = code[pc]
+                    pc += 1
+                    if op == MOVE: regs[a] = regs[b]
+                    elif op == LOADK: regs[a] = k[b]
+                    elif op == JMPF:
+                        if not regs[a]: pc = b
+                    elif op == JMP: pc = b
+                    elif op == ADD_I: regs[a] = _wrap(regs[b] + regs[c])
+                    elif op == LT_N: regs[a] = regs[b] < regs[c]
+                    elif op == GT_N: regs[a] = regs[b] > regs[c]
+                    elif op == ADD_F: regs[a] = regs[b] + regs[c]
+                    elif op == MUL_F: regs[a] = regs[b] * regs[c]
+                    elif op == SUB_I: regs[a] = _wrap(regs[b] - regs[c])
+                    elif op == SUB_F: regs[a] = regs[b] - regs[c]
+                    elif op == MUL_I: regs[a] = _wrap(regs[b] * regs[c])
+                    elif op == NOT_B: regs[a] = not regs[b]
+                    elif op == EQ_I: regs[a] = regs[b] == regs[c]
+                    elif op == AND_B: regs[a] = regs[b] and regs[c]
+                    elif op == OR_B: regs[a] = regs[b] or regs[c]
+                    elif op == FIELD: regs[a] = getattr(regs[b], FIELDS[c])
+                    elif op == FLOAT: regs[a] = ops.Float(regs[b])
+                    elif op == BUILTIN:
+                        fn, n = self.builtins[b]
+                        regs[a] = fn(*regs[c:c + n])
+                    elif op == CALL:
+                        result, callee = self.execute(b, regs[c:c + self.arity[b]])
+                        regs[a] = result
+                        for i in self.refs[b]: regs[c + i] = callee[i]
+                    elif op == JMPT:
+                        if regs[a]: pc = b
+                    elif op == RET: return regs[a], regs
+                    elif op == RETN: return None, regs
+                    elif op == ADD: regs[a] = ops.Add(regs[b], regs[c])
+                    elif op == SUB: regs[a] = ops.Sub(regs[b], regs[c])
+                    elif op == MUL: regs[a] = ops.Mul(regs[b], regs[c])
+                    elif op == DIV: regs[a] = ops.Div(regs[b], regs[c])
+                    elif op == MOD: regs[a] = ops.Mod(regs[b], regs[c])
+                    elif op == EQ: regs[a] = ops.Eq(regs[b], regs[c])
+                    elif op == LT: regs[a] = ops.Lt(regs[b], regs[c])
+                    elif op == GT: regs[a] = ops.Gt(regs[b], regs[c])
+                    elif op == AND: regs[a] = ops.And(regs[b], regs[c])
+                    elif op == OR: regs[a] = ops.Or(regs[b], regs[c])
+                    elif op == NOT: regs[a] = ops.Not(regs[b])
+                    elif op == NEG: regs[a] = ops.Neg(regs[b])
+                    elif op == NEG_I: regs[a] = _wrap(-regs[b])
+                    elif op == NEG_F: regs[a] = -regs[b]
+                    elif op == CAST_S: regs[a] = ops.CastString(regs[b])
+                    elif op == CAST_F: regs[a] = ops.CastFloat(regs[b])
+                    elif op == CAST_I: regs[a] = ops.CastInt(regs[b])
+                    elif op == TRY: handlers.append(b)
+                    elif op == ENDTRY: handlers.pop()
+                    elif op == CATCH: regs[a] = message_of(exc)
+                    elif op == THROW: raise LangError(regs[a])
+                    else: raise ValueError(f"Bad opcode {op} at {pc - 1}")
+            except Exception as e:
+                if not handlers: raise
+                pc, exc = handlers.pop(), e
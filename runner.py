@@ -1,4 +1,4 @@
-import sys, argparse, json
+import sys, argparse, json, os
 from antlr4 import *
 from antlr4.error.ErrorListener import ErrorListener
 from antlr4.tree.Trees import Trees
@@ -8,6 +8,8 @@ from ImageLangParser import ImageLangParser
 
 from semantics.analyzer import SemanticAnalyzer
 from compiler import Compiler  # <-- Импортируем наш компилятор
+from codegen.sinks import open_sink
+from modules import ModuleLoader, ModuleError, interface_path
 
 class CollectingErrorListener(ErrorListener):
     def __init__(self):
@@ -49,12 +51,90 @@ def format_error(err, source_lines):
         f"    {pointer}"
     )
 
+def run_in_process(tree, source_name):
+    # The backend needs NumPy, which emitting IL does not
+    try:
+        from codegen.pygen import PythonGenerator, UnsupportedConstruct
+        from pyruntime.values import message_of
+    except ImportError as e:
+        print(f"--run is unavailable: {e}")
+        return 1
+
+    try:
+        entry = PythonGenerator(source_name).build(tree)
+    except UnsupportedConstruct as e:
+        print(f"Cannot run in-process: {e}")
+        return 1
+
+    return run_entry(entry, message_of)
+
+def run_bytecode(program):
+    try:
+        from pyruntime.vm import VM
+        from pyruntime.values import message_of
+    except ImportError as e:
+        print(f"--vm is unavailable: {e}")
+        return 1
+    return run_entry(VM(program).run, message_of)
+
+def run_entry(entry, message_of):
+    try:
+        entry()
+    except Exception as e:
+        print(f"Unhandled Exception: {message_of(e)}")
+        return 1
+    return 0
+
+def compile_bytecode(tree, args):
+    from codegen.bytecode import BytecodeCompiler, UnsupportedConstruct
+    from codegen.ilbc import disassemble, dump
+    try:
+        program = BytecodeCompiler().compile(tree)
+    except UnsupportedConstruct as e:
+        print(f"Cannot compile to bytecode: {e}")
+        return 1
+    if args.disasm:
+        print(disassemble(program))
+    if args.bytecode:
+        with open(args.bytecode, "wb") as f:
+            dump(program, f)
+        print(f"Bytecode written to {args.bytecode}")
+    return run_bytecode(program) if args.vm else 0
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("file", help="Source file (.img)")
-    ap.add_argument("--output", help="Output IL file", default="program.il")
+    ap.add_argument("file", help="Source file (.img), or compiled bytecode (.ilbc) to run with the VM")
+    ap.add_argument("--output", help="Output IL file (.gz for a compressed stream)", default="program.il")
+    ap.add_argument("--inline-threshold", type=int, default=8,
+                    help="Max statements in a function body to inline at call sites (0 disables)")
+    ap.add_argument("--no-peephole", action="store_true", help="Disable the peephole pass over emitted IL")
+    ap.add_argument("--instrument", action="store_true",
+                    help="Emit profiler probes and .line directives; the program writes a profile at exit")
+    ap.add_argument("--peephole-report", action="store_true", help="Print how often each peephole pattern fired")
+    ap.add_argument("--memoize-size", type=int, default=0,
+                    help="Memoize pure, non-inlined functions of int/float/bool arguments in tables of this many entries (0 disables)")
+    ap.add_argument("--no-prefetch", action="store_true",
+                    help="Do not decode images loaded from compile-time paths in the background at startup")
+    ap.add_argument("--sync-saves", action="store_true",
+                    help="Write images in save() before continuing instead of on the background save queue")
+    ap.add_argument("--run", action="store_true",
+                    help="Execute the program in-process with the NumPy backend instead of emitting IL")
+    ap.add_argument("--vm", action="store_true", help="Execute the program on the bytecode VM instead of emitting IL")
+    ap.add_argument("--bytecode", help="Write compiled bytecode (.ilbc) instead of IL")
+    ap.add_argument("--disasm", action="store_true", help="Print a listing of the compiled bytecode")
     args = ap.parse_args()
 
+    # Compiled bytecode runs without reparsing or re-verifying the source
+    if args.file.endswith(".ilbc"):
+        from codegen.ilbc import load
+        try:
+            with open(args.file, "rb") as f:
+                program = load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cannot load bytecode: {e}")
+            return 1
+        return run_bytecode(program)
+
     try:
         source_lines = open(args.file, encoding="utf-8").read().splitlines()
     except FileNotFoundError:
@@ -72,7 +152,12 @@ def main():
         return
 
     # 2. Semantic Analysis
-    analyzer = SemanticAnalyzer(tokens)
+    # Imported modules are compiled with the same options, so their cached IL matches this program's
+    options = {"inline_threshold": args.inline_threshold, "optimize": not args.no_peephole, "instrument": args.instrument,
+               "memoize_size": args.memoize_size, "prefetch": not args.no_prefetch, "background_saves": not args.sync_saves}
+    loader = ModuleLoader(parse_text, options)
+    path = os.path.abspath(args.file)
+    analyzer = SemanticAnalyzer(tokens, loader=loader, base_dir=os.path.dirname(path), path=path)
     sem_errors = analyzer.analyze(tree)
     
     if analyzer.errors:
@@ -81,17 +166,40 @@ def main():
             print(format_error(e, source_lines))
         return
 
+    # A file without a main block is a module: build its interface for importers
+    if tree.main_block() is None:
+        try:
+            loader.load(args.file)
+        except ModuleError as e:
+            print(e)
+            return 1
+        print(f"Module OK. Interface written to {interface_path(args.file)}")
+        return 0
+
+    if args.run:
+        print("Verification OK. Running...")
+        return run_in_process(tree, args.file)
+
+    if args.vm or args.bytecode or args.disasm:
+        print("Verification OK. Running..." if args.vm else "Verification OK. Compiling...")
+        return compile_bytecode(tree, args)
+
     print("Verification OK. Compiling...")
 
     # 3. Compilation
-    compiler = Compiler()
-    compiler.visit(tree)
-    
-    with open(args.output, "w") as f:
-        f.write(compiler.get_il())
+    # IL is streamed to --output method by method instead of being joined in memory
+    with open_sink(args.output) as sink:
+        compiler = Compiler(sink=sink, source_name=args.file, imports=loader.closure(analyzer.imports),
+                            pure={fn.name for fn in analyzer.module_functions if fn.pure},
+                            expression_types=analyzer.index.expression_types, **options)
+        compiler.visit(tree)
     
     print(f"Compilation successful! Output written to {args.output}")
+    if args.peephole_report:
+        print("Peephole report:")
+        for pattern, hits in sorted(compiler.peephole_stats.items()):
+            print(f"    {pattern}: {hits}")
     print("Next step: Run 'ilasm program.il' to generate executable.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
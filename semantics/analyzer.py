@@ -1,8 +1,11 @@
+import os
+
 from antlr4 import CommonTokenStream, ParserRuleContext
 from ImageLangParser import ImageLangParser
 from ImageLangVisitor import ImageLangVisitor
 
 from semantics.symbols import Scope, VarSymbol, FuncSymbol
+from semantics.index import SemanticIndex
 from semantics.types import *
 from semantics.errors import make_error
 
@@ -10,6 +13,14 @@ from semantics.errors import make_error
 # -----------------------------
 # Built-in functions registry
 # -----------------------------
+IMPURE_BUILTINS = {"write", "read", "load", "save", "set_threads"}
+
+# Nodes whose visit result is an expression type, recorded in the position index
+EXPRESSION_CONTEXTS = (
+    ImageLangParser.ExpressionContext, ImageLangParser.Unary_exprContext, ImageLangParser.Cast_exprContext,
+    ImageLangParser.Postfix_exprContext, ImageLangParser.Primary_baseContext, ImageLangParser.Func_callContext,
+)
+
 def seed_builtins(scope: Scope):
     # IO
     scope.define_func(FuncSymbol("write", NULL, [VarSymbol("msg", STRING)]))
@@ -28,11 +39,22 @@ def seed_builtins(scope: Scope):
         VarSymbol("img", IMAGE), VarSymbol("x", INT), VarSymbol("y", INT)
     ]))
     scope.define_func(FuncSymbol("blur", IMAGE, [VarSymbol("img", IMAGE), VarSymbol("radius", FLOAT)]))
+    scope.define_func(FuncSymbol("gauss_blur", IMAGE, [VarSymbol("img", IMAGE), VarSymbol("sigma", FLOAT)]))
     scope.define_func(FuncSymbol("avg", FLOAT, [VarSymbol("img", IMAGE)]))
+    scope.define_func(FuncSymbol("avg_region", FLOAT, [
+        VarSymbol("img", IMAGE), VarSymbol("x", INT), VarSymbol("y", INT), VarSymbol("w", INT), VarSymbol("h", INT)
+    ]))
+
+    # Runtime
+    scope.define_func(FuncSymbol("set_threads", NULL, [VarSymbol("n", INT)]))
+
+    # User functions get their flag from infer_purity
+    for fn in scope.funcs.values():
+        fn.pure = fn.name not in IMPURE_BUILTINS
 
 
 class SemanticAnalyzer(ImageLangVisitor):
-    def __init__(self, token_stream: CommonTokenStream):
+    def __init__(self, token_stream: CommonTokenStream, loader=None, base_dir=".", path=None):
         super().__init__()
         self.tokens = token_stream
         self.errors = []
@@ -40,12 +62,39 @@ class SemanticAnalyzer(ImageLangVisitor):
         self.current_scope = self.global_scope
         self.current_func: FuncSymbol | None = None
 
+        # Imports resolve through a modules.ModuleLoader, relative to the importing file
+        self.loader = loader
+        self.base_dir = base_dir
+        # Absolute path of the analyzed file, recorded on the functions it declares
+        self.path = path
+        self.imports = []
+        self.module_functions: list[FuncSymbol] = []
+        self.imported_funcs = {}
+
+        # Per user function: names it calls, and whether it reads input directly
+        self.calls: dict[str, set] = {}
+        self.reads_input = set()
+
+        # Types and resolved symbols by source position, for type_at / definition_of / diagnostics_in
+        self.index = SemanticIndex(token_stream)
+
     def analyze(self, tree):
         seed_builtins(self.global_scope)
         self.current_scope = self.global_scope
         self.visit(tree)
+        self.index.set_diagnostics(self.errors)
         return self.errors
 
+    def visit(self, tree):
+        result = super().visit(tree)
+        if isinstance(result, Type) and isinstance(tree, EXPRESSION_CONTEXTS):
+            self.index.add_type(tree, result)
+        return result
+
+    def type_at(self, line, column): return self.index.type_at(line, column)
+    def definition_of(self, line, column): return self.index.definition_of(line, column)
+    def diagnostics_in(self, start, end): return self.index.diagnostics_in(start, end)
+
     def push_scope(self): self.current_scope = Scope(self.current_scope)
     def pop_scope(self): self.current_scope = self.current_scope.parent
 
@@ -68,9 +117,63 @@ class SemanticAnalyzer(ImageLangVisitor):
         return Type("unknown")
 
     def visitProgram(self, ctx: ImageLangParser.ProgramContext):
+        for imp in ctx.import_decl():
+            self.visit(imp)
         for td in ctx.top_decl():
             self.visit(td)
-        self.visit(ctx.main_block())
+        self.infer_purity()
+        if ctx.main_block():
+            self.visit(ctx.main_block())
+        return None
+
+    def infer_purity(self):
+        # Greatest fixpoint, so mutually recursive pure functions stay pure
+        for fn in self.module_functions:
+            fn.pure = fn.name not in self.reads_input and not any(p.by_ref for p in fn.params)
+        changed = True
+        while changed:
+            changed = False
+            for fn in self.module_functions:
+                if fn.pure and not all(self.is_pure_call(c) for c in self.calls.get(fn.name, ())):
+                    fn.pure = False
+                    changed = True
+
+    def is_pure_call(self, name):
+        fn = self.global_scope.resolve_func(name)
+        return fn is not None and fn.pure
+
+    def record_call(self, name):
+        if self.current_func is not None:
+            self.calls.setdefault(self.current_func.name, set()).add(name)
+
+    def visitImport_decl(self, ctx: ImageLangParser.Import_declContext):
+        from modules import ModuleError
+
+        tok = ctx.STRING_LITERAL().getSymbol()
+        if self.loader is None:
+            self.errors.append(make_error(tok, "Imports are not available here"))
+            return None
+        try:
+            iface = self.loader.load(os.path.join(self.base_dir, tok.text[1:-1]))
+        except ModuleError as e:
+            self.errors.append(make_error(tok, str(e)))
+            return None
+        if any(i.path == iface.path for i in self.imports):
+            return None
+        self.imports.append(iface)
+
+        # Functions of indirectly imported modules are not visible, but end up in the same program class
+        clashes = set()
+        for dep in self.loader.closure([iface]):
+            for fn in dep.functions:
+                owner = self.imported_funcs.setdefault(fn.name, dep.path)
+                if owner != dep.path:
+                    clashes.add(fn.name)
+                    self.errors.append(make_error(tok, f"Function '{fn.name}' is defined in both "
+                                                       f"'{os.path.basename(owner)}' and '{os.path.basename(dep.path)}'"))
+        for fn in iface.functions:
+            if not self.global_scope.define_func(fn) and fn.name not in clashes:
+                self.errors.append(make_error(tok, f"Function '{fn.name}' already defined"))
         return None
 
     def visitMain_block(self, ctx: ImageLangParser.Main_blockContext):
@@ -95,11 +198,18 @@ class SemanticAnalyzer(ImageLangVisitor):
                 t = self.type_from_ctx(p.type_())
                 by_ref = p.getToken(ImageLangParser.AMP, 0) is not None
                 pname = p.ID().getText()
-                params.append(VarSymbol(pname, t, by_ref))
+                p_tok = p.ID().getSymbol()
+                params.append(VarSymbol(pname, t, by_ref, p_tok.line, p_tok.column))
+                self.index.add_symbol(p_tok, params[-1])
 
-        fn = FuncSymbol(name, ret_t, params)
+        fn = FuncSymbol(name, ret_t, params, line=tok.line, column=tok.column, path=self.path)
+        self.index.add_symbol(tok, fn)
         if not self.global_scope.define_func(fn):
             self.errors.append(make_error(tok, f"Function '{name}' already defined"))
+        elif name in self.imported_funcs:
+            self.errors.append(make_error(tok, f"Function '{name}' is already defined in imported module "
+                                               f"'{os.path.basename(self.imported_funcs[name])}'"))
+        self.module_functions.append(fn)
 
         self.current_func = fn
         self.push_scope()
@@ -121,7 +231,8 @@ class SemanticAnalyzer(ImageLangVisitor):
         name_tok = ctx.ID().getSymbol()
         name = ctx.ID().getText()
 
-        sym = VarSymbol(name, t)
+        sym = VarSymbol(name, t, line=name_tok.line, column=name_tok.column)
+        self.index.add_symbol(name_tok, sym)
         if not self.current_scope.define_var(sym):
             self.errors.append(make_error(name_tok, f"Variable '{name}' already declared"))
 
@@ -156,6 +267,7 @@ class SemanticAnalyzer(ImageLangVisitor):
             if not sym:
                 self.errors.append(make_error(tok, f"Undeclared variable '{name}'"))
                 return None, tok, False
+            self.index.add_symbol(tok, sym)
             return sym.type, tok, True
 
         base_t, tok, _ = self.resolve_lvalue(ctx.lvalue())
@@ -254,7 +366,9 @@ class SemanticAnalyzer(ImageLangVisitor):
     def visitIo_stmt(self, ctx: ImageLangParser.Io_stmtContext):
         name = ctx.ID().getText()
         tok = ctx.ID().getSymbol()
+        self.record_call(name)
         fn = self.current_scope.resolve_func(name)
+        if fn is not None: self.index.add_symbol(tok, fn)
         arg_types = []
         arg_lvals = []
 
@@ -304,7 +418,8 @@ class SemanticAnalyzer(ImageLangVisitor):
             var_name = ctx.ID().getText()
             var_tok = ctx.ID().getSymbol()
             
-            sym = VarSymbol(var_name, STRING)
+            sym = VarSymbol(var_name, STRING, line=var_tok.line, column=var_tok.column)
+            self.index.add_symbol(var_tok, sym)
             
             if not self.current_scope.define_var(sym):
                 self.errors.append(make_error(var_tok, f"Variable '{var_name}' already declared in this scope"))
@@ -365,7 +480,9 @@ class SemanticAnalyzer(ImageLangVisitor):
     def visitFunc_call(self, ctx: ImageLangParser.Func_callContext):
         name = ctx.ID().getText()
         tok = ctx.ID().getSymbol()
+        self.record_call(name)
         fn = self.current_scope.resolve_func(name)
+        if fn is not None: self.index.add_symbol(tok, fn)
         arg_types = []
         arg_lvals = []
 
@@ -482,6 +599,7 @@ class SemanticAnalyzer(ImageLangVisitor):
             if sym is None:
                 self.errors.append(make_error(tok, f"Undeclared identifier '{name}'"))
                 return None
+            self.index.add_symbol(tok, sym)
             return sym.type
         if ctx.type_() and ctx.getToken(ImageLangParser.LPAREN, 0):
             t = self.type_from_ctx(ctx.type_())
@@ -498,6 +616,8 @@ class SemanticAnalyzer(ImageLangVisitor):
         if ctx.func_call():
             return self.visit(ctx.func_call())
         if ctx.read_type_call():
+            if self.current_func is not None:
+                self.reads_input.add(self.current_func.name)
             t = self.type_from_ctx(ctx.read_type_call().type_())
             return t
         return None
@@ -0,0 +1,64 @@
+import bisect
+from typing import Dict, List, Optional, Tuple, Union
+
+from antlr4 import ParserRuleContext, Token
+
+from semantics.symbols import VarSymbol, FuncSymbol
+from semantics.types import Type
+
+# (line, column) as ANTLR reports them: lines from 1, columns from 0
+Position = Tuple[int, int]
+
+
+class SemanticIndex:
+    """Position queries over an analyzed program, for editor tooling. Each token carries the type of
+    the innermost expression containing it and, for identifiers, the symbol it resolves to; queries
+    bisect the sorted token and diagnostic positions, so each costs O(log n)."""
+
+    def __init__(self, token_stream):
+        # Whitespace and comments are skipped by the lexer, so a token's index is its place in this list
+        self.tokens = [t for t in token_stream.tokens if t.type != Token.EOF] if token_stream is not None else []
+        self.starts = [(t.line, t.column) for t in self.tokens]
+        self.types: List[Optional[Type]] = [None] * len(self.tokens)
+        # Type of each expression node, for the compiler
+        self.expression_types: Dict[ParserRuleContext, Type] = {}
+        self.symbols: List[Union[VarSymbol, FuncSymbol, None]] = [None] * len(self.tokens)
+        self.diagnostics = []
+        self.diagnostic_starts = []
+
+    def add_type(self, ctx, t: Type):
+        self.expression_types[ctx] = t
+        # Expressions are recorded after their operands, so tokens already typed belong to inner ones
+        if ctx.start is None or ctx.stop is None: return
+        for i in range(ctx.start.tokenIndex, min(ctx.stop.tokenIndex + 1, len(self.types))):
+            if self.types[i] is None: self.types[i] = t
+
+    def add_symbol(self, token, sym):
+        if 0 <= token.tokenIndex < len(self.symbols): self.symbols[token.tokenIndex] = sym
+
+    def set_diagnostics(self, errors):
+        self.diagnostics = sorted(errors, key=lambda e: (e["line"], e["column"]))
+        self.diagnostic_starts = [(e["line"], e["column"]) for e in self.diagnostics]
+
+    def token_at(self, line: int, column: int) -> Optional[int]:
+        i = bisect.bisect_right(self.starts, (line, column)) - 1
+        if i < 0: return None
+        t = self.tokens[i]
+        return i if t.line == line and column < t.column + len(t.text) else None
+
+    def type_at(self, line: int, column: int) -> Optional[Type]:
+        """Type of the innermost expression at the position, None outside expressions."""
+        i = self.token_at(line, column)
+        return self.types[i] if i is not None else None
+
+    def definition_of(self, line: int, column: int) -> Union[VarSymbol, FuncSymbol, None]:
+        """Symbol the identifier at the position declares or refers to. Its line and column give the
+        declaration, in the file at path for functions; builtins have line 0 and no path."""
+        i = self.token_at(line, column)
+        return self.symbols[i] if i is not None else None
+
+    def diagnostics_in(self, start: Position, end: Position) -> list:
+        """Errors reported at positions in [start, end)."""
+        lo = bisect.bisect_left(self.diagnostic_starts, start)
+        hi = bisect.bisect_left(self.diagnostic_starts, end)
+        return self.diagnostics[lo:hi]
@@ -7,12 +7,18 @@ class VarSymbol:
     name: str
     type: Type
     by_ref: bool = False
+    line: int = 0    # declaration position; 0 for builtins
+    column: int = 0
 
 @dataclass
 class FuncSymbol:
     name: str
     ret_type: Type
     params: List[VarSymbol]
+    pure: bool = False  # no I/O, no by-ref parameters, calls only pure functions
+    line: int = 0
+    column: int = 0
+    path: Optional[str] = None  # absolute path of the declaring file; None for builtins
 
 class Scope:
     def __init__(self, parent: Optional['Scope'] = None):
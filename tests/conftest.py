@@ -0,0 +1,88 @@
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALID = os.path.join(ROOT, "tests", "valid")
+sys.path.insert(0, ROOT)
+
+
+def generate_parser():
+    """Puts the ANTLR parser on sys.path, generating it into .pytest_cache when it is not importable
+    and the antlr4 tool (antlr4-tools) and Java are installed. Without them the tests that parse
+    programs are skipped; the rest do not need a parser."""
+    if importlib.util.find_spec("ImageLangParser") is not None: return
+    antlr4 = shutil.which("antlr4")
+    if antlr4 is None or shutil.which("java") is None: return
+    with open(os.path.join(ROOT, "ImageLang.g4"), "rb") as f:
+        out = os.path.join(ROOT, ".pytest_cache", "parser-" + hashlib.sha256(f.read()).hexdigest()[:16])
+    if not os.path.isdir(out):
+        # Generated into a scratch directory first, so an interrupted run is not mistaken for a parser
+        scratch = out + ".tmp"
+        shutil.rmtree(scratch, ignore_errors=True)
+        try:
+            subprocess.run([antlr4, "-Dlanguage=Python3", "-visitor", "-o", scratch, "ImageLang.g4"],
+                           cwd=ROOT, check=True, capture_output=True, timeout=600)
+        except (OSError, subprocess.SubprocessError):
+            return
+        if not os.path.isfile(os.path.join(scratch, "ImageLangParser.py")): return
+        os.replace(scratch, out)
+    sys.path.insert(0, out)
+
+
+generate_parser()
+
+
+def valid_programs():
+    return sorted(os.path.join(VALID, f) for f in os.listdir(VALID) if f.endswith(".imagelang"))
+
+
+@pytest.fixture
+def run_runner(monkeypatch, capsys, tmp_path):
+    """Runs runner.py in-process from tmp_path, so programs save their images there.
+    Returns (exit code, stdout)."""
+    pytest.importorskip("ImageLangParser", reason="the ANTLR parser has not been generated")
+    import runner
+    monkeypatch.chdir(tmp_path)
+
+    def run(path, *flags, stdin=""):
+        monkeypatch.setattr(sys, "argv", ["runner.py", str(path), *flags])
+        monkeypatch.setattr(sys, "stdin", io.StringIO(stdin))
+        code = runner.main()
+        return code, capsys.readouterr().out
+
+    return run
+
+
+@pytest.fixture
+def write_program(tmp_path):
+    def write(source, name="program.imagelang"):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(source, encoding="utf-8")
+        return path
+
+    return write
+
+
+@pytest.fixture
+def analyze(tmp_path):
+    """Parses and analyzes source as the file name in tmp_path; returns (tree, analyzer)."""
+    pytest.importorskip("ImageLangParser", reason="the ANTLR parser has not been generated")
+    from runner import parse_text
+    from semantics.analyzer import SemanticAnalyzer
+
+    def run(source, loader=None, name="program.imagelang"):
+        tree, _, lex_errs, parse_errs, tokens = parse_text(source)
+        assert not lex_errs + parse_errs
+        analyzer = SemanticAnalyzer(tokens, loader=loader, base_dir=str(tmp_path), path=str(tmp_path / name))
+        analyzer.analyze(tree)
+        return tree, analyzer
+
+    return run
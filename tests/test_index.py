@@ -0,0 +1,198 @@
+from types import SimpleNamespace
+
+import pytest
+from antlr4 import ParserRuleContext
+from antlr4.Token import CommonToken, Token
+
+from modules import ModuleLoader
+from semantics.index import SemanticIndex
+from semantics.symbols import FuncSymbol, VarSymbol
+from semantics.types import FLOAT, INT, STRING
+
+
+def loader():
+    pytest.importorskip("ImageLangParser", reason="the ANTLR parser has not been generated")
+    from runner import parse_text
+    return ModuleLoader(parse_text)
+
+TONE = """float clamp01(float v) {
+    if v > 1.0 then { return 1.0; }
+    return v;
+}
+"""
+
+# Positions below are (line, column) with lines from 1 and columns from 0
+PROGRAM = """import "lib/tone.imagelang";
+
+float scale(float v, int& n) {
+    n = n + 1;
+    return clamp01(v) * 2.0;
+}
+
+{
+    int count = 0;
+    float s = scale(0.5, count);
+    string label = "n=" + (string)count;
+    write(label);
+}
+"""
+
+
+@pytest.fixture
+def program(analyze, write_program, tmp_path):
+    write_program(TONE, "lib/tone.imagelang")
+    _, analyzer = analyze(PROGRAM, loader=loader())
+    assert analyzer.errors == []
+    return analyzer
+
+
+def test_type_at(program):
+    assert program.type_at(4, 8) == INT            # n in n + 1
+    assert program.type_at(5, 22) == FLOAT         # * in clamp01(v) * 2.0
+    assert program.type_at(10, 14) == FLOAT        # scale(...)
+    assert program.type_at(10, 20) == FLOAT        # 0.5
+    assert program.type_at(11, 19) == STRING       # "n="
+    assert program.type_at(11, 24) == STRING       # + of two strings
+    assert program.type_at(11, 34) == INT          # count inside the cast
+
+
+def test_type_at_outside_expressions(program):
+    assert program.type_at(2, 0) is None           # blank line
+    assert program.type_at(9, 4) is None           # the type keyword of a declaration
+    assert program.type_at(10, 9) is None          # space between tokens
+    assert program.type_at(12, 40) is None         # past the end of the line
+    assert program.type_at(99, 0) is None
+
+
+def test_definition_of_local_symbols(program, tmp_path):
+    fn = program.definition_of(10, 16)
+    assert isinstance(fn, FuncSymbol)
+    assert (fn.name, fn.line, fn.column, fn.path) == ("scale", 3, 6, str(tmp_path / "program.imagelang"))
+    assert program.definition_of(3, 8) is fn       # the declaration itself
+
+    var = program.definition_of(10, 25)
+    assert isinstance(var, VarSymbol)
+    assert (var.name, var.line, var.column) == ("count", 9, 8)
+    assert program.definition_of(11, 34) is var
+
+    param = program.definition_of(4, 4)
+    assert (param.name, param.by_ref, param.line, param.column) == ("n", True, 3, 26)
+
+
+def test_definition_of_builtin(program):
+    fn = program.definition_of(12, 4)
+    assert (fn.name, fn.line, fn.path) == ("write", 0, None)
+    assert program.definition_of(11, 19) is None   # literals resolve to nothing
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_definition_of_imported_function(analyze, write_program, tmp_path, cached):
+    tone = write_program(TONE, "lib/tone.imagelang")
+    if cached:
+        loader().load(str(tone))   # the analysis below reads the .imli
+    _, analyzer = analyze(PROGRAM, loader=loader())
+    fn = analyzer.definition_of(5, 12)
+    assert (fn.name, fn.line, fn.column) == ("clamp01", 1, 6)
+    assert fn.path == str(tone)
+
+
+def test_moved_module_interface_is_rebuilt(write_program, tmp_path):
+    tone = write_program(TONE, "lib/tone.imagelang")
+    loader().load(str(tone))
+    moved = tmp_path / "moved"
+    (tmp_path / "lib").rename(moved)
+    iface = loader().load(str(moved / "tone.imagelang"))
+    assert iface.functions[0].path == str(moved / "tone.imagelang")
+
+
+def test_diagnostics_in(analyze):
+    _, analyzer = analyze("""{
+    int a = "x";
+    int b = 1;
+    undefined_call();
+    int c = 2;
+    string d = 3;
+}
+""")
+    assert [e["line"] for e in analyzer.errors] == [2, 4, 6]
+    assert [e["line"] for e in analyzer.diagnostics_in((1, 0), (99, 0))] == [2, 4, 6]
+    assert [e["line"] for e in analyzer.diagnostics_in((3, 0), (5, 0))] == [4]
+    assert [e["line"] for e in analyzer.diagnostics_in((4, 4), (6, 0))] == [4]
+    assert analyzer.diagnostics_in((4, 5), (6, 0)) == []
+    assert analyzer.diagnostics_in((5, 0), (5, 0)) == []
+
+
+# SemanticIndex over synthetic tokens, without the parser
+
+def token(index, line, column, text, type=1):
+    t = CommonToken(type=type)
+    t.tokenIndex, t.line, t.column, t.text = index, line, column, text
+    return t
+
+
+@pytest.fixture
+def index():
+    # "int count = n + 1;" on line 2, "write(count);" on line 3, then EOF
+    words = [(2, 4, "int"), (2, 8, "count"), (2, 14, "="), (2, 16, "n"), (2, 18, "+"), (2, 20, "1"), (2, 21, ";"),
+             (3, 4, "write"), (3, 9, "("), (3, 10, "count"), (3, 15, ")"), (3, 16, ";")]
+    tokens = [token(i, *w) for i, w in enumerate(words)] + [token(len(words), 3, 17, "<EOF>", Token.EOF)]
+    return SemanticIndex(SimpleNamespace(tokens=tokens))
+
+
+def expr(index, first, last):
+    ctx = ParserRuleContext()
+    ctx.start, ctx.stop = (index.tokens[first], index.tokens[last]) if first is not None else (None, None)
+    return ctx
+
+
+def test_token_at(index):
+    assert len(index.tokens) == 12                 # EOF is dropped
+    assert index.token_at(2, 8) == 1
+    assert index.token_at(2, 12) == 1              # last character of count
+    assert index.token_at(2, 13) is None           # space after it
+    assert index.token_at(2, 3) is None            # indentation before the first token
+    assert index.token_at(1, 0) is None
+    assert index.token_at(3, 16) == 11
+    assert index.token_at(3, 17) is None           # where EOF was
+    assert index.token_at(4, 0) is None
+
+
+def test_innermost_expression_types_win(index):
+    inner, outer = expr(index, 5, 5), expr(index, 3, 5)
+    index.add_type(inner, INT)
+    index.add_type(outer, FLOAT)
+    assert index.expression_types == {inner: INT, outer: FLOAT}
+    assert [index.type_at(2, c) for c in (16, 18, 20)] == [FLOAT, FLOAT, INT]
+    assert index.type_at(2, 4) is None
+    index.add_type(expr(index, None, None), STRING)
+    assert index.type_at(2, 16) == FLOAT
+
+
+def test_definition_of(index):
+    var = VarSymbol("count", INT, False, 2, 8)
+    write = FuncSymbol("write", None, [])
+    index.add_symbol(index.tokens[1], var)
+    index.add_symbol(index.tokens[9], var)
+    index.add_symbol(index.tokens[7], write)
+    index.add_symbol(token(99, 9, 0, "x"), var)    # out of range, ignored
+    assert index.definition_of(2, 10) is var
+    assert index.definition_of(3, 12) is var
+    assert index.definition_of(3, 4) is write
+    assert index.definition_of(2, 16) is None
+
+
+def test_diagnostics_in_is_half_open_and_sorted(index):
+    errors = [{"line": 3, "column": 4, "message": "c"}, {"line": 2, "column": 16, "message": "b"},
+              {"line": 2, "column": 4, "message": "a"}]
+    index.set_diagnostics(errors)
+    assert [e["message"] for e in index.diagnostics_in((1, 0), (9, 0))] == ["a", "b", "c"]
+    assert [e["message"] for e in index.diagnostics_in((2, 4), (2, 16))] == ["a"]
+    assert [e["message"] for e in index.diagnostics_in((2, 5), (3, 5))] == ["b", "c"]
+    assert index.diagnostics_in((3, 5), (9, 0)) == []
+    assert index.diagnostics_in((2, 4), (2, 4)) == []
+
+
+def test_index_without_tokens():
+    index = SemanticIndex(None)
+    assert index.type_at(1, 0) is None and index.definition_of(1, 0) is None
+    assert index.diagnostics_in((1, 0), (9, 0)) == []
@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+
+from modules import ModuleLoader, ModuleError, ModuleInterface, interface_path
+from semantics.symbols import FuncSymbol, VarSymbol
+from semantics.types import FLOAT, IMAGE
+
+
+class StubLoader(ModuleLoader):
+    """Builds interfaces without the parser. A stub module is whitespace-separated words:
+    `import:<path>` imports a module, any other word declares a function of that name."""
+
+    def __init__(self, options=None):
+        super().__init__(self.parse, options)
+        self.built = []
+
+    @staticmethod
+    def parse(text):
+        raise AssertionError("modules are built by the stub, never parsed")
+
+    def build(self, path, source):
+        self.built.append(os.path.basename(path))
+        words = source.decode("utf-8").split()
+        deps = [self.load(os.path.join(os.path.dirname(path), w[len("import:"):])) for w in words if w.startswith("import:")]
+        names = [w for w in words if not w.startswith("import:")]
+        functions = [FuncSymbol(n, IMAGE, [VarSymbol("img", IMAGE, True, line, 10), VarSymbol("v", FLOAT, False, line, 25)],
+                                False, line, 6, path) for line, n in enumerate(names, 1)]
+        iface = ModuleInterface(path, self.digest(source, deps), functions, [d.path for d in deps],
+                                [f".method static object {n}() cil managed {{ }}" for n in names])
+        self.write_cached(iface)
+        return iface
+
+
+@pytest.fixture
+def lib(write_program):
+    write_program("clamp01", "lib/tone.imagelang")
+    write_program("noise", "lib/grain.imagelang")
+    return write_program("import:tone.imagelang import:grain.imagelang soften", "lib/filters.imagelang")
+
+
+def test_interface_is_read_back_from_the_cache(lib):
+    first = StubLoader().load(str(lib))
+    loader = StubLoader()
+    again = loader.load(str(lib))
+    assert loader.built == []
+    assert again == first
+    fn = again.functions[0]
+    assert (fn.name, fn.ret_type, fn.line, fn.column, fn.path) == ("soften", IMAGE, 1, 6, str(lib))
+    assert [(p.name, p.type, p.by_ref) for p in fn.params] == [("img", IMAGE, True), ("v", FLOAT, False)]
+
+
+def test_changed_dependency_rebuilds_it_and_its_importers(lib, tmp_path):
+    before = StubLoader().load(str(lib))
+    (tmp_path / "lib" / "tone.imagelang").write_text("clamp01 gain", encoding="utf-8")
+    loader = StubLoader()
+    after = loader.load(str(lib))
+    assert sorted(loader.built) == ["filters.imagelang", "tone.imagelang"]
+    assert after.digest != before.digest
+
+
+@pytest.mark.parametrize("option", [{"prefetch": False}, {"background_saves": False}, {"inline_threshold": 0}])
+def test_changed_options_rebuild(lib, option):
+    StubLoader().load(str(lib))
+    loader = StubLoader(option)
+    loader.load(str(lib))
+    assert sorted(loader.built) == ["filters.imagelang", "grain.imagelang", "tone.imagelang"]
+    again = StubLoader(option)
+    again.load(str(lib))
+    assert again.built == []
+
+
+@pytest.mark.parametrize("edit", [
+    lambda data: data.update(version=data["version"] - 1),
+    lambda data: data.update(digest="0" * 64),
+    lambda data: data.pop("il"),
+    lambda data: data.update(path="/elsewhere/filters.imagelang"),
+], ids=["version", "digest", "missing-key", "other-path"])
+def test_stale_or_damaged_interface_is_rebuilt(lib, edit):
+    StubLoader().load(str(lib))
+    path = interface_path(str(lib))
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    edit(data)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    loader = StubLoader()
+    loader.load(str(lib))
+    assert loader.built == ["filters.imagelang"]
+
+
+def test_unreadable_interface_is_rebuilt(lib):
+    StubLoader().load(str(lib))
+    with open(interface_path(str(lib)), "w", encoding="utf-8") as f:
+        f.write("{ not json")
+    loader = StubLoader()
+    loader.load(str(lib))
+    assert loader.built == ["filters.imagelang"]
+
+
+def test_moved_module_is_rebuilt(lib, tmp_path):
+    StubLoader().load(str(lib))
+    (tmp_path / "lib").rename(tmp_path / "moved")
+    loader = StubLoader()
+    iface = loader.load(str(tmp_path / "moved" / "filters.imagelang"))
+    assert sorted(loader.built) == ["filters.imagelang", "grain.imagelang", "tone.imagelang"]
+    assert iface.functions[0].path == str(tmp_path / "moved" / "filters.imagelang")
+
+
+def test_closure_lists_dependencies_first_and_once(lib, write_program):
+    app = write_program("import:lib/filters.imagelang import:lib/tone.imagelang main_helper", "app.imagelang")
+    loader = StubLoader()
+    iface = loader.load(str(app))
+    order = [os.path.basename(i.path) for i in loader.closure([iface])]
+    assert order == ["tone.imagelang", "grain.imagelang", "filters.imagelang", "app.imagelang"]
+
+
+def test_import_cycle(write_program):
+    write_program("import:b.imagelang f", "a.imagelang")
+    b = write_program("import:a.imagelang g", "b.imagelang")
+    with pytest.raises(ModuleError, match="Import cycle: b.imagelang -> a.imagelang -> b.imagelang"):
+        StubLoader().load(str(b))
+
+
+def test_missing_module(write_program, tmp_path):
+    with pytest.raises(ModuleError, match="Module not found: .*nope.imagelang"):
+        StubLoader().load(str(tmp_path / "nope.imagelang"))
+    app = write_program("import:nope.imagelang f", "app.imagelang")
+    with pytest.raises(ModuleError, match="Module not found"):
+        StubLoader().load(str(app))
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+pytest.importorskip("ImageLangParser", reason="the ANTLR parser has not been generated")
+
+from modules import ModuleLoader, ModuleError, interface_path
+from runner import parse_text
+
+TONE = """float clamp01(float v) {
+    if v < 0.0 then { return 0.0; }
+    if v > 1.0 then { return 1.0; }
+    return v;
+}
+"""
+
+FILTERS = """import "tone.imagelang";
+
+image soften(image& img, float amount) {
+    img = blur(img, 2.0 * clamp01(amount));
+    return img;
+}
+"""
+
+
+@pytest.fixture
+def lib(write_program):
+    write_program(TONE, "lib/tone.imagelang")
+    return write_program(FILTERS, "lib/filters.imagelang")
+
+
+class CountingLoader(ModuleLoader):
+    def __init__(self, options=None):
+        super().__init__(parse_text, options)
+        self.built = []
+
+    def build(self, path, source):
+        self.built.append(path.replace("\\", "/").rsplit("/", 1)[-1])
+        return super().build(path, source)
+
+
+def test_interface_is_cached(lib):
+    first = CountingLoader().load(str(lib))
+    loader = CountingLoader()
+    again = loader.load(str(lib))
+    assert loader.built == []
+    assert again.digest == first.digest
+    assert [fn.name for fn in again.functions] == ["soften"]
+    assert [p.by_ref for p in again.functions[0].params] == [True, False]
+
+
+def test_changed_dependency_rebuilds_importers(lib, tmp_path):
+    before = CountingLoader().load(str(lib))
+    (tmp_path / "lib" / "tone.imagelang").write_text(TONE + "// edited\n", encoding="utf-8")
+    loader = CountingLoader()
+    after = loader.load(str(lib))
+    assert sorted(loader.built) == ["filters.imagelang", "tone.imagelang"]
+    assert after.digest != before.digest
+
+
+@pytest.mark.parametrize("option", [{"prefetch": False}, {"background_saves": False}, {"inline_threshold": 0}])
+def test_changed_options_rebuild(lib, option):
+    CountingLoader().load(str(lib))
+    loader = CountingLoader(option)
+    loader.load(str(lib))
+    assert sorted(loader.built) == ["filters.imagelang", "tone.imagelang"]
+
+
+def test_stale_interface_version_is_ignored(lib):
+    CountingLoader().load(str(lib))
+    path = interface_path(str(lib))
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["version"] -= 1
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    loader = CountingLoader()
+    loader.load(str(lib))
+    assert loader.built == ["filters.imagelang"]
+
+
+def test_runner_options_reach_the_cache(run_runner, write_program, lib):
+    main = write_program('import "lib/filters.imagelang";\n{\n    image img = image(2, 2);\n    soften(img, 0.5);\n}')
+    run_runner(main, "--output", "a.il")
+    with open(interface_path(str(lib)), encoding="utf-8") as f:
+        default = json.load(f)["digest"]
+    _, out = run_runner(main, "--output", "b.il", "--no-prefetch", "--sync-saves")
+    assert "Compilation successful" in out
+    with open(interface_path(str(lib)), encoding="utf-8") as f:
+        assert json.load(f)["digest"] != default
+
+
+def errors_of(analyze, source):
+    _, analyzer = analyze(source, loader=ModuleLoader(parse_text))
+    return [e["message"] for e in analyzer.errors]
+
+
+def test_import_cycle(analyze, write_program):
+    write_program('import "b.imagelang";\n', "lib/a.imagelang")
+    write_program('import "a.imagelang";\n', "lib/b.imagelang")
+    errors = errors_of(analyze, 'import "lib/a.imagelang";\n{ write("x"); }')
+    assert len(errors) == 1
+    assert "Import cycle: a.imagelang -> b.imagelang -> a.imagelang" in errors[0]
+
+
+def test_local_function_clashes_with_indirect_import(analyze, lib):
+    errors = errors_of(analyze, 'import "lib/filters.imagelang";\nfloat clamp01(float v) { return v; }\n{ write("x"); }')
+    assert errors == ["Function 'clamp01' is already defined in imported module 'tone.imagelang'"]
+
+
+def test_same_function_in_two_modules(analyze, write_program):
+    write_program("int twice(int v) { return v * 2; }\n", "x.imagelang")
+    write_program("int twice(int v) { return v + v; }\n", "y.imagelang")
+    errors = errors_of(analyze, 'import "x.imagelang";\nimport "y.imagelang";\n{ write("x"); }')
+    assert errors == ["Function 'twice' is defined in both 'x.imagelang' and 'y.imagelang'"]
+
+
+def test_importing_a_program_with_main_block(analyze, write_program):
+    write_program('{ write("hi"); }', "script.imagelang")
+    errors = errors_of(analyze, 'import "script.imagelang";\n{ write("x"); }')
+    assert len(errors) == 1
+    assert "Module 'script.imagelang' has a main block" in errors[0]
+
+
+def test_missing_module(analyze):
+    errors = errors_of(analyze, 'import "nope.imagelang";\n{ write("x"); }')
+    assert len(errors) == 1 and errors[0].startswith("Module not found: ")
+
+
+def test_errors_in_module_are_reported_at_the_import(analyze, write_program):
+    path = write_program('int broken() { return "s"; }\n', "broken.imagelang")
+    with pytest.raises(ModuleError, match="Errors in module 'broken.imagelang'"):
+        ModuleLoader(parse_text).load(str(path))
+    assert len(errors_of(analyze, 'import "broken.imagelang";\n{ write("x"); }')) == 1
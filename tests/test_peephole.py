@@ -0,0 +1,94 @@
+from collections import Counter
+
+import pytest
+
+from codegen.il import Directive, Instr, Label
+from codegen.peephole import optimize
+
+INT = "[mscorlib]System.Int32"
+
+
+def run(*items):
+    stats = Counter()
+    return optimize([Instr.parse(i) if isinstance(i, str) else i for i in items], stats), stats
+
+
+def test_box_unbox_pair_is_removed():
+    out, stats = run("ldloc 4", f"box {INT}", f"unbox.any {INT}", "stloc 5")
+    assert out == [Instr("ldloc.s", "4"), Instr("stloc.s", "5")]
+    assert stats["box/unbox.any"] == 1
+
+
+def test_box_unbox_of_different_types_is_kept():
+    out, stats = run(f"box {INT}", "unbox.any float64")
+    assert out == [Instr("box", INT), Instr("unbox.any", "float64")]
+    assert stats["box/unbox.any"] == 0
+
+
+def test_store_then_load_becomes_dup():
+    out, stats = run("stloc 7", "ldloc 7")
+    assert out == [Instr("dup"), Instr("stloc.s", "7")]
+    assert stats["stloc/ldloc"] == 1
+
+
+def test_store_then_load_of_another_local_is_kept():
+    out, stats = run("stloc 7", "ldloc 8")
+    assert out == [Instr("stloc.s", "7"), Instr("ldloc.s", "8")]
+    assert stats["stloc/ldloc"] == 0
+
+
+@pytest.mark.parametrize("barrier", [Label("L1"), Directive("} // end .try")], ids=["label", "directive"])
+def test_store_and_load_across_a_barrier_are_kept(barrier):
+    # Control can reach the ldloc from elsewhere, so it cannot be replaced by a dup before the barrier
+    out, stats = run("stloc 7", barrier, "ldloc 7")
+    assert out == [Instr("stloc.s", "7"), barrier, Instr("ldloc.s", "7")]
+    assert stats["stloc/ldloc"] == 0
+
+
+def test_branch_to_next_label_is_removed():
+    out, stats = run("br L1", Label("L1"), "ret")
+    assert out == [Label("L1"), Instr("ret")]
+    assert stats["br-next"] == 1
+
+
+def test_branch_to_another_label_is_kept():
+    out, stats = run("br L2", Label("L1"), "ret", Label("L2"), "ret")
+    assert out == [Instr("br", "L2"), Label("L1"), Instr("ret"), Label("L2"), Instr("ret")]
+    assert stats["br-next"] == 0
+
+
+def test_conditional_branch_to_next_label_is_kept():
+    out, _ = run("brtrue L1", Label("L1"))
+    assert out == [Instr("brtrue", "L1"), Label("L1")]
+
+
+def test_rewrites_repeat_until_nothing_changes():
+    # Dropping the box/unbox pair brings stloc and ldloc together
+    out, stats = run("stloc 9", f"box {INT}", f"unbox.any {INT}", "ldloc 9")
+    assert out == [Instr("dup"), Instr("stloc.s", "9")]
+    assert stats["box/unbox.any"] == 1 and stats["stloc/ldloc"] == 1
+
+
+@pytest.mark.parametrize("instr, short", [
+    ("ldc.i4 -1", Instr("ldc.i4.m1")),
+    ("ldc.i4 0", Instr("ldc.i4.0")),
+    ("ldc.i4 8", Instr("ldc.i4.8")),
+    ("ldc.i4 9", Instr("ldc.i4.s", "9")),
+    ("ldc.i4 -128", Instr("ldc.i4.s", "-128")),
+    ("ldc.i4 127", Instr("ldc.i4.s", "127")),
+    ("ldc.i4 128", Instr("ldc.i4", "128")),
+    ("ldloc 3", Instr("ldloc.3")),
+    ("stloc 0", Instr("stloc.0")),
+    ("ldarg 2", Instr("ldarg.2")),
+    ("ldloc 4", Instr("ldloc.s", "4")),
+    ("starg 1", Instr("starg.s", "1")),
+    ("ldloca 0", Instr("ldloca.s", "0")),
+    ("ldarga 255", Instr("ldarga.s", "255")),
+    ("ldloc 256", Instr("ldloc", "256")),
+    ("ldstr \"7\"", Instr("ldstr", "\"7\"")),
+    ("ret", Instr("ret")),
+])
+def test_short_forms(instr, short):
+    out, stats = run(instr)
+    assert out == [short]
+    assert stats["short-form"] == (short != Instr.parse(instr))
@@ -0,0 +1,214 @@
+import math
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import valid_programs
+from pyruntime import ops, rawio, stdlib
+from pyruntime.values import Image, Color, INT32_MIN, to_text
+
+
+def random_image(h, w, seed=0):
+    data = np.random.default_rng(seed).integers(0, 256, size=(h, w, 4), dtype=np.uint8)
+    data[..., 3] = 255
+    return Image(data)
+
+
+@pytest.mark.parametrize("path", valid_programs(), ids=os.path.basename)
+def test_valid_programs_run(run_runner, path):
+    code, out = run_runner(path, "--run")
+    assert code == 0, out
+    assert out.startswith("Verification OK. Running...")
+    assert "Unhandled Exception" not in out
+
+
+def test_run_images_end_to_end(run_runner, write_program, tmp_path):
+    path = write_program("""{
+    image a = image(6, 4);
+    save(a, "a.ppm");
+    image b = load("a.ppm");
+    image d = b * 2.0;
+    image c = blur(d - pow_channels(b, 2.0), 1);
+    write("w=" + (string)width(c) + " h=" + (string)height(c));
+    write((string)avg(c));
+}""")
+    code, out = run_runner(path, "--run")
+    assert code == 0, out
+    assert out.splitlines()[1:] == ["w=6 h=4", "0"]
+    assert (tmp_path / "a.ppm").exists()
+
+
+# Ops semantics shared with the .NET runtime
+
+def test_int_arithmetic_wraps_through_double():
+    assert ops.Add(2**31 - 1, 1) == INT32_MIN
+    assert ops.Mul(65536, 65536) == INT32_MIN
+    assert ops.Sub(INT32_MIN, 1) == INT32_MIN
+    assert ops.Div(7, 2) == 3
+    assert ops.Div(-7, 2) == -3
+    assert ops.Div(1, 0) == INT32_MIN
+    assert ops.Neg(INT32_MIN) == INT32_MIN
+
+
+def test_float_arithmetic():
+    assert ops.Div(1.0, 0) == math.inf
+    assert ops.Div(-1.0, 0) == -math.inf
+    assert math.isnan(ops.Div(0.0, 0))
+    assert ops.Add(1, 0.5) == 1.5
+    assert ops.Mod(-7, 3) == -1
+
+
+def test_double_formatting():
+    assert to_text(0.1 + 0.2) == "0.3"
+    assert to_text(2.0) == "2"
+    assert to_text(1e16) == "1E+16"
+    assert to_text(1.5e-7) == "1.5E-07"
+    assert to_text(math.nan) == "NaN"
+    assert to_text(-math.inf) == "-Infinity"
+    assert to_text(True) == "True"
+    assert to_text(None) == ""
+    assert ops.Add("x=", 2.5) == "x=2.5"
+
+
+def test_boxed_equality_compares_runtime_types():
+    assert ops.Eq(1, 1)
+    assert not ops.Eq(1, 1.0)
+    assert not ops.Eq(1, True)
+    assert ops.Eq(None, None)
+    assert not ops.Eq(None, 0)
+    assert ops.Eq(math.nan, math.nan)
+    assert ops.Eq(Color(1, 2, 3), Color(1, 2, 3))
+    img = random_image(2, 2)
+    assert ops.Eq(img, img)
+    assert not ops.Eq(img, img.clone())
+
+
+def test_casts():
+    assert ops.CastInt("42") == 42
+    assert ops.CastInt(2.5) == 2
+    assert ops.CastInt(3.5) == 4
+    assert ops.CastString(3.0) == "3"
+    with pytest.raises(TypeError):
+        ops.And(1, True)
+    with pytest.raises(OverflowError):
+        ops.CastInt(1e10)
+
+
+# Kernels
+
+def naive_box_blur(data, r):
+    h, w = data.shape[:2]
+    out = np.empty_like(data)
+    for y in range(h):
+        for x in range(w):
+            window = data[max(0, y - r):y + r + 1, max(0, x - r):x + r + 1, :3].astype(np.int64)
+            out[y, x, :3] = window.sum(axis=(0, 1)) // (window.shape[0] * window.shape[1])
+    out[..., 3] = 255
+    return out
+
+
+@pytest.mark.parametrize("radius", [1, 2, 5])
+def test_blur_matches_window_mean(radius):
+    img = random_image(7, 9, seed=radius)
+    assert np.array_equal(stdlib.blur(img, radius).data, naive_box_blur(img.data, radius))
+
+
+def test_blur_rounds_radius_up_and_copies_when_zero():
+    img = random_image(5, 5)
+    assert np.array_equal(stdlib.blur(img, 0.2).data, naive_box_blur(img.data, 1))
+    same = stdlib.blur(img, 0)
+    assert same is not img and np.array_equal(same.data, img.data)
+    assert stdlib.gauss_blur(img, 0).data is not img.data
+
+
+def test_gauss_blur_is_box_passes():
+    img = random_image(12, 10)
+    # sigma 2 gives box widths 3, 3, 5; for sigma 1 the first two have radius 0 and are skipped
+    expected = naive_box_blur(naive_box_blur(naive_box_blur(img.data, 1), 1), 2)
+    assert np.array_equal(stdlib.gauss_blur(img, 2.0).data, expected)
+    assert np.array_equal(stdlib.gauss_blur(img, 1.0).data, naive_box_blur(img.data, 1))
+
+
+def test_combine_saturates_and_takes_common_region():
+    a = Image(np.full((3, 4, 4), 200, dtype=np.uint8))
+    b = Image(np.full((2, 5, 4), 100, dtype=np.uint8))
+    added = stdlib.add_images(a, b).data
+    assert added.shape == (2, 4, 4)
+    assert (added[..., :3] == 255).all() and (added[..., 3] == 255).all()
+    assert (stdlib.sub_images(b, a).data[..., :3] == 100).all()
+    assert stdlib.add_images(None, b) is b
+
+
+def test_lut_kernels():
+    img = random_image(4, 4)
+    c = img.data[..., :3].astype(np.float64)
+    assert np.array_equal(stdlib.mul_image_scalar(img, 1.5).data[..., :3], np.clip(np.trunc(c * 1.5), 0, 255))
+    gamma = stdlib.pow_channels(img, 2.0).data[..., :3]
+    assert np.array_equal(gamma, np.trunc(255 * (c / 255.0) ** 2))
+    assert (stdlib.mul_image_scalar(img, -1).data[..., :3] == 0).all()
+
+
+def test_avg_and_regions():
+    data = np.zeros((2, 2, 4), dtype=np.uint8)
+    data[0, 0, :3] = (30, 60, 90)
+    img = Image(data)
+    assert stdlib.avg(img) == 15.0
+    assert stdlib.avg_region(img, -5, -5, 6, 6) == 60.0
+    assert stdlib.avg_region(img, 5, 5, 1, 1) == 0.0
+    assert stdlib.avg(None) == 0.0
+
+
+def test_get_pixel_reads_rgb_and_checks_bounds():
+    data = np.zeros((2, 3, 4), dtype=np.uint8)
+    data[1, 2, :3] = (3, 2, 1)
+    img = Image(data)
+    assert stdlib.get_pixel(img, 2, 1) == Color(1, 2, 3)
+    with pytest.raises(IndexError, match="Parameter name: x"):
+        stdlib.get_pixel(img, 3, 0)
+
+
+@pytest.mark.parametrize("ext", [".ppm", ".ilraw"])
+def test_raw_formats_round_trip(tmp_path, ext):
+    img = random_image(5, 7)
+    path = str(tmp_path / ("img" + ext))
+    rawio.save(img.data, path)
+    assert np.array_equal(rawio.load(path), img.data)
+
+
+def test_pgm_stores_gray(tmp_path):
+    img = random_image(3, 3)
+    path = str(tmp_path / "img.pgm")
+    rawio.save(img.data, path)
+    loaded = rawio.load(path)
+    assert np.array_equal(loaded[..., 0], rawio.gray(img.data))
+
+
+def write_raw_header(path, w, h, payload=b""):
+    path.write_bytes(rawio.RAW_MAGIC + np.array([w, h], dtype="<i4").tobytes() + payload)
+    return str(path)
+
+
+def test_raw_size_does_not_wrap_int32(tmp_path):
+    # 40000 x 20000 x 4 wraps to a negative int32; the file is far too short and must say so
+    path = write_raw_header(tmp_path / "huge.ilraw", 40000, 20000, bytes(64))
+    with pytest.raises(ValueError, match="Truncated ILRAW data: expected 3200000016 bytes"):
+        rawio.load(path)
+
+
+def test_raw_rejects_bad_headers(tmp_path):
+    with pytest.raises(ValueError, match="Invalid ILRAW dimensions -1x2"):
+        rawio.load(write_raw_header(tmp_path / "neg.ilraw", -1, 2))
+    with pytest.raises(ValueError, match="Truncated ILRAW data"):
+        rawio.load(write_raw_header(tmp_path / "short.ilraw", 2, 2, bytes(15)))
+    (tmp_path / "header.ilraw").write_bytes(rawio.RAW_MAGIC + b"\1")
+    with pytest.raises(ValueError, match="Truncated ILRAW header"):
+        rawio.load(str(tmp_path / "header.ilraw"))
+    assert stdlib.load(str(tmp_path / "short.ilraw")) is None
+
+
+def test_netpbm_rejects_truncated_data(tmp_path):
+    (tmp_path / "short.ppm").write_bytes(b"P6\n2 2\n255\n" + bytes(11))
+    with pytest.raises(ValueError, match="Truncated PPM/PGM data"):
+        rawio.load(str(tmp_path / "short.ppm"))
@@ -0,0 +1,38 @@
+import gzip
+
+import pytest
+
+from codegen.sinks import open_sink
+
+
+@pytest.mark.parametrize("name", ["out.il", "out.il.gz"])
+def test_output_appears_on_clean_close(tmp_path, name):
+    path = tmp_path / name
+    with open_sink(str(path)) as sink:
+        sink.write_lines([".assembly a {}", "ret"])
+        assert not path.exists()
+    text = gzip.open(path, "rt").read() if name.endswith(".gz") else path.read_text()
+    assert text == ".assembly a {}\nret"
+    assert [p.name for p in tmp_path.iterdir()] == [name]
+
+
+@pytest.mark.parametrize("name", ["out.il", "out.il.gz"])
+def test_failed_compilation_keeps_previous_output(tmp_path, name):
+    path = tmp_path / name
+    with open_sink(str(path)) as sink:
+        sink.write_lines(["previous"])
+    before = path.read_bytes()
+    with pytest.raises(RuntimeError):
+        with open_sink(str(path)) as sink:
+            sink.write_lines(["partial"])
+            raise RuntimeError("internal error")
+    assert path.read_bytes() == before
+    assert [p.name for p in tmp_path.iterdir()] == [name]
+
+
+def test_failed_compilation_leaves_no_file(tmp_path):
+    with pytest.raises(RuntimeError):
+        with open_sink(str(tmp_path / "out.il")) as sink:
+            sink.write_lines(["partial"])
+            raise RuntimeError("internal error")
+    assert list(tmp_path.iterdir()) == []
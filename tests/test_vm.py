@@ -0,0 +1,218 @@
+import io
+import os
+from array import array
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from conftest import valid_programs
+from codegen.ilbc import (Function, Program, dump, load, disassemble, VERSION, BUILTIN_INDEX,
+                          LOADK, ADD_I, RET, RETN, CALL, CAST_S, BUILTIN, TRY, ENDTRY, THROW, CATCH, JMP)
+
+OPS_PROGRAM = """
+int fact(int n) {
+    if n < 2 then { return 1; }
+    return n * fact(n - 1);
+}
+
+int bump(int& x, int by) {
+    x = x + by;
+    return x;
+}
+
+float half(float v) {
+    return v / 2;
+}
+
+string risky(int n) {
+    if n > 2 then { throw ValueError("too big: " + (string)n); }
+    return "fine";
+}
+
+{
+    int i = 0;
+    int sum = 0;
+    while i < 10 do {
+        sum = sum + i;
+        i = i + 1;
+    }
+    write((string)sum);
+    write((string)fact(10));
+    int n = 5;
+    bump(n, 3);
+    bump(n, n);
+    write((string)n);
+    float f = 1;
+    f = f * 1.5 - 0.25;
+    write((string)f);
+    write((string)half(3));
+    bool ok = (not (i > 3)) or ((sum == 45) and true);
+    write((string)ok);
+    string s = "a" + "b";
+    write(s + (string)(7 / 2) + (string)(-7 / 2));
+    color c = color(10, 20, 30);
+    write((string)c.g);
+    int big = 2147483647;
+    big = big + 1;
+    write((string)big);
+    for int k = 2; k < 5; k = k + 1 do {
+        try {
+            write(risky(k));
+        } except ValueError e {
+            write("caught " + e);
+        }
+    }
+    try {
+        throw Exception("outer");
+    } except Exception e {
+        write("caught " + e);
+    }
+    write((string)(0.1 + 0.2));
+}
+"""
+
+OPS_OUTPUT = ["45", "3628800", "16", "1.25", "1.5", "True", "ab3-3", "20", "-2147483648",
+              "fine", "caught too big: 3", "caught too big: 4", "caught outer", "0.3"]
+
+
+@pytest.mark.parametrize("path", valid_programs(), ids=os.path.basename)
+def test_vm_matches_in_process_backend(run_runner, path):
+    vm_code, vm_out = run_runner(path, "--vm")
+    run_code, run_out = run_runner(path, "--run")
+    assert vm_code == run_code == 0
+    assert vm_out == run_out
+
+
+@pytest.mark.parametrize("backend", ["--vm", "--run"])
+def test_operations(run_runner, write_program, backend):
+    code, out = run_runner(write_program(OPS_PROGRAM), backend)
+    assert code == 0, out
+    assert out.splitlines()[1:] == OPS_OUTPUT
+
+
+@pytest.mark.parametrize("backend", ["--vm", "--run"])
+def test_unhandled_throw(run_runner, write_program, backend):
+    path = write_program('{\n    write("before");\n    throw IOError("disk");\n    write("after");\n}')
+    code, out = run_runner(path, backend)
+    assert code == 1
+    assert out.splitlines()[1:] == ["before", "Unhandled Exception: disk"]
+
+
+def test_typed_and_generic_opcodes(analyze):
+    from codegen.bytecode import BytecodeCompiler, OPNAMES, MAIN
+    tree, analyzer = analyze(OPS_PROGRAM)
+    assert not analyzer.errors
+    program = BytecodeCompiler().compile(tree)
+    ops = {f.name: {OPNAMES[f.code[i]] for i in range(0, len(f.code), 4)} for f in program.functions}
+
+    assert {"LT_N", "SUB_I", "CALL"} <= ops["fact"]
+    assert "ADD_I" in ops["bump"]
+    assert {"MUL_F", "SUB_F", "OR_B", "AND_B", "NOT_B", "EQ_I", "TRY", "CATCH", "BUILTIN", "CAST_S", "FIELD"} <= ops[MAIN]
+    assert "THROW" in ops["risky"]
+    # Call results, strings and division have no typed opcodes and follow Ops through the generic ones
+    assert "MUL" in ops["fact"] and "MUL_I" not in ops["fact"]
+    assert {"ADD", "DIV"} <= ops[MAIN]
+    assert "DIV" in ops["half"]
+
+    refs = {f.name: f.refs for f in program.functions}
+    assert refs["bump"] == [0]
+    assert refs["fact"] == []
+
+
+def test_bytecode_round_trip(run_runner, write_program, tmp_path, analyze):
+    from codegen.bytecode import BytecodeCompiler, dump, load
+    tree, _ = analyze(OPS_PROGRAM)
+    program = BytecodeCompiler().compile(tree)
+    buf = io.BytesIO()
+    dump(program, buf)
+    buf.seek(0)
+    assert load(buf) == program
+
+    code, out = run_runner(write_program(OPS_PROGRAM), "--bytecode", "ops.ilbc")
+    assert code == 0, out
+    code, out = run_runner(tmp_path / "ops.ilbc")
+    assert code is None or code == 0
+    assert out.splitlines() == OPS_OUTPUT
+
+
+def test_bytecode_version_check(run_runner, write_program, tmp_path):
+    from codegen.bytecode import VERSION
+    run_runner(write_program(OPS_PROGRAM), "--bytecode", "ops.ilbc")
+    data = bytearray((tmp_path / "ops.ilbc").read_bytes())
+
+    newer = data.copy()
+    newer[4:6] = (VERSION + 1).to_bytes(2, "little")
+    (tmp_path / "newer.ilbc").write_bytes(newer)
+    code, out = run_runner(tmp_path / "newer.ilbc")
+    assert code == 1
+    assert f"Unsupported bytecode version {VERSION + 1}, expected {VERSION}" in out
+
+    (tmp_path / "bad.ilbc").write_bytes(b"XXXX" + data[4:])
+    assert "Not an ImageLang bytecode file" in run_runner(tmp_path / "bad.ilbc")[1]
+
+    (tmp_path / "short.ilbc").write_bytes(data[:len(data) // 2])
+    code, out = run_runner(tmp_path / "short.ilbc")
+    assert code == 1 and "Cannot load bytecode" in out
+
+
+# Hand-assembled programs: the .ilbc format and the VM run without the parser
+
+def hand_program():
+    write = BUILTIN_INDEX["write"]
+    bump = Function("bump", 1, [0], "ii", array("i", [
+        LOADK, 1, 0, 0,         # r1 = 1
+        ADD_I, 0, 0, 1,         # x = x + r1
+        RET, 0, 0, 0,
+    ]))
+    main = Function("_main", 0, [], "iso", array("i", [
+        LOADK, 0, 1, 0,         # r0 = 41
+        CALL, 2, 0, 0,          # bump(r0), written back to r0
+        CAST_S, 1, 0, 0,
+        BUILTIN, 2, write, 1,   # write(r1)
+        TRY, 0, 10, 0,
+        LOADK, 1, 2, 0,
+        THROW, 1, 0, 0,
+        ENDTRY, 0, 0, 0,
+        JMP, 0, 12, 0,
+        CATCH, 1, 0, 0,         # handler: r1 = message
+        BUILTIN, 2, write, 1,
+        RETN, 0, 0, 0,
+        RETN, 0, 0, 0,
+    ]))
+    # Every constant kind, including text that is not ASCII
+    return Program([1, 41, "bоом ✓", None, True, 2.5, -2**40], [bump, main], 1)
+
+
+def dumped(program):
+    buf = io.BytesIO()
+    dump(program, buf)
+    return buf.getvalue()
+
+
+def test_hand_program_round_trips_and_runs(capsys):
+    from pyruntime.vm import VM
+    program = load(io.BytesIO(dumped(hand_program())))
+    assert program == hand_program()
+    VM(program).run()
+    assert capsys.readouterr().out.splitlines() == ["42", "bоом ✓"]
+
+
+def test_disassemble_names_constants_and_builtins():
+    listing = disassemble(hand_program())
+    assert "function 0 bump params=1 refs=[0] regs=ii" in listing
+    assert "LOADK    0 1 0  ; 41" in listing
+    assert "BUILTIN  2 0 1  ; write" in listing
+
+
+def test_load_checks_magic_version_and_length():
+    data = dumped(hand_program())
+    newer = bytearray(data)
+    newer[4:6] = (VERSION + 1).to_bytes(2, "little")
+    with pytest.raises(ValueError, match=f"Unsupported bytecode version {VERSION + 1}, expected {VERSION}"):
+        load(io.BytesIO(bytes(newer)))
+    with pytest.raises(ValueError, match="Not an ImageLang bytecode file"):
+        load(io.BytesIO(b"XXXX" + data[4:]))
+    for cut in range(len(data)):
+        with pytest.raises(ValueError, match="Truncated bytecode file"):
+            load(io.BytesIO(data[:cut]))